@@ -0,0 +1,707 @@
+"""
+Calibrations and Q0 measurements as explicit state machines. A measurement
+is a sequence of phases (fill, lock the JT valve, set the heater, record a
+run, restore) that each get kicked off with a handful of puts and then
+polled until they're done, so nothing ever sits in a sleep. An Acquisition
+walks one cryomodule through its phases, timing each one, and an
+AcquisitionLoop steps any number of acquisitions from a single thread,
+waking up whenever a monitored readback updates or a phase's poll interval
+runs out.
+
+Sequences are generators of phases (see the *_phases methods on
+Q0Cryomodule), so the code between phases runs right when the previous
+phase finishes and sees the state it left behind.
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+from lcls_tools.superconducting.sc_linac_utils import CavityAbortError
+from numpy import floor, sign
+
+import q0_utils
+from q0_epics import (
+    acquisition_thread,
+    camonitor,
+    camonitor_clear,
+    now,
+    turn_on_cavity,
+    wait_for,
+)
+
+if TYPE_CHECKING:
+    from q0_linac import Q0Cryomodule
+
+ACQ_QUEUED = "Queued"
+ACQ_RUNNING = "Running"
+ACQ_PAUSED = "Paused"
+ACQ_DONE = "Done"
+ACQ_ABORTED = "Aborted"
+ACQ_FAILED = "Failed"
+
+# Seconds between polls for things that don't have a monitor to wake us up
+HEATER_MODE_POLL_INTERVAL = 3
+JT_POLL_INTERVAL = 1
+CAVITY_POLL_INTERVAL = 5
+
+# For the few calls that can't help blocking (lcls_tools cavity ramps and
+# archiver searches), so they don't hold up the loop
+_background_calls = ThreadPoolExecutor(thread_name_prefix="q0-background")
+
+
+class Phase:
+    """
+    One step of an acquisition. start() kicks it off, poll() moves it along
+    and returns whether it's done and stop() cleans up after it, whether it
+    finished or got aborted. None of them may block, since every cryomodule
+    on the loop shares one thread: puts go through put_nowait and anything
+    slow (saving, fitting, archiver searches) goes in a BackgroundPhase.
+    is_ready() says whether poll() has anything to do yet; it gets checked
+    on every readback update with the loop's condition held, so it has to be
+    cheap, can't have side effects and can't wait on a PV connecting.
+    """
+
+    poll_interval: float = q0_utils.STATUS_INTERVAL
+
+    def __init__(self, cryomodule: "Q0Cryomodule", name: str):
+        self.cryomodule = cryomodule
+        self.name = name
+
+    def start(self):
+        pass
+
+    def is_ready(self) -> bool:
+        return True
+
+    def poll(self) -> bool:
+        return True
+
+    def stop(self):
+        pass
+
+    def status(self) -> str:
+        """Printed every STATUS_INTERVAL while waiting, unless it's empty"""
+        return f"{self.cryomodule} {self.name}"
+
+
+class ActionPhase(Phase):
+    """A phase that's done as soon as its action has been called"""
+
+    def __init__(self, cryomodule: "Q0Cryomodule", name: str, action: Callable):
+        super().__init__(cryomodule, name)
+        self.action = action
+
+    def start(self):
+        self.action()
+
+
+class SetHeaterPhase(Phase):
+    poll_interval = HEATER_MODE_POLL_INTERVAL
+
+    def __init__(self, cryomodule: "Q0Cryomodule", power: float):
+        super().__init__(cryomodule, f"Set heater to {power} W")
+        self.power = power
+
+    def is_ready(self) -> bool:
+        return self.cryomodule.heater_in_manual
+
+    def poll(self) -> bool:
+        if not self.cryomodule.heater_in_manual:
+            # Asked again every poll interval until the mode readback agrees
+            print(f"Setting {self.cryomodule} heaters to manual and waiting 3s")
+            self.cryomodule.put_nowait(self.cryomodule.heater_manual_pv, 1)
+            return False
+
+        self.cryomodule.put_nowait(self.cryomodule.heater_setpoint_pv, self.power)
+        print(f"set {self.cryomodule} heater power to {self.power} W")
+        return True
+
+
+class WaitForLLPhase(Phase):
+    def __init__(self, cryomodule: "Q0Cryomodule", desired_level: float):
+        super().__init__(cryomodule, f"Fill to {desired_level}%")
+        self.desired_level = desired_level
+
+    def start(self):
+        print(f"Waiting for downstream liquid level to be {self.desired_level}%")
+
+    def is_ready(self) -> bool:
+        return (self.desired_level - self.cryomodule.averaged_liquid_level) <= 0.01
+
+    def poll(self) -> bool:
+        if not self.is_ready():
+            return False
+        print("downstream liquid level at required value.")
+        return True
+
+    def status(self) -> str:
+        return f"Current averaged level is {self.cryomodule.averaged_liquid_level}"
+
+
+class FillPhase(WaitForLLPhase):
+    """
+    Puts the JT valve in auto to refill to desired_level, with the heater at
+    heater_power (and, unless told otherwise, the cavities off)
+    """
+
+    def __init__(
+        self,
+        cryomodule: "Q0Cryomodule",
+        desired_level: float,
+        heater_power: float = 0,
+        turn_cavities_off: bool = True,
+    ):
+        super().__init__(cryomodule, desired_level)
+        self.heater = SetHeaterPhase(cryomodule, heater_power)
+        self.heater_set = False
+        self.turn_cavities_off = turn_cavities_off
+
+    @property
+    def poll_interval(self) -> float:
+        if not self.heater_set:
+            return self.heater.poll_interval
+        return q0_utils.STATUS_INTERVAL
+
+    def start(self):
+        self.cryomodule.ds_liquid_level = self.desired_level
+        print(f"Setting JT to auto for refill to {self.desired_level}")
+        self.cryomodule.set_jt_auto(wait=False)
+
+    def is_ready(self) -> bool:
+        if not self.heater_set:
+            return self.heater.is_ready()
+        return super().is_ready()
+
+    def poll(self) -> bool:
+        if not self.heater_set:
+            if not self.heater.poll():
+                return False
+            self.heater_set = True
+
+            if self.turn_cavities_off:
+                self.cryomodule.turn_cavities_off()
+            super().start()
+
+        return super().poll()
+
+
+class LockJTPhase(Phase):
+    """
+    Walks the JT valve to position in manual, one percent at a time. One way
+    for the JT valve to be locked in the correct position is for it to be in
+    manual mode and at the desired value.
+    """
+
+    poll_interval = JT_POLL_INTERVAL
+
+    def __init__(self, cryomodule: "Q0Cryomodule", position: float):
+        super().__init__(cryomodule, f"Lock JT at {position}%")
+        self.position = position
+        self.step = 0
+        self.steps_left = 0
+        self.step_target: Optional[float] = None
+        self.step_deadline: Optional[datetime] = None
+        self.has_slot = False
+        self.waiting_for_slot = False
+        self.monitoring = False
+
+    def start(self):
+        print("Setting JT to manual and waiting for readback to change")
+
+    @property
+    def readback(self) -> float:
+        return self.cryomodule.jt_readback
+
+    def is_ready(self) -> bool:
+        if not self.has_slot:
+            # Nothing tells us when another cryomodule gives up its slot
+            return False
+        if not self.monitoring:
+            return self.cryomodule.jt_in_manual
+        if self.step_target is not None:
+            return (
+                abs(self.readback - self.step_target) <= q0_utils.JT_STEP_TOL
+                or now() >= self.step_deadline
+            )
+        return abs(self.readback - self.position) <= q0_utils.VALVE_POS_TOL
+
+    def poll(self) -> bool:
+        if not self.has_slot:
+            if not self.cryomodule.try_set_jt_manual():
+                if not self.waiting_for_slot:
+                    print(
+                        f"{self.cryomodule} waiting for another cryomodule's JT"
+                        " to go to auto"
+                    )
+                    self.waiting_for_slot = True
+                return False
+            self.has_slot = True
+
+        if not self.monitoring:
+            if not self.cryomodule.jt_in_manual:
+                return False
+            # Worked out from where the valve is now rather than where it was
+            # before waiting for a slot
+            position = self.cryomodule.pvs.get_if_connected(
+                self.cryomodule.jt_valve_readback_pv
+            )
+            if position is None:
+                return False
+            delta = self.position - position
+            self.step = sign(delta)
+            self.steps_left = int(floor(abs(delta)))
+            print(f"Walking {self.cryomodule} JT to {self.position}%")
+            self.cryomodule.jt_readback = position
+            camonitor(
+                self.cryomodule.jt_valve_readback_pv,
+                callback=self.cryomodule.monitor_jt,
+            )
+            self.monitoring = True
+            self.next_step()
+
+        if self.step_target is not None:
+            # Move on as soon as the valve gets there, giving it at most
+            # JT_STEP_TIMEOUT to do so
+            if not self.is_ready():
+                return False
+            self.next_step()
+            if self.step_target is not None:
+                return False
+
+        if not self.is_ready():
+            return False
+        print(f"{self.cryomodule} JT Valve at {self.position}")
+        self.cryomodule.jt_locked_position = self.position
+        return True
+
+    def next_step(self):
+        if self.steps_left:
+            self.steps_left -= 1
+            self.step_target = self.readback + self.step
+            self.step_deadline = now() + timedelta(seconds=q0_utils.JT_STEP_TIMEOUT)
+            self.cryomodule.put_nowait(
+                self.cryomodule.jtManPosSetpointPV, self.step_target
+            )
+        else:
+            self.step_target = None
+            self.cryomodule.put_nowait(
+                self.cryomodule.jtManPosSetpointPV, self.position
+            )
+            print(f"Waiting for {self.cryomodule} JT Valve position to be in tolerance")
+
+    def stop(self):
+        if self.monitoring:
+            camonitor_clear(self.cryomodule.jt_valve_readback_pv)
+            self.monitoring = False
+
+    def status(self) -> str:
+        if not self.has_slot:
+            return ""
+        return f"{self.cryomodule} JT Valve at {self.cryomodule.jt_readback}"
+
+
+class RecordPhase(Phase):
+    """
+    Records data_run until the liquid level drops target_ll_diff or, if
+    target_rel_error is given, the run's running dLL/dt fit gets that
+    precise. monitors maps extra PVs to watch while recording to their
+    callbacks.
+    """
+
+    def __init__(
+        self,
+        cryomodule: "Q0Cryomodule",
+        name: str,
+        data_run: q0_utils.DataRun,
+        target_ll_diff: float,
+        target_rel_error: Optional[float] = None,
+        monitors: Optional[Dict[str, Callable]] = None,
+    ):
+        super().__init__(cryomodule, name)
+        self.data_run = data_run
+        self.target_ll_diff = target_ll_diff
+        self.target_rel_error = target_rel_error
+        self.monitors: Dict[str, Callable] = monitors or {}
+        self.starting_level: Optional[float] = None
+        self.recording = False
+
+    def start(self):
+        self.cryomodule.current_data_run = self.data_run
+        self.cryomodule.recording_phase = self
+        self.data_run.start_time = now()
+        for pvname, callback in self.monitors.items():
+            camonitor(pvname, callback=callback)
+        self.cryomodule.fill_data_run_buffer = True
+        self.recording = True
+
+    def is_ready(self) -> bool:
+        if self.starting_level is None:
+            return self.cryomodule.ll_filter.count > 0
+        return self.stop_reason is not None
+
+    @property
+    def stop_reason(self) -> Optional[str]:
+        return self.cryomodule.ll_drop_stop_reason(
+            self.starting_level, self.target_ll_diff, self.target_rel_error
+        )
+
+    def poll(self) -> bool:
+        if self.starting_level is None:
+            if not self.cryomodule.ll_filter.count:
+                return False
+            self.starting_level = self.cryomodule.averaged_liquid_level
+
+        stop_reason = self.stop_reason
+        if stop_reason is None:
+            return False
+
+        self.stop()
+        self.data_run.stop_reason = stop_reason
+        self.data_run.end_time = now()
+        print(f"{self.name} done: {stop_reason}")
+        self.cryomodule.report_heater_tolerance()
+        return True
+
+    def stop(self):
+        if self.recording:
+            self.recording = False
+            self.cryomodule.fill_data_run_buffer = False
+            self.cryomodule.recording_phase = None
+            for pvname in self.monitors.keys():
+                camonitor_clear(pvname)
+
+    def status(self) -> str:
+        running_slope = self.data_run.running_fit()[0]
+        return (
+            f"Averaged level is {self.cryomodule.averaged_liquid_level}, dLL/dt is"
+            f" {running_slope.slope:.3e} +/- {running_slope.std_err:.1e}"
+        )
+
+
+class WaitForCavitiesPhase(Phase):
+    poll_interval = CAVITY_POLL_INTERVAL
+
+    def __init__(self, cryomodule: "Q0Cryomodule", amplitudes: Dict[int, float]):
+        super().__init__(cryomodule, "Wait for cavities")
+        self.amplitudes = amplitudes
+
+    @property
+    def cavities_not_ready(self) -> List[int]:
+        not_ready = []
+        for cav_num, des_amp in self.amplitudes.items():
+            amplitude = self.cryomodule.cavity_amplitude(cav_num)
+            if amplitude is None or abs(amplitude - des_amp) > 0.1:
+                not_ready.append(cav_num)
+        return not_ready
+
+    def is_ready(self) -> bool:
+        return not self.cavities_not_ready
+
+    def poll(self) -> bool:
+        return self.is_ready()
+
+    def status(self) -> str:
+        return (
+            f"Waiting for CM{self.cryomodule.name} cavities"
+            f" {self.cavities_not_ready} to be ready"
+        )
+
+
+class BackgroundPhase(Phase):
+    """Runs blocking calls in the background and is done once they all are"""
+
+    def __init__(self, cryomodule: "Q0Cryomodule", name: str, calls: List[Callable]):
+        super().__init__(cryomodule, name)
+        self.calls = calls
+        self.futures: List[Future] = []
+        self.calls_left: int = len(calls)
+
+    def run_call(self, call: Callable, started: threading.Event):
+        # Shares the clock with the loop like any other acquisition thread, and
+        # counts as finished before letting go of it so the loop doesn't sit
+        # out a poll interval waiting for the future to catch up
+        with acquisition_thread():
+            started.set()
+            try:
+                return call()
+            finally:
+                with self.cryomodule.monitor_condition:
+                    self.calls_left -= 1
+                    self.cryomodule.monitor_condition.notify_all()
+
+    def start(self):
+        for call in self.calls:
+            started = threading.Event()
+            self.futures.append(_background_calls.submit(self.run_call, call, started))
+            # Otherwise the clock could move on without the call
+            started.wait()
+
+    def is_ready(self) -> bool:
+        return self.calls_left == 0
+
+    def poll(self) -> bool:
+        if not self.is_ready():
+            return False
+        for future in self.futures:
+            # Raises whatever the call raised
+            future.result()
+        return True
+
+
+class RampCavitiesPhase(BackgroundPhase):
+    def __init__(self, cryomodule: "Q0Cryomodule", amplitudes: Dict[int, float]):
+        super().__init__(
+            cryomodule,
+            "Ramp cavities",
+            [
+                partial(turn_on_cavity, cryomodule.cavities[cav_num], amplitude)
+                for cav_num, amplitude in amplitudes.items()
+            ],
+        )
+        self.amplitudes = amplitudes
+
+    def start(self):
+        for cav_num, amplitude in self.amplitudes.items():
+            print(f"Ramping {self.cryomodule} cavity {cav_num} to {amplitude} MV")
+        super().start()
+
+
+class Acquisition:
+    """
+    One cryomodule working through a sequence of phases. Pausing takes
+    effect once the current phase is done, so the cryo is never left
+    halfway through a fill or a run, and doesn't keep the JT valve locked.
+    """
+
+    def __init__(self, cryomodule: "Q0Cryomodule", phases: Iterable[Phase], name: str):
+        self.cryomodule = cryomodule
+        self.name = name
+        self._phases = iter(phases)
+        self.phase: Optional[Phase] = None
+
+        self.state: str = ACQ_QUEUED
+        self.error: Optional[str] = None
+        self.exception: Optional[Exception] = None
+        self.finished = threading.Event()
+
+        # (phase name, seconds) for every phase that's finished
+        self.timings: List[Tuple[str, float]] = []
+        self._phase_start: Optional[datetime] = None
+        self._last_status: Optional[datetime] = None
+        self._pause_requested = False
+
+    def __str__(self):
+        phase = f" ({self.phase.name})" if self.phase else ""
+        error = f": {self.error}" if self.error else ""
+        return f"{self.cryomodule} {self.name} {self.state}{phase}{error}"
+
+    @property
+    def is_active(self) -> bool:
+        return self.state in [ACQ_QUEUED, ACQ_RUNNING, ACQ_PAUSED]
+
+    def pause(self):
+        self._pause_requested = True
+
+    def resume(self):
+        self._pause_requested = False
+        self.cryomodule.notify_monitors()
+
+    def abort(self):
+        self.cryomodule.abort_flag = True
+
+    @property
+    def poll_interval(self) -> float:
+        if self.state == ACQ_RUNNING and self.phase:
+            return self.phase.poll_interval
+        return q0_utils.STATUS_INTERVAL
+
+    def is_ready(self) -> bool:
+        if self.state == ACQ_QUEUED or self.cryomodule.abort_flag:
+            return True
+        if self.state == ACQ_PAUSED:
+            return not self._pause_requested
+        if self.state == ACQ_RUNNING:
+            return self.phase is None or self.phase.is_ready()
+        return False
+
+    def step(self):
+        """Moves through as many phases as are ready to go"""
+        if not self.is_active:
+            return
+
+        try:
+            # Restored in the background once the acquisition is finished
+            restore = self.cryomodule.abort_flag
+            self.cryomodule.check_abort(restore=False)
+
+            if self.state == ACQ_PAUSED:
+                if self._pause_requested:
+                    return
+                print(f"{self.cryomodule} {self.name} resumed")
+            self.state = ACQ_RUNNING
+
+            while True:
+                if not self.phase:
+                    if self._pause_requested:
+                        self.state = ACQ_PAUSED
+                        print(f"{self.cryomodule} {self.name} paused")
+                        self.release_jt()
+                        return
+                    if not self.start_next_phase():
+                        self.finish(ACQ_DONE)
+                        return
+
+                if not self.phase.poll():
+                    self.report_status()
+                    return
+
+                self.phase.stop()
+                self.timings.append(
+                    (self.phase.name, (now() - self._phase_start).total_seconds())
+                )
+                self.phase = None
+
+        except (q0_utils.Q0AbortError, CavityAbortError) as e:
+            self.finish(ACQ_ABORTED, e, restore=restore)
+
+        except Exception as e:
+            # Don't leave the cryomodule (or its JT slot) locked up
+            self.finish(ACQ_FAILED, e, restore=True)
+
+    def restore_cryo(self, started: threading.Event):
+        # Like BackgroundPhase.run_call, shares the clock with the loop
+        with acquisition_thread():
+            started.set()
+            try:
+                self.cryomodule.restore_cryo()
+            except Exception as restore_error:
+                print(f"Unable to restore {self.cryomodule}: {restore_error}")
+            finally:
+                self.finished.set()
+
+    def release_jt(self):
+        """
+        Puts a locked JT valve back in auto (giving up its slot) for as long
+        as the acquisition is paused, and has it locked again first thing on
+        resuming
+        """
+        position = self.cryomodule.jt_locked_position
+        if position is None:
+            return
+        print(f"Putting {self.cryomodule} JT back in auto while paused")
+        self.cryomodule.set_jt_auto(wait=False)
+        self._phases = chain([LockJTPhase(self.cryomodule, position)], self._phases)
+
+    def start_next_phase(self) -> bool:
+        self.phase = next(self._phases, None)
+        if not self.phase:
+            return False
+
+        self._phase_start = now()
+        self._last_status = self._phase_start
+        print(f"{self.cryomodule}: {self.phase.name}")
+        self.phase.start()
+        return True
+
+    def report_status(self):
+        if (now() - self._last_status).total_seconds() >= q0_utils.STATUS_INTERVAL:
+            self._last_status = now()
+            status = self.phase.status()
+            if status:
+                print(status)
+
+    def finish(self, state: str, exception: Optional[Exception] = None, restore=False):
+        """
+        Ends the acquisition in state. With restore, the cryo gets restored
+        in the background and the acquisition only counts as finished once
+        that's done.
+        """
+        if self.phase:
+            self.phase.stop()
+        self.state = state
+        if exception:
+            self.exception = exception
+            self.error = str(exception)
+        print(self)
+        if self.timings:
+            print("\n".join(self.timing_summary))
+        if restore:
+            started = threading.Event()
+            _background_calls.submit(self.restore_cryo, started)
+            # Otherwise the clock could move on without the restore
+            started.wait()
+        else:
+            self.finished.set()
+
+    @property
+    def timing_summary(self) -> List[str]:
+        return [
+            f"{self.cryomodule} {name}: {seconds / 60:.1f} min"
+            for name, seconds in self.timings
+        ]
+
+
+class AcquisitionLoop:
+    """
+    Steps every acquisition added to it from whichever thread calls run().
+    Each cryomodule's monitor_condition gets swapped for the loop's so a
+    readback update on any of them wakes the loop up.
+    """
+
+    def __init__(self, condition: Optional[threading.Condition] = None):
+        self.condition = condition or threading.Condition()
+        self.acquisitions: List[Acquisition] = []
+        self.running = False
+
+    def add(self, acquisition: Acquisition):
+        with self.condition:
+            acquisition.cryomodule.monitor_condition = self.condition
+            self.acquisitions.append(acquisition)
+            self.condition.notify_all()
+
+    @property
+    def active(self) -> List[Acquisition]:
+        return [
+            acquisition for acquisition in self.acquisitions if acquisition.is_active
+        ]
+
+    def submit(self, acquisition: Acquisition):
+        """
+        Adds acquisition and makes sure there's a thread running the loop,
+        which exits once there's nothing left to run
+        """
+        with self.condition:
+            self.add(acquisition)
+            if not self.running:
+                self.running = True
+                threading.Thread(target=self._run_in_thread, daemon=True).start()
+
+    def _run_in_thread(self):
+        with acquisition_thread():
+            self.run()
+
+    def run(self):
+        """Runs until every acquisition has finished"""
+        with self.condition:
+            self.running = True
+
+        while True:
+            # Stepping happens without the condition held since the puts
+            # can wait on callbacks from the same threads the monitors use
+            for acquisition in self.active:
+                acquisition.step()
+
+            with self.condition:
+                active = self.active
+                if not active:
+                    self.running = False
+                    return
+                wait_for(
+                    self.condition,
+                    lambda: any(acquisition.is_ready() for acquisition in active),
+                    min(acquisition.poll_interval for acquisition in active),
+                )
@@ -0,0 +1,447 @@
+"""
+The analysis half of a Q0 measurement: calibrations, RF runs and the Q0
+calculation, plus the JT stability search. None of it talks to the control
+system or draws anything, so batch jobs can import it without paying for
+pyepics, lcls_tools, Qt or matplotlib. q0_linac re-exports all of it for the
+acquisition side.
+"""
+
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import q0_bootstrap
+import q0_catalog
+import q0_store
+import q0_utils
+
+if TYPE_CHECKING:
+    from q0_linac import Q0Cryomodule
+
+
+class Calibration:
+    def __init__(self, time_stamp, cryomodule):
+        # type: (str, Q0Cryomodule) -> None
+
+        self.time_stamp: str = time_stamp
+        self.cryomodule: Q0Cryomodule = cryomodule
+
+        self.heater_runs: List[q0_utils.HeaterRun] = []
+        self._slope = None
+        self._slope_ci: Optional[Tuple[float, float]] = None
+        # Bootstrapping can fail, which shouldn't get retried on every access
+        self._slope_ci_computed = False
+        self.adjustment = 0
+        # The reference parameters a loaded calibration was taken with
+        self.valve_params: Optional[q0_utils.ValveParams] = None
+
+    def load_data(self):
+        self.load_heater_runs()
+
+        record = q0_catalog.get_calibration(self.cryomodule.name, self.time_stamp)
+        if not record.valve_params:
+            raise q0_utils.DataError(
+                f"{self.cryomodule} calibration from {self.time_stamp} has no"
+                " reference parameters"
+            )
+
+        self.valve_params = record.valve_params
+
+    def load_heater_runs(self):
+        """
+        Loads the heater runs saved so far, which is all of them unless the
+        calibration was interrupted
+        """
+        self.heater_runs: List[q0_utils.HeaterRun] = []
+
+        data_file = self.cryomodule.calib_data_file
+        data: Dict = q0_store.load_session(data_file, self.time_stamp)
+
+        for heater_run_data in data.values():
+            run = q0_utils.HeaterRun(heater_run_data["Desired Heat Load"])
+            run._start_time = datetime.strptime(
+                heater_run_data[q0_utils.JSON_START_KEY],
+                q0_utils.DATETIME_FORMATTER,
+            )
+            run._end_time = datetime.strptime(
+                heater_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
+            )
+
+            q0_store.load_run_ll(data_file, run, heater_run_data)
+            run.average_heat = heater_run_data[q0_utils.JSON_HEATER_READBACK_KEY]
+            run.stop_reason = heater_run_data.get(q0_utils.JSON_STOP_REASON_KEY)
+
+            self.heater_runs.append(run)
+
+    def save_data(self):
+        new_data = {}
+        for idx, heater_run in enumerate(self.heater_runs):
+            key = heater_run.start_time
+            heater_data = {
+                q0_utils.JSON_START_KEY: heater_run.start_time,
+                q0_utils.JSON_END_KEY: heater_run.end_time,
+                "Desired Heat Load": heater_run.heat_load_des,
+                q0_utils.JSON_HEATER_READBACK_KEY: heater_run.average_heat,
+                q0_utils.JSON_DLL_KEY: heater_run.dll_dt,
+                q0_utils.JSON_STOP_REASON_KEY: heater_run.stop_reason,
+                q0_utils.JSON_LL_REF_KEY: q0_store.save_run_ll(
+                    self.cryomodule.calib_data_file, heater_run
+                ),
+            }
+
+            new_data[key] = heater_data
+
+        q0_utils.update_json_data(
+            self.cryomodule.calib_data_file, self.time_stamp, new_data
+        )
+
+    def save_results(self):
+        q0_catalog.save_calibration(
+            q0_catalog.CalibrationRecord(
+                cryomodule=self.cryomodule.name,
+                time_stamp=self.time_stamp,
+                slope=self.dLLdt_dheat,
+                adjustment=self.adjustment,
+                valve_params=self.cryomodule.valveParams,
+                slope_ci=self.slope_ci,
+            )
+        )
+
+    @property
+    def dLLdt_dheat(self):
+        if not self._slope:
+            heat_loads = []
+            dll_dts = []
+            for run in self.heater_runs:
+                heat_loads.append(run.average_heat)
+                dll_dts.append(run.dll_dt)
+
+            slope, intercept = q0_utils.calc_calibration_fit(heat_loads, dll_dts)
+
+            if slope is not None:
+                self.adjustment = intercept
+            self._slope = slope
+
+        return self._slope
+
+    @property
+    def slope_ci(self) -> Optional[Tuple[float, float]]:
+        """
+        Bootstrapped confidence interval on dLLdt_dheat. Statistical only: it
+        covers the liquid level noise, not anything systematic.
+        """
+        if not self._slope_ci_computed:
+            self._slope_ci_computed = True
+            try:
+                slopes, _ = q0_bootstrap.bootstrap_calibration(self)
+                self._slope_ci = q0_bootstrap.confidence_interval(slopes)
+            except q0_utils.DataError as e:
+                print(f"Unable to bootstrap calibration {self.time_stamp}: {e}")
+        return self._slope_ci
+
+    def get_heat(self, dll_dt: float):
+        # Fitting the slope is what sets the adjustment, so it has to go first
+        slope = self.dLLdt_dheat
+        return (dll_dt - self.adjustment) / slope
+
+
+class RFRun(q0_utils.DataRun):
+    def __init__(self, amplitudes: Dict[int, float]):
+        super().__init__()
+        self.amplitudes = amplitudes
+        self.pressure = q0_utils.RunningStats()
+        self._avg_pressure = None
+
+    @property
+    def avg_pressure(self):
+        if self._avg_pressure is None:
+            return self.pressure.mean
+        return self._avg_pressure
+
+    @avg_pressure.setter
+    def avg_pressure(self, value: float):
+        self._avg_pressure = value
+
+
+class Q0Measurement:
+    def __init__(self, cryomodule):
+        # type: (Q0Cryomodule) -> None
+        self.cryomodule: Q0Cryomodule = cryomodule
+        self.heater_run: Optional[q0_utils.HeaterRun] = None
+        self.rf_run: Optional[RFRun] = None
+        self._raw_heat: Optional[float] = None
+        self._adjustment: Optional[float] = None
+        self._heat_load: Optional[float] = None
+        self._q0: Optional[float] = None
+        self._q0_ci: Optional[Tuple[float, float]] = None
+        self._q0_ci_computed = False
+        self._start_time: Optional[str] = None
+        self._amplitudes: Optional[Dict[int, float]] = None
+        self._heater_run_heatload: Optional[float] = None
+
+    @property
+    def amplitudes(self):
+        return self._amplitudes
+
+    @amplitudes.setter
+    def amplitudes(self, amplitudes: Dict[int, float]):
+        self._amplitudes = amplitudes
+        self.rf_run = RFRun(amplitudes)
+
+    @property
+    def heater_run_heatload(self):
+        return self._heater_run_heatload
+
+    @heater_run_heatload.setter
+    def heater_run_heatload(self, heat_load: float):
+        self._heater_run_heatload = heat_load
+        self.heater_run = q0_utils.HeaterRun(heat_load)
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    @start_time.setter
+    def start_time(self, start_time: datetime):
+        if not self._start_time:
+            self._start_time = start_time.strftime(q0_utils.DATETIME_FORMATTER)
+
+    def load_data(self, time_stamp: str):
+        self.start_time = datetime.strptime(time_stamp, q0_utils.DATETIME_FORMATTER)
+
+        data_file = self.cryomodule.q0_data_file
+        q0_meas_data: Dict = q0_store.load_session(data_file, time_stamp)
+
+        self.load_heater_run(q0_meas_data[q0_utils.JSON_HEATER_RUN_KEY])
+        self.load_rf_run(q0_meas_data[q0_utils.JSON_RF_RUN_KEY])
+
+    def load_heater_run(self, heater_run_data: Dict):
+        data_file = self.cryomodule.q0_data_file
+        self.heater_run_heatload = heater_run_data[q0_utils.JSON_HEATER_READBACK_KEY]
+        self.heater_run.average_heat = heater_run_data[
+            q0_utils.JSON_HEATER_READBACK_KEY
+        ]
+        self.heater_run.start_time = datetime.strptime(
+            heater_run_data[q0_utils.JSON_START_KEY], q0_utils.DATETIME_FORMATTER
+        )
+        self.heater_run.end_time = datetime.strptime(
+            heater_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
+        )
+        q0_store.load_run_ll(data_file, self.heater_run, heater_run_data)
+        self.heater_run.stop_reason = heater_run_data.get(q0_utils.JSON_STOP_REASON_KEY)
+
+    def load_rf_run(self, rf_run_data: Dict):
+        data_file = self.cryomodule.q0_data_file
+        cav_amps = {}
+        for cav_num_str, amp in rf_run_data[q0_utils.JSON_CAV_AMPS_KEY].items():
+            cav_amps[int(cav_num_str)] = amp
+
+        self.amplitudes = cav_amps
+        self.rf_run.start_time = datetime.strptime(
+            rf_run_data[q0_utils.JSON_START_KEY], q0_utils.DATETIME_FORMATTER
+        )
+        self.rf_run.end_time = datetime.strptime(
+            rf_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
+        )
+        self.rf_run.average_heat = rf_run_data[q0_utils.JSON_HEATER_READBACK_KEY]
+
+        q0_store.load_run_ll(data_file, self.rf_run, rf_run_data)
+
+        self.rf_run.avg_pressure = rf_run_data[q0_utils.JSON_AVG_PRESS_KEY]
+        self.rf_run.stop_reason = rf_run_data.get(q0_utils.JSON_STOP_REASON_KEY)
+
+    def save_data(self):
+        """
+        Saves whichever runs have finished, so the RF run is kept even if the
+        heater run after it never completes
+        """
+        data_file = self.cryomodule.q0_data_file
+        new_data = {}
+
+        if self.heater_run and self.heater_run.end_time:
+            new_data[q0_utils.JSON_HEATER_RUN_KEY] = {
+                q0_utils.JSON_START_KEY: self.heater_run.start_time,
+                q0_utils.JSON_END_KEY: self.heater_run.end_time,
+                q0_utils.JSON_LL_REF_KEY: q0_store.save_run_ll(
+                    data_file, self.heater_run
+                ),
+                q0_utils.JSON_HEATER_READBACK_KEY: self.heater_run.average_heat,
+                q0_utils.JSON_DLL_KEY: self.heater_run.dll_dt,
+                q0_utils.JSON_STOP_REASON_KEY: self.heater_run.stop_reason,
+            }
+
+        new_data[q0_utils.JSON_RF_RUN_KEY] = {
+            q0_utils.JSON_START_KEY: self.rf_run.start_time,
+            q0_utils.JSON_END_KEY: self.rf_run.end_time,
+            q0_utils.JSON_LL_REF_KEY: q0_store.save_run_ll(data_file, self.rf_run),
+            q0_utils.JSON_HEATER_READBACK_KEY: self.rf_run.average_heat,
+            q0_utils.JSON_AVG_PRESS_KEY: self.rf_run.avg_pressure,
+            q0_utils.JSON_DLL_KEY: self.rf_run.dll_dt,
+            q0_utils.JSON_CAV_AMPS_KEY: self.rf_run.amplitudes,
+            q0_utils.JSON_STOP_REASON_KEY: self.rf_run.stop_reason,
+        }
+
+        q0_utils.update_json_data(data_file, self.start_time, new_data)
+
+    def save_results(self):
+        q0_catalog.save_q0_measurement(
+            q0_catalog.Q0Record(
+                cryomodule=self.cryomodule.name,
+                time_stamp=self.start_time,
+                calibration_time_stamp=self.cryomodule.calibration.time_stamp,
+                raw_heat_load=self.raw_heat,
+                adjusted_heat_load=self.heat_load,
+                adjustment=self.adjustment,
+                q0=self.q0,
+                q0_ci=self.q0_ci,
+                amplitudes=self.rf_run.amplitudes,
+            )
+        )
+
+    def clear_results(self):
+        """
+        Forgets everything worked out from the cryomodule's calibration, for
+        when the measurement is reused after a different one was loaded
+        """
+        self._raw_heat = None
+        self._adjustment = None
+        self._heat_load = None
+        self._q0 = None
+        self._q0_ci = None
+        self._q0_ci_computed = False
+
+    @property
+    def raw_heat(self):
+        if not self._raw_heat:
+            self._raw_heat = self.cryomodule.calibration.get_heat(self.rf_run.dll_dt)
+        return self._raw_heat
+
+    @property
+    def adjustment(self):
+        if not self._adjustment:
+            heater_run_raw_heat = self.cryomodule.calibration.get_heat(
+                self.heater_run.dll_dt
+            )
+            self._adjustment = self.heater_run.average_heat - heater_run_raw_heat
+        return self._adjustment
+
+    @property
+    def heat_load(self):
+        if not self._heat_load:
+            self._heat_load = self.raw_heat + self.adjustment
+        return self._heat_load
+
+    @property
+    def q0(self):
+        if not self._q0:
+            self._q0 = q0_utils.calc_q0(
+                amplitude=q0_utils.calc_effective_amplitude(self.rf_run.amplitudes),
+                rf_heat_load=self.heat_load,
+                avg_pressure=self.rf_run.avg_pressure,
+                cav_length=self.cryomodule.cavities[1].length,
+            )
+        return self._q0
+
+    @property
+    def q0_ci(self) -> Optional[Tuple[float, float]]:
+        """
+        Bootstrapped confidence interval on q0. Statistical only, like the
+        calibration's slope_ci.
+        """
+        if not self._q0_ci_computed:
+            self._q0_ci_computed = True
+            try:
+                self._q0_ci = q0_bootstrap.confidence_interval(
+                    q0_bootstrap.bootstrap_q0(self)
+                )
+            except q0_utils.DataError as e:
+                print(f"Unable to bootstrap Q0 measurement {self.start_time}: {e}")
+        return self._q0_ci
+
+
+def _window_sums(
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    window_starts: np.ndarray,
+    window_length: float,
+):
+    """
+    Index bounds [first, last) of each window and the sum of values inside
+    it, from one cumulative sum rather than a pass per window. The archiver
+    only stores a sample when the value changes, so each window starts from
+    the last sample at or before its start (carried forward) rather than
+    from the first sample inside it.
+    """
+    first = np.searchsorted(timestamps, window_starts, side="right") - 1
+    first = np.maximum(first, 0)
+    last = np.searchsorted(timestamps, window_starts + window_length, side="right")
+    cumulative = np.concatenate([[0], np.cumsum(values)])
+    return first, last, cumulative[last] - cumulative[first]
+
+
+def find_stable_period(
+    window_starts: np.ndarray,
+    window_length: float,
+    ll_data: Tuple[np.ndarray, np.ndarray],
+    jt_data: Tuple[np.ndarray, np.ndarray],
+    heater_des_data: Tuple[np.ndarray, np.ndarray],
+    heater_act_data: Tuple[np.ndarray, np.ndarray],
+) -> Optional[Tuple[float, float, q0_utils.ValveParams]]:
+    """
+    Evaluates every JT search window at once and returns (window start,
+    liquid level slope, valve params) for the flattest one that had a flat
+    liquid level and no heater setpoint changes, or None if none did. Each
+    *_data is a (timestamps, values) pair of arrays covering every window,
+    starting from the last sample before the first window.
+    """
+    ll_times, ll_values = ll_data
+    if not window_starts.size or ll_values.size < 2:
+        return None
+
+    # Least squares slope against sample number in each window, from running
+    # sums of y and i*y (centred to keep the sums well conditioned)
+    from scipy.signal import medfilt
+
+    ll_filtered = medfilt(ll_values)
+    centered = ll_filtered - np.mean(ll_filtered)
+    first, last, sum_y = _window_sums(ll_times, centered, window_starts, window_length)
+    cumulative_iy = np.concatenate(
+        [[0], np.cumsum(np.arange(centered.size) * centered)]
+    )
+    num = (last - first).astype(float)
+    sum_iy = cumulative_iy[last] - cumulative_iy[first] - first * sum_y
+    sum_i = num * (num - 1) / 2
+    sum_ii = (num - 1) * num * (2 * num - 1) / 6
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = (num * sum_iy - sum_i * sum_y) / (num * sum_ii - sum_i**2)
+    is_stable = (num >= 2) & (np.abs(slopes) < q0_utils.MAX_STABLE_LL_SLOPE)
+
+    # We only want to use time periods in which there were no changes made
+    # to the heater settings
+    des_times, des_values = heater_des_data
+    changes = np.concatenate([[0], np.cumsum(des_values[1:] != des_values[:-1])])
+    des_first, des_last, _ = _window_sums(
+        des_times, des_values, window_starts, window_length
+    )
+    has_des = des_last > des_first
+    is_stable &= has_des
+    is_stable[has_des] &= changes[des_last[has_des] - 1] == changes[des_first[has_des]]
+
+    jt_first, jt_last, jt_sums = _window_sums(*jt_data, window_starts, window_length)
+    act_first, act_last, act_sums = _window_sums(
+        *heater_act_data, window_starts, window_length
+    )
+    is_stable &= (jt_last > jt_first) & (act_last > act_first)
+
+    if not is_stable.any():
+        return None
+
+    candidates = np.flatnonzero(is_stable)
+    best = candidates[np.argmin(np.abs(slopes[candidates]))]
+    valve_params = q0_utils.ValveParams(
+        refValvePos=round(float(jt_sums[best] / (jt_last[best] - jt_first[best])), 1),
+        refHeatLoadDes=float(des_values[des_first[best]]),
+        refHeatLoadAct=float(act_sums[best] / (act_last[best] - act_first[best])),
+    )
+    return float(window_starts[best]), float(slopes[best]), valve_params
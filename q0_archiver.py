@@ -0,0 +1,86 @@
+"""
+Helpers for archiver data: converting what the archiver hands back into
+arrays, and LocalArchiver, an in-memory stand-in for the real archiver that
+answers the same calls (for offline reconstruction, tests and simulation).
+"""
+
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class ArchiverData:
+    def __init__(self, timeStamps: Dict[str, List], values: Dict[str, List]):
+        self.timeStamps = timeStamps
+        self.values = values
+
+
+class LocalArchiver:
+    """
+    Stands in for lcls_tools' Archiver with data held in memory (or saved to
+    an npz file), answering getValuesOverTimeRange the same way
+    """
+
+    def __init__(self):
+        self.timestamps: Dict[str, np.ndarray] = {}
+        self.values: Dict[str, np.ndarray] = {}
+        self.num_requests = 0
+
+    def add(self, pv: str, timestamps, values):
+        """timestamps are epoch seconds"""
+        order = np.argsort(timestamps, kind="stable")
+        self.timestamps[pv] = np.asarray(timestamps, dtype=float)[order]
+        self.values[pv] = np.asarray(values, dtype=float)[order]
+
+    def save(self, filepath: str):
+        arrays = {}
+        for pv in self.timestamps.keys():
+            arrays[f"{pv}/timestamps"] = self.timestamps[pv]
+            arrays[f"{pv}/values"] = self.values[pv]
+        np.savez(filepath, **arrays)
+
+    @staticmethod
+    def load(filepath: str):
+        archiver = LocalArchiver()
+        with np.load(filepath) as arrays:
+            for key in arrays.files:
+                pv, field = key.rsplit("/", 1)
+                if field == "timestamps":
+                    archiver.add(pv, arrays[key], arrays[f"{pv}/values"])
+        return archiver
+
+    def get_values_over_time_range(
+        self, pv_list: List[str], start_time: datetime, end_time: datetime
+    ) -> ArchiverData:
+        return self.getValuesOverTimeRange(pv_list, start_time, end_time)
+
+    def getValuesOverTimeRange(
+        self, pvList: List[str], startTime: datetime, endTime: datetime
+    ) -> ArchiverData:
+        self.num_requests += 1
+        timestamps = {}
+        values = {}
+        for pv in pvList:
+            pv_times = self.timestamps.get(pv, np.empty(0))
+            start, end = np.searchsorted(
+                pv_times, [startTime.timestamp(), endTime.timestamp()], side="left"
+            )
+            timestamps[pv] = [datetime.fromtimestamp(t) for t in pv_times[start:end]]
+            values[pv] = list(self.values[pv][start:end]) if pv in self.values else []
+        return ArchiverData(timestamps, values)
+
+
+def to_arrays(timestamps: List[datetime], values) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Archiver timestamps and values as float arrays, converted in one go
+    rather than one datetime at a time. Naive archiver datetimes are local
+    time, so offsets are taken from the first one's epoch time.
+    """
+    values = np.asarray(values, dtype=float)
+    if not len(timestamps):
+        return np.empty(0), values
+
+    stamps = np.array(timestamps, dtype="datetime64[us]")
+    seconds = (stamps - stamps[0]) / np.timedelta64(1, "s")
+    return timestamps[0].timestamp() + seconds, values
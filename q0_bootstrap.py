@@ -0,0 +1,203 @@
+"""
+Bootstrap confidence intervals for calibration slopes and Q0.
+
+Each run's liquid level trace is resampled with a moving block residual
+bootstrap around its least squares fit: the residuals from that fit are
+reshuffled in blocks a couple of autocorrelation times long (so the
+correlation of the liquid level noise survives) and the least squares slope
+of the reshuffled residuals is how far that resample's dLL/dt lands from the
+fitted one. Refitting every resample with the run's own estimator (Siegel's
+repeated median by default) would take minutes per run, so the least
+squares spread is put around whatever dLL/dt the run was fitted with.
+
+The intervals are statistical only: they cover the noise on the liquid
+level, not anything systematic like heat that isn't accounted for or a
+drop that isn't quite linear. That's a matrix-vector
+product per chunk of resamples, so thousands of resamples per run are cheap,
+and runs get resampled in parallel. The calibration's heater points are then
+resampled as pairs, and every resample is pushed through get_heat, the
+heater run adjustment and calc_q0_batch to get a distribution of Q0.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+import q0_slopes
+import q0_utils
+
+if TYPE_CHECKING:
+    from q0_analysis import Calibration, Q0Measurement
+
+# Resamples generated at a time per run, to cap the size of the index arrays
+BOOTSTRAP_CHUNK = 256
+
+
+def block_length(residuals: np.ndarray) -> int:
+    """
+    Long enough for blocks to carry the residuals' autocorrelation, and
+    never shorter than the usual cube root of the number of points
+    """
+    autocorrelation_time = q0_slopes.autocorrelation_time(residuals)
+    length = max(np.ceil(residuals.size ** (1 / 3)), np.ceil(2 * autocorrelation_time))
+    return int(min(max(length, 1), residuals.size))
+
+
+def block_indices(
+    num_points: int, num_resamples: int, rng: np.random.Generator, block_length: int
+) -> np.ndarray:
+    """(num_resamples, num_points) indices made of randomly placed blocks"""
+    num_blocks = -(-num_points // block_length)
+    starts = rng.integers(
+        0, num_points - block_length + 1, size=(num_resamples, num_blocks)
+    )
+    indices = starts[:, :, np.newaxis] + np.arange(block_length)
+    return indices.reshape(num_resamples, -1)[:, :num_points]
+
+
+def bootstrap_dll_dt(
+    timestamps: np.ndarray,
+    values: np.ndarray,
+    dll_dt: float,
+    num_resamples: int,
+    rng: np.random.Generator,
+) -> np.ndarray:
+    """num_resamples bootstrapped dLL/dt values around the fitted dll_dt"""
+    x = timestamps - timestamps.mean()
+    x_over_sxx = x / np.dot(x, x)
+    least_squares_slope = np.dot(values, x_over_sxx)
+    residuals = values - values.mean() - least_squares_slope * x
+    length = block_length(residuals)
+
+    samples = np.empty(num_resamples)
+    for start in range(0, num_resamples, BOOTSTRAP_CHUNK):
+        stop = min(start + BOOTSTRAP_CHUNK, num_resamples)
+        indices = block_indices(x.size, stop - start, rng, length)
+        samples[start:stop] = dll_dt + residuals[indices] @ x_over_sxx
+    return samples
+
+
+def bootstrap_runs(
+    runs: List[q0_utils.DataRun],
+    num_resamples: int,
+    seed_seq: np.random.SeedSequence,
+) -> np.ndarray:
+    """
+    (len(runs), num_resamples) bootstrapped dLL/dt values, one row per run,
+    with the runs spread across cores
+    """
+    for run in runs:
+        if run.num_ll_points < 3:
+            raise q0_utils.DataError(
+                f"Run starting {run.start_time} has too few liquid level points"
+                " to bootstrap"
+            )
+
+    # One independent stream per run so the result doesn't depend on which
+    # thread gets to which run first
+    rngs = [np.random.default_rng(child) for child in seed_seq.spawn(len(runs))]
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        rows = executor.map(
+            lambda run, rng: bootstrap_dll_dt(
+                run.ll_timestamps, run.ll_values, run.dll_dt, num_resamples, rng
+            ),
+            runs,
+            rngs,
+        )
+        return np.array(list(rows)).reshape(len(runs), num_resamples)
+
+
+def bootstrap_calibration_fit(
+    heat_loads: np.ndarray,
+    dll_dt_samples: np.ndarray,
+    rng: np.random.Generator,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Refits the calibration line for every resample, drawing the heater
+    points with replacement and using each point's bootstrapped dLL/dt.
+    Resamples that drew a single heat load come back as nan.
+    """
+    num_points, num_resamples = dll_dt_samples.shape
+    picks = rng.integers(0, num_points, size=(num_resamples, num_points))
+    x = heat_loads[picks]
+    y = dll_dt_samples[picks, np.arange(num_resamples)[:, np.newaxis]]
+
+    x_mean = x.mean(axis=1)
+    y_mean = y.mean(axis=1)
+    x_centered = x - x_mean[:, np.newaxis]
+    sxx = np.sum(x_centered**2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slopes = np.sum(x_centered * (y - y_mean[:, np.newaxis]), axis=1) / sxx
+    slopes[sxx == 0] = np.nan
+    return slopes, y_mean - slopes * x_mean
+
+
+def confidence_interval(
+    samples: np.ndarray, confidence: float = q0_utils.BOOTSTRAP_CONFIDENCE
+) -> Optional[Tuple[float, float]]:
+    """Percentile interval of the finite samples, or None if there aren't any"""
+    samples = samples[np.isfinite(samples)]
+    if not samples.size:
+        return None
+    tail = 100 * (1 - confidence) / 2
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def bootstrap_calibration(
+    calibration: "Calibration",
+    num_resamples: int = q0_utils.BOOTSTRAP_RESAMPLES,
+    seed: Optional[int] = q0_utils.BOOTSTRAP_SEED,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Bootstrapped (slopes, intercepts) of a calibration's heat vs dLL/dt fit"""
+    return _bootstrap_calibration(
+        calibration, num_resamples, np.random.SeedSequence(seed)
+    )
+
+
+def _bootstrap_calibration(
+    calibration: "Calibration",
+    num_resamples: int,
+    seed_seq: np.random.SeedSequence,
+) -> Tuple[np.ndarray, np.ndarray]:
+    runs_seed, fit_seed = seed_seq.spawn(2)
+    runs = calibration.heater_runs
+    dll_dt_samples = bootstrap_runs(runs, num_resamples, runs_seed)
+    heat_loads = np.array([run.average_heat for run in runs], dtype=float)
+    return bootstrap_calibration_fit(
+        heat_loads, dll_dt_samples, np.random.default_rng(fit_seed)
+    )
+
+
+def bootstrap_q0(
+    q0_measurement: "Q0Measurement",
+    num_resamples: int = q0_utils.BOOTSTRAP_RESAMPLES,
+    seed: Optional[int] = q0_utils.BOOTSTRAP_SEED,
+) -> np.ndarray:
+    """
+    Bootstrapped Q0 values for a measurement, resampling its own runs and
+    those of the calibration it was taken with
+    """
+    calibration_seed, runs_seed = np.random.SeedSequence(seed).spawn(2)
+    slopes, intercepts = _bootstrap_calibration(
+        q0_measurement.cryomodule.calibration, num_resamples, calibration_seed
+    )
+    rf_dll_dts, heater_dll_dts = bootstrap_runs(
+        [q0_measurement.rf_run, q0_measurement.heater_run], num_resamples, runs_seed
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw_heat = (rf_dll_dts - intercepts) / slopes
+        adjustment = q0_measurement.heater_run.average_heat - (
+            (heater_dll_dts - intercepts) / slopes
+        )
+
+    q0s, _ = q0_utils.calc_q0_batch(
+        amplitudes=q0_utils.calc_effective_amplitude(q0_measurement.rf_run.amplitudes),
+        rf_heat_loads=raw_heat + adjustment,
+        avg_pressures=q0_measurement.rf_run.avg_pressure,
+        cav_lengths=q0_measurement.cryomodule.cavities[1].length,
+    )
+    return q0s
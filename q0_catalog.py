@@ -0,0 +1,786 @@
+"""
+SQLite catalog of calibration and Q0 measurement results.
+
+Every calibration and Q0 measurement's results get a row keyed by cryomodule
+and start time (as epoch seconds, so they sort and range query properly),
+with the reference heater/JT parameters, slope, adjustment and Q0 in their
+own indexed columns, Q0 measurements linked to the calibration they were
+taken with, and per-cavity amplitudes in a table of their own. The database
+runs in WAL mode so any number of GUIs and scripts can read while one of them
+writes, and writes wait their turn instead of clobbering each other.
+
+The raw runs behind each result stay in data/ (see q0_store). Results saved
+to the old calibrations/ and q0_measurements/ JSON index files get imported
+by import_changed_json_indexes(), which the GUI runs when it starts, if the
+file has changed since it was last imported (json_imports keeps track, so an
+import that failed gets tried again next time), or explicitly with:
+
+    python q0_catalog.py import [calibrations/cm13.json ...]
+
+and can be queried from the command line, e.g. every CM12 Q0 above 1e10 from
+2023:
+
+    python q0_catalog.py q0 --cryomodule 12 --min-q0 1e10 \\
+                            --start 01/01/23 --end 01/01/24
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from glob import glob
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.request import pathname2url
+
+import q0_utils
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibrations (
+    id INTEGER PRIMARY KEY,
+    cryomodule TEXT NOT NULL,
+    time_stamp TEXT NOT NULL,
+    start_epoch REAL NOT NULL,
+    slope REAL,
+    slope_ci_low REAL,
+    slope_ci_high REAL,
+    adjustment REAL,
+    ref_valve_pos REAL,
+    ref_heat_load_des REAL,
+    ref_heat_load_act REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (cryomodule, start_epoch)
+);
+CREATE INDEX IF NOT EXISTS calibrations_start ON calibrations (start_epoch);
+CREATE INDEX IF NOT EXISTS calibrations_version ON calibrations (version);
+CREATE INDEX IF NOT EXISTS calibrations_slope ON calibrations (slope);
+CREATE INDEX IF NOT EXISTS calibrations_slope_ci
+    ON calibrations (slope_ci_low, slope_ci_high);
+CREATE INDEX IF NOT EXISTS calibrations_adjustment ON calibrations (adjustment);
+CREATE INDEX IF NOT EXISTS calibrations_ref_valve_pos
+    ON calibrations (ref_valve_pos);
+CREATE INDEX IF NOT EXISTS calibrations_ref_heat_load_des
+    ON calibrations (ref_heat_load_des);
+CREATE INDEX IF NOT EXISTS calibrations_ref_heat_load_act
+    ON calibrations (ref_heat_load_act);
+
+CREATE TABLE IF NOT EXISTS q0_measurements (
+    id INTEGER PRIMARY KEY,
+    cryomodule TEXT NOT NULL,
+    time_stamp TEXT NOT NULL,
+    start_epoch REAL NOT NULL,
+    calibration_id INTEGER REFERENCES calibrations (id) ON DELETE SET NULL,
+    calibration_time_stamp TEXT,
+    raw_heat_load REAL,
+    adjusted_heat_load REAL,
+    adjustment REAL,
+    q0 REAL,
+    q0_ci_low REAL,
+    q0_ci_high REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (cryomodule, start_epoch)
+);
+CREATE INDEX IF NOT EXISTS q0_measurements_start ON q0_measurements (start_epoch);
+CREATE INDEX IF NOT EXISTS q0_measurements_version ON q0_measurements (version);
+CREATE INDEX IF NOT EXISTS q0_measurements_q0 ON q0_measurements (q0);
+CREATE INDEX IF NOT EXISTS q0_measurements_q0_ci
+    ON q0_measurements (q0_ci_low, q0_ci_high);
+CREATE INDEX IF NOT EXISTS q0_measurements_adjustment
+    ON q0_measurements (adjustment);
+CREATE INDEX IF NOT EXISTS q0_measurements_calibration
+    ON q0_measurements (calibration_id);
+
+CREATE TABLE IF NOT EXISTS cavity_amplitudes (
+    q0_measurement_id INTEGER NOT NULL
+        REFERENCES q0_measurements (id) ON DELETE CASCADE,
+    cavity INTEGER NOT NULL,
+    amplitude REAL NOT NULL,
+    PRIMARY KEY (q0_measurement_id, cavity)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS json_imports (
+    index_file TEXT PRIMARY KEY,
+    modified INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    results INTEGER NOT NULL
+);
+"""
+
+CALIBRATION_COLUMNS = (
+    "cryomodule, time_stamp, start_epoch, slope, slope_ci_low, slope_ci_high,"
+    " adjustment, ref_valve_pos, ref_heat_load_des, ref_heat_load_act"
+)
+Q0_COLUMNS = (
+    "cryomodule, time_stamp, start_epoch, calibration_time_stamp, raw_heat_load,"
+    " adjusted_heat_load, adjustment, q0, q0_ci_low, q0_ci_high"
+)
+
+# Anything a malformed or half written index file can throw at an import
+IMPORT_ERRORS = (OSError, KeyError, TypeError, ValueError)
+
+_connections = threading.local()
+
+
+@dataclass
+class CalibrationRecord:
+    cryomodule: str
+    time_stamp: str
+    slope: Optional[float]
+    adjustment: Optional[float]
+    valve_params: Optional[q0_utils.ValveParams]
+    slope_ci: Optional[Tuple[float, float]] = None
+    # Row id and version, only set on records read from the catalog. Every
+    # save gives the row a version past any other in its table, so anything
+    # with a version past the last one seen is new or changed since then.
+    id: Optional[int] = None
+    version: Optional[int] = None
+    # Worked out from time_stamp unless it's been read from the catalog
+    start_epoch: Optional[float] = None
+
+    def __post_init__(self):
+        if self.start_epoch is None:
+            self.start_epoch = to_epoch(self.time_stamp)
+
+
+@dataclass
+class Q0Record:
+    cryomodule: str
+    time_stamp: str
+    calibration_time_stamp: Optional[str]
+    raw_heat_load: Optional[float]
+    adjusted_heat_load: Optional[float]
+    adjustment: Optional[float]
+    q0: Optional[float]
+    q0_ci: Optional[Tuple[float, float]] = None
+    amplitudes: Dict[int, float] = field(default_factory=dict)
+    id: Optional[int] = None
+    version: Optional[int] = None
+    start_epoch: Optional[float] = None
+
+    def __post_init__(self):
+        if self.start_epoch is None:
+            self.start_epoch = to_epoch(self.time_stamp)
+
+
+def to_epoch(time_stamp: str) -> float:
+    return datetime.strptime(time_stamp, q0_utils.DATETIME_FORMATTER).timestamp()
+
+
+def _ci_columns(ci: Optional[Tuple[float, float]]) -> Tuple:
+    return tuple(ci) if ci else (None, None)
+
+
+def _ci_from_columns(low: Optional[float], high: Optional[float]):
+    return None if low is None or high is None else (low, high)
+
+
+def connect(
+    filepath: str = q0_utils.CATALOG_FILE, read_only: bool = False
+) -> sqlite3.Connection:
+    """
+    This thread's connection to the catalog at filepath, creating the catalog
+    (or bringing its schema up to date) if need be. A read only connection
+    does neither and can't write anything. Connections can't be shared between
+    threads or carried over a fork, so every thread and process gets its own.
+    """
+    key = (os.getpid(), os.path.abspath(filepath), read_only)
+    connections: Dict = _connections.__dict__.setdefault("by_file", {})
+    if key in connections:
+        return connections[key]
+
+    if read_only:
+        if not os.path.isfile(filepath):
+            raise q0_utils.DataError(f"No results catalog at {filepath}")
+        connection = sqlite3.connect(
+            f"file:{pathname2url(os.path.abspath(filepath))}?mode=ro",
+            uri=True,
+            timeout=q0_utils.CATALOG_BUSY_TIMEOUT,
+            isolation_level=None,
+        )
+        connections[key] = connection
+        return connection
+
+    if os.path.dirname(filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Autocommit, so transaction() decides when writes start and end
+    connection = sqlite3.connect(
+        filepath, timeout=q0_utils.CATALOG_BUSY_TIMEOUT, isolation_level=None
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    _add_version_columns(connection)
+    connection.executescript(SCHEMA)
+    connections[key] = connection
+    return connection
+
+
+def _add_version_columns(connection: sqlite3.Connection):
+    """Catalogs made before rows had versions get them, all starting at 0"""
+    for table in ["calibrations", "q0_measurements"]:
+        columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+        if columns and "version" not in columns:
+            connection.execute(
+                f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+
+
+# Write transactions committed by this process, on any connection
+_local_commits = 0
+_local_commits_lock = threading.Lock()
+
+
+@contextmanager
+def transaction(
+    connection: sqlite3.Connection, mode: str = "IMMEDIATE"
+) -> Iterator[sqlite3.Connection]:
+    """
+    Writes take the write lock up front, so two writers queue on the busy
+    timeout instead of one of them failing to upgrade a read transaction.
+    Reads that need several statements to agree use DEFERRED, which just
+    holds one snapshot for all of them.
+    """
+    global _local_commits
+    connection.execute(f"BEGIN {mode}")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+    if mode != "DEFERRED":
+        with _local_commits_lock:
+            _local_commits += 1
+
+
+def _upsert(connection: sqlite3.Connection, table: str, columns: str, values: Tuple):
+    names = [name.strip() for name in columns.split(",")]
+    updates = ", ".join(
+        f"{name} = excluded.{name}"
+        for name in names
+        if name not in ("cryomodule", "start_epoch")
+    )
+    connection.execute(
+        f"INSERT INTO {table} ({columns}, version)"
+        f" VALUES ({', '.join('?' * len(names))},"
+        f" (SELECT COALESCE(MAX(version), 0) + 1 FROM {table}))"
+        f" ON CONFLICT (cryomodule, start_epoch) DO UPDATE SET {updates},"
+        " version = excluded.version",
+        values,
+    )
+    return connection.execute(
+        f"SELECT id FROM {table} WHERE cryomodule = ? AND start_epoch = ?",
+        (values[0], values[2]),
+    ).fetchone()[0]
+
+
+def _save_calibration(connection: sqlite3.Connection, record: CalibrationRecord):
+    valve_params = record.valve_params
+    calibration_id = _upsert(
+        connection,
+        "calibrations",
+        CALIBRATION_COLUMNS,
+        (
+            record.cryomodule,
+            record.time_stamp,
+            record.start_epoch,
+            record.slope,
+            *_ci_columns(record.slope_ci),
+            record.adjustment,
+            valve_params.refValvePos if valve_params else None,
+            valve_params.refHeatLoadDes if valve_params else None,
+            valve_params.refHeatLoadAct if valve_params else None,
+        ),
+    )
+
+    # Q0 measurements can get imported before the calibration they used
+    connection.execute(
+        "UPDATE q0_measurements SET calibration_id = ?"
+        " WHERE cryomodule = ? AND calibration_time_stamp = ?",
+        (calibration_id, record.cryomodule, record.time_stamp),
+    )
+
+
+def _save_q0_measurement(connection: sqlite3.Connection, record: Q0Record):
+    q0_id = _upsert(
+        connection,
+        "q0_measurements",
+        Q0_COLUMNS,
+        (
+            record.cryomodule,
+            record.time_stamp,
+            record.start_epoch,
+            record.calibration_time_stamp,
+            record.raw_heat_load,
+            record.adjusted_heat_load,
+            record.adjustment,
+            record.q0,
+            *_ci_columns(record.q0_ci),
+        ),
+    )
+
+    connection.execute(
+        "UPDATE q0_measurements SET calibration_id ="
+        " (SELECT id FROM calibrations WHERE cryomodule = ? AND time_stamp = ?)"
+        " WHERE id = ?",
+        (record.cryomodule, record.calibration_time_stamp, q0_id),
+    )
+
+    connection.execute(
+        "DELETE FROM cavity_amplitudes WHERE q0_measurement_id = ?", (q0_id,)
+    )
+    connection.executemany(
+        "INSERT INTO cavity_amplitudes (q0_measurement_id, cavity, amplitude)"
+        " VALUES (?, ?, ?)",
+        [(q0_id, int(cavity), amp) for cavity, amp in record.amplitudes.items()],
+    )
+
+
+def save_calibration(record: CalibrationRecord, filepath: str = q0_utils.CATALOG_FILE):
+    connection = connect(filepath)
+    with transaction(connection):
+        _save_calibration(connection, record)
+
+
+def save_q0_measurement(record: Q0Record, filepath: str = q0_utils.CATALOG_FILE):
+    connection = connect(filepath)
+    with transaction(connection):
+        _save_q0_measurement(connection, record)
+
+
+def _calibration_from_row(row: Tuple) -> CalibrationRecord:
+    (
+        calibration_id,
+        cryomodule,
+        time_stamp,
+        start_epoch,
+        slope,
+        slope_ci_low,
+        slope_ci_high,
+        adjustment,
+        ref_valve_pos,
+        ref_heat_load_des,
+        ref_heat_load_act,
+        version,
+    ) = row
+    valve_params = None
+    if ref_valve_pos is not None:
+        valve_params = q0_utils.ValveParams(
+            refValvePos=ref_valve_pos,
+            refHeatLoadDes=ref_heat_load_des,
+            refHeatLoadAct=ref_heat_load_act,
+        )
+    return CalibrationRecord(
+        cryomodule=cryomodule,
+        time_stamp=time_stamp,
+        slope=slope,
+        adjustment=adjustment,
+        valve_params=valve_params,
+        slope_ci=_ci_from_columns(slope_ci_low, slope_ci_high),
+        id=calibration_id,
+        version=version,
+        start_epoch=start_epoch,
+    )
+
+
+def _where(
+    cm_name: Optional[str],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    after_version: Optional[int] = None,
+) -> Tuple[List[str], List]:
+    clauses = []
+    params = []
+    if after_version is not None:
+        clauses.append("version > ?")
+        params.append(after_version)
+    if cm_name is not None:
+        clauses.append("cryomodule = ?")
+        params.append(cm_name)
+    if start is not None:
+        clauses.append("start_epoch >= ?")
+        params.append(start.timestamp())
+    if end is not None:
+        clauses.append("start_epoch < ?")
+        params.append(end.timestamp())
+    return clauses, params
+
+
+def _where_sql(clauses: List[str]) -> str:
+    return f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def calibrations(
+    cm_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_version: Optional[int] = None,
+    filepath: str = q0_utils.CATALOG_FILE,
+    read_only: bool = False,
+) -> List[CalibrationRecord]:
+    """
+    Calibrations started in [start, end), oldest first, only counting the ones
+    saved since the one with version after_version if given
+    """
+    clauses, params = _where(cm_name, start, end, after_version)
+    rows = connect(filepath, read_only).execute(
+        f"SELECT id, {CALIBRATION_COLUMNS}, version FROM calibrations{_where_sql(clauses)}"
+        " ORDER BY start_epoch, cryomodule",
+        params,
+    )
+    return [_calibration_from_row(row) for row in rows]
+
+
+def q0_measurements(
+    cm_name: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    min_q0: Optional[float] = None,
+    max_q0: Optional[float] = None,
+    after_version: Optional[int] = None,
+    filepath: str = q0_utils.CATALOG_FILE,
+    read_only: bool = False,
+) -> List[Q0Record]:
+    """
+    Q0 measurements started in [start, end) with Q0 between min_q0 and
+    max_q0, oldest first, only counting the ones saved since the one with
+    version after_version if given
+    """
+    clauses, params = _where(cm_name, start, end, after_version)
+    if min_q0 is not None:
+        clauses.append("q0 >= ?")
+        params.append(min_q0)
+    if max_q0 is not None:
+        clauses.append("q0 <= ?")
+        params.append(max_q0)
+    where = _where_sql(clauses)
+
+    # Sorting here rather than in SQL leaves SQLite free to pick whichever
+    # index narrows things down most instead of the one that's already sorted
+    connection = connect(filepath, read_only)
+    with transaction(connection, "DEFERRED"):
+        rows = connection.execute(
+            f"SELECT id, {Q0_COLUMNS}, version FROM q0_measurements{where}", params
+        ).fetchall()
+        amplitudes: Dict[int, Dict[int, float]] = defaultdict(dict)
+        for q0_id, cavity, amplitude in connection.execute(
+            "SELECT q0_measurement_id, cavity, amplitude FROM cavity_amplitudes"
+            f" WHERE q0_measurement_id IN (SELECT id FROM q0_measurements{where})",
+            params,
+        ):
+            amplitudes[q0_id][cavity] = amplitude
+
+    rows.sort(key=lambda row: (row[3], row[1]))
+    return [
+        Q0Record(
+            cryomodule=cryomodule,
+            time_stamp=time_stamp,
+            calibration_time_stamp=calibration_time_stamp,
+            raw_heat_load=raw_heat_load,
+            adjusted_heat_load=adjusted_heat_load,
+            adjustment=adjustment,
+            q0=q0,
+            q0_ci=_ci_from_columns(q0_ci_low, q0_ci_high),
+            amplitudes=dict(sorted(amplitudes[q0_id].items())),
+            id=q0_id,
+            version=version,
+            start_epoch=start_epoch,
+        )
+        for (
+            q0_id,
+            cryomodule,
+            time_stamp,
+            start_epoch,
+            calibration_time_stamp,
+            raw_heat_load,
+            adjusted_heat_load,
+            adjustment,
+            q0,
+            q0_ci_low,
+            q0_ci_high,
+            version,
+        ) in rows
+    ]
+
+
+def _at(time_stamp: str) -> Tuple[datetime, datetime]:
+    """The [start, end) range that only catches time_stamp"""
+    moment = datetime.strptime(time_stamp, q0_utils.DATETIME_FORMATTER)
+    return moment, moment + timedelta(seconds=1)
+
+
+def get_calibration(
+    cm_name: str, time_stamp: str, filepath: str = q0_utils.CATALOG_FILE
+) -> CalibrationRecord:
+    records = calibrations(cm_name, *_at(time_stamp), filepath=filepath)
+    if not records:
+        raise q0_utils.DataError(f"No CM{cm_name} calibration from {time_stamp}")
+    return records[0]
+
+
+def get_q0_measurement(
+    cm_name: str, time_stamp: str, filepath: str = q0_utils.CATALOG_FILE
+) -> Q0Record:
+    records = q0_measurements(cm_name, *_at(time_stamp), filepath=filepath)
+    if not records:
+        raise q0_utils.DataError(f"No CM{cm_name} Q0 measurement from {time_stamp}")
+    return records[0]
+
+
+def _row_version(table: str, cm_name: str, time_stamp: str, filepath: str):
+    start, end = _at(time_stamp)
+    row = (
+        connect(filepath)
+        .execute(
+            f"SELECT version FROM {table} WHERE cryomodule = ?"
+            " AND start_epoch >= ? AND start_epoch < ?",
+            (cm_name, start.timestamp(), end.timestamp()),
+        )
+        .fetchone()
+    )
+    return row[0] if row else None
+
+
+def calibration_version(
+    cm_name: str, time_stamp: str, filepath: str = q0_utils.CATALOG_FILE
+) -> Optional[int]:
+    """The calibration's row version, or None if it isn't catalogued"""
+    return _row_version("calibrations", cm_name, time_stamp, filepath)
+
+
+def q0_measurement_version(
+    cm_name: str, time_stamp: str, filepath: str = q0_utils.CATALOG_FILE
+) -> Optional[int]:
+    """The Q0 measurement's row version, or None if it isn't catalogued"""
+    return _row_version("q0_measurements", cm_name, time_stamp, filepath)
+
+
+def data_version(filepath: str = q0_utils.CATALOG_FILE) -> Tuple[int, int]:
+    """
+    Changes whenever anything gets committed to the catalog. PRAGMA
+    data_version only counts other connections' commits, so this process's
+    own writes get counted separately.
+    """
+    pragma = connect(filepath).execute("PRAGMA data_version").fetchone()[0]
+    return pragma, _local_commits
+
+
+def cryomodule_names(
+    filepath: str = q0_utils.CATALOG_FILE, read_only: bool = False
+) -> List[str]:
+    rows = connect(filepath, read_only).execute(
+        "SELECT cryomodule FROM calibrations"
+        " UNION SELECT cryomodule FROM q0_measurements ORDER BY cryomodule"
+    )
+    return [row[0] for row in rows]
+
+
+def _float_or_none(value) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def calibration_from_json(cm_name: str, time_stamp: str, data: Dict):
+    valve_params = None
+    if "JT Valve Position" in data:
+        valve_params = q0_utils.ValveParams(
+            refValvePos=data["JT Valve Position"],
+            refHeatLoadDes=data["Total Reference Heater Setpoint"],
+            refHeatLoadAct=data["Total Reference Heater Readback"],
+        )
+
+    return CalibrationRecord(
+        cryomodule=cm_name,
+        time_stamp=time_stamp,
+        slope=_float_or_none(data.get("Calculated Heat vs dll/dt Slope")),
+        adjustment=_float_or_none(data.get("Calculated Adjustment")),
+        valve_params=valve_params,
+        slope_ci=data.get("Calculated Heat vs dll/dt Slope CI"),
+    )
+
+
+def q0_from_json(cm_name: str, time_stamp: str, data: Dict):
+    return Q0Record(
+        cryomodule=cm_name,
+        time_stamp=time_stamp,
+        calibration_time_stamp=data.get("Calibration Used"),
+        raw_heat_load=_float_or_none(data.get("Calculated Raw Heat Load")),
+        adjusted_heat_load=_float_or_none(data.get("Calculated Adjusted Heat Load")),
+        adjustment=_float_or_none(data.get("Calculated Adjustment")),
+        q0=_float_or_none(data.get("Calculated Q0")),
+        q0_ci=data.get("Calculated Q0 CI"),
+        amplitudes={
+            int(cavity): amp
+            for cavity, amp in data.get(q0_utils.JSON_CAV_AMPS_KEY, {}).items()
+        },
+    )
+
+
+def _index_file_cm_name(index_file: str) -> str:
+    return os.path.splitext(os.path.basename(index_file))[0][len("cm") :]
+
+
+def is_calibration_index(index_file: str) -> bool:
+    index_dir = os.path.basename(os.path.dirname(os.path.abspath(index_file)))
+    return index_dir == os.path.dirname(q0_utils.CALIB_IDX_FILE)
+
+
+def _index_file_version(index_file: str) -> Tuple[int, int]:
+    """When an index file or its journal last changed, and their total size"""
+    modified = 0
+    size = 0
+    for path in [index_file, q0_utils.journal_file(index_file)]:
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            modified = max(modified, stat.st_mtime_ns)
+            size += stat.st_size
+    return modified, size
+
+
+def _imported_version(
+    connection: sqlite3.Connection, index_file: str
+) -> Optional[Tuple[int, int]]:
+    row = connection.execute(
+        "SELECT modified, size FROM json_imports WHERE index_file = ?",
+        (os.path.abspath(index_file),),
+    ).fetchone()
+    return tuple(row) if row else None
+
+
+def import_json_index(
+    connection: sqlite3.Connection, index_file: str, is_calibration: bool
+) -> int:
+    """
+    Imports (or re-imports) every result in one of the old JSON index files,
+    returning how many there were. Importing the same file again just
+    overwrites the same rows.
+    """
+    cm_name = _index_file_cm_name(index_file)
+    # Taken first, so anything saved while this runs gets imported next time
+    modified, size = _index_file_version(index_file)
+    all_data: Dict = q0_utils.read_json_data(index_file)
+    with transaction(connection):
+        for time_stamp, data in all_data.items():
+            if is_calibration:
+                _save_calibration(
+                    connection, calibration_from_json(cm_name, time_stamp, data)
+                )
+            else:
+                _save_q0_measurement(
+                    connection, q0_from_json(cm_name, time_stamp, data)
+                )
+        connection.execute(
+            "INSERT INTO json_imports (index_file, modified, size, results)"
+            " VALUES (?, ?, ?, ?) ON CONFLICT (index_file) DO UPDATE SET"
+            " modified = excluded.modified, size = excluded.size,"
+            " results = excluded.results",
+            (os.path.abspath(index_file), modified, size, len(all_data)),
+        )
+    return len(all_data)
+
+
+def import_json_indexes(
+    connection: sqlite3.Connection, changed_only: bool = False
+) -> Dict[str, int]:
+    """
+    Imports every JSON index file (or just the ones that changed since they
+    were last imported), skipping any that can't be read so they get tried
+    again next time
+    """
+    imported = {}
+    for pattern, is_calibration in [
+        (q0_utils.CALIB_IDX_FILE, True),
+        (q0_utils.Q0_IDX_FILE, False),
+    ]:
+        for index_file in sorted(glob(pattern.format(CM="*"))):
+            if changed_only and _imported_version(
+                connection, index_file
+            ) == _index_file_version(index_file):
+                continue
+            try:
+                imported[index_file] = import_json_index(
+                    connection, index_file, is_calibration
+                )
+            except IMPORT_ERRORS as e:
+                print(f"Unable to import {index_file}: {e}")
+    return imported
+
+
+def import_changed_json_indexes(
+    filepath: str = q0_utils.CATALOG_FILE,
+) -> Dict[str, int]:
+    """
+    Brings the catalog at filepath up to date with the old JSON index files
+    under the working directory, for running once at startup
+    """
+    return import_json_indexes(connect(filepath), changed_only=True)
+
+
+def parse_time_stamp(time_stamp: str) -> datetime:
+    # Dates on their own are fine for picking a range
+    for date_format in [q0_utils.DATETIME_FORMATTER, "%m/%d/%y"]:
+        try:
+            return datetime.strptime(time_stamp, date_format)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Can't read {time_stamp} as a date")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Q0 results catalog")
+    parser.add_argument("--catalog", default=q0_utils.CATALOG_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="import JSON index files (default: all of them)"
+    )
+    import_parser.add_argument("files", nargs="*")
+
+    for command in ["calibrations", "q0"]:
+        query_parser = subparsers.add_parser(command, help=f"list {command} results")
+        query_parser.add_argument("--cryomodule")
+        query_parser.add_argument("--start", type=parse_time_stamp)
+        query_parser.add_argument("--end", type=parse_time_stamp)
+        if command == "q0":
+            query_parser.add_argument("--min-q0", type=float)
+            query_parser.add_argument("--max-q0", type=float)
+
+    args = parser.parse_args()
+
+    if args.command == "import":
+        catalog = connect(args.catalog)
+        if args.files:
+            imported = {
+                path: import_json_index(catalog, path, is_calibration_index(path))
+                for path in args.files
+            }
+        else:
+            imported = import_json_indexes(catalog)
+        for path, count in imported.items():
+            print(f"{path}: imported {count} results")
+
+    elif args.command == "calibrations":
+        for record in calibrations(
+            args.cryomodule, args.start, args.end, filepath=args.catalog
+        ):
+            print(
+                f"CM{record.cryomodule} {record.time_stamp}:"
+                f" slope {record.slope}, adjustment {record.adjustment}"
+            )
+
+    else:
+        for record in q0_measurements(
+            args.cryomodule,
+            args.start,
+            args.end,
+            args.min_q0,
+            args.max_q0,
+            filepath=args.catalog,
+        ):
+            print(
+                f"CM{record.cryomodule} {record.time_stamp}: Q0 {record.q0}"
+                f" (calibration {record.calibration_time_stamp})"
+            )
@@ -0,0 +1,80 @@
+"""
+Min/max decimation of liquid level traces for plotting.
+
+A trace's pyramid keeps, for bins of 2, 4, 8... consecutive points, which
+point in each bin is the lowest and which is the highest. Drawing a view
+then takes the finest level that gives no more than the requested number of
+points over the visible part of the trace, so a trace costs about the same
+to draw whether it has a thousand points or a million, and spikes and dips
+stay visible at any zoom since every bin keeps its extremes.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+class DecimationPyramid:
+    def __init__(self, x, y):
+        # x has to be sorted, which liquid level timestamps always are
+        self.x: np.ndarray = np.asarray(x, dtype=float)
+        self.y: np.ndarray = np.asarray(y, dtype=float)
+
+        # Index of the lowest and highest point in each bin of 2 ** (level + 1)
+        # points, with nan never chosen over a number
+        self.levels: List[Tuple[np.ndarray, np.ndarray]] = []
+        min_keys = np.where(np.isnan(self.y), np.inf, self.y)
+        max_keys = np.where(np.isnan(self.y), -np.inf, self.y)
+
+        index_type = np.int32 if self.y.size < 2**31 else np.int64
+        min_idx = max_idx = np.arange(self.y.size, dtype=index_type)
+        while min_idx.size > 1:
+            min_idx = self.merge_pairs(min_idx, min_keys, np.less_equal)
+            max_idx = self.merge_pairs(max_idx, max_keys, np.greater_equal)
+            self.levels.append((min_idx, max_idx))
+
+    @staticmethod
+    def merge_pairs(indices: np.ndarray, keys: np.ndarray, keep_first) -> np.ndarray:
+        """Picks one index out of each consecutive pair by comparing keys"""
+        if indices.size % 2:
+            indices = np.append(indices, indices[-1])
+        first, second = indices[0::2], indices[1::2]
+        return np.where(keep_first(keys[first], keys[second]), first, second)
+
+    @property
+    def x_range(self) -> Tuple[float, float]:
+        return self.x[0], self.x[-1]
+
+    def __len__(self):
+        return self.x.size
+
+    def view(
+        self, x_min: float, x_max: float, max_points: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The points to draw for [x_min, x_max], at most about max_points of
+        them. One point either side of the range is included so the line
+        runs to the edge of the view.
+        """
+        start = max(np.searchsorted(self.x, x_min, side="left") - 1, 0)
+        stop = min(np.searchsorted(self.x, x_max, side="right") + 1, self.x.size)
+        num_points = stop - start
+        max_points = max(max_points, 2)
+
+        if num_points <= max_points:
+            return self.x[start:stop], self.y[start:stop]
+
+        # Each bin becomes two points
+        level = int(np.ceil(np.log2(2 * num_points / max_points))) - 1
+        level = min(level, len(self.levels) - 1)
+        min_idx, max_idx = self.levels[level]
+
+        bin_points = 2 ** (level + 1)
+        bins = slice(start // bin_points, (stop - 1) // bin_points + 1)
+
+        # Sorted back into x order, with the ends of the range kept so the
+        # line still reaches the edges
+        indices = np.unique(
+            np.concatenate(([start], min_idx[bins], max_idx[bins], [stop - 1]))
+        )
+        return self.x[indices], self.y[indices]
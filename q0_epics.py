@@ -0,0 +1,259 @@
+"""
+PV access layer for the acquisition code. Everything that reads or writes a
+PV, subscribes to one, asks the archiver for its history, asks what time it
+is or waits goes through the
+functions here, which hand off to whichever backend is active. By default
+that's the real control system (pyepics and the wall clock); q0_sim swaps in
+a simulated cryomodule running on a virtual clock. pyepics and lcls_tools only
+get imported once the real backend is first used.
+"""
+
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from lcls_tools.common.controls.pyepics.utils import PV
+
+
+class EPICSBackend:
+    def __init__(self):
+        import epics
+        from lcls_tools.common.controls.pyepics.utils import PV
+        from lcls_tools.common.data_analysis import archiver
+
+        self.epics = epics
+        self.pv_class = PV
+        self.archiver = archiver
+
+    def caget(self, pvname: str, **kwargs):
+        return self.epics.caget(pvname, **kwargs)
+
+    def caput(self, pvname: str, value, **kwargs):
+        return self.epics.caput(pvname, value, **kwargs)
+
+    def camonitor(self, pvname: str, callback: Callable):
+        self.epics.camonitor(pvname, callback=callback)
+
+    def camonitor_clear(self, pvname: str):
+        self.epics.camonitor_clear(pvname)
+
+    def get_pv(self, pvname: str):
+        return self.pv_class(pvname)
+
+    def get_values_over_time_range(
+        self, pv_list: List[str], start_time: datetime, end_time: datetime
+    ):
+        return self.archiver.get_values_over_time_range(
+            pv_list=pv_list, start_time=start_time, end_time=end_time
+        )
+
+    def turn_off_cavity(self, cavity, turn_off_ssa: bool = False):
+        cavity.turnOff()
+        if turn_off_ssa:
+            cavity.ssa.turnOff()
+
+    def turn_on_cavity(self, cavity, amplitude: float):
+        cavity.turn_on()
+        cavity.walk_amp(amplitude, step_size=0.1)
+
+    def acquisition_thread(self):
+        return nullcontext()
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+    def wait_for(
+        self, condition: threading.Condition, predicate: Callable, timeout: float
+    ) -> bool:
+        return condition.wait_for(predicate, timeout)
+
+
+_backend: Optional[EPICSBackend] = None
+
+
+def get_backend() -> EPICSBackend:
+    global _backend
+    if _backend is None:
+        _backend = EPICSBackend()
+    return _backend
+
+
+def set_backend(backend: Optional[EPICSBackend] = None):
+    """
+    Makes backend the one all acquisition code talks to; no argument goes
+    back to the real control system
+    """
+    global _backend
+    _backend = backend
+
+
+def caget(pvname: str, **kwargs):
+    return get_backend().caget(pvname, **kwargs)
+
+
+def caput(pvname: str, value, **kwargs):
+    return get_backend().caput(pvname, value, **kwargs)
+
+
+def camonitor(pvname: str, callback: Callable):
+    get_backend().camonitor(pvname, callback=callback)
+
+
+def camonitor_clear(pvname: str):
+    get_backend().camonitor_clear(pvname)
+
+
+def get_pv(pvname: str):
+    return get_backend().get_pv(pvname)
+
+
+def get_values_over_time_range(
+    pv_list: List[str], start_time: datetime, end_time: datetime
+):
+    return get_backend().get_values_over_time_range(pv_list, start_time, end_time)
+
+
+def turn_off_cavity(cavity, turn_off_ssa: bool = False):
+    get_backend().turn_off_cavity(cavity, turn_off_ssa=turn_off_ssa)
+
+
+def turn_on_cavity(cavity, amplitude: float):
+    get_backend().turn_on_cavity(cavity, amplitude)
+
+
+def acquisition_thread():
+    """
+    Context for code running acquisition on a thread of its own, e.g. one of
+    several cryomodules measured at once. Only matters for backends that
+    keep their own clock.
+    """
+    return get_backend().acquisition_thread()
+
+
+def now() -> datetime:
+    return get_backend().now()
+
+
+def sleep(seconds: float):
+    get_backend().sleep(seconds)
+
+
+def wait_for(
+    condition: threading.Condition, predicate: Callable, timeout: float
+) -> bool:
+    """
+    Waits (holding condition) until predicate is true or timeout seconds
+    have passed and returns the last value of predicate. Whatever updates the
+    state predicate looks at should notify condition so the wait ends as soon
+    as it can.
+    """
+    return get_backend().wait_for(condition, predicate, timeout)
+
+
+@dataclass
+class PVMetrics:
+    gets: int = 0
+    cached_gets: int = 0
+    puts: int = 0
+    # Wall clock time spent in get/put calls on this PV
+    total_seconds: float = 0
+    max_seconds: float = 0
+
+    def record(self, seconds: float):
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def __str__(self):
+        calls = self.gets + self.puts
+        mean = self.total_seconds / calls if calls else 0
+        return (
+            f"{self.gets} gets ({self.cached_gets} from monitor), {self.puts} puts,"
+            f" {mean * 1000:.2f} ms mean, {self.max_seconds * 1000:.2f} ms max"
+        )
+
+
+class PVPool:
+    """
+    Persistent PV handles for one cryomodule, so loops that read or write the
+    same PVs over and over don't look them up (or reconnect) every time.
+    Handles start connecting in the background as soon as they're made, so
+    connect() ahead of time (e.g. on cryomodule selection) hides the
+    connection cost. Handles get remade if the backend changes.
+    """
+
+    def __init__(self):
+        self._backend: Optional[EPICSBackend] = None
+        self._handles: Dict[str, "PV"] = {}
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, PVMetrics] = {}
+
+    def handle(self, pvname: str) -> "PV":
+        with self._lock:
+            backend = get_backend()
+            if self._backend is not backend:
+                self._backend = backend
+                self._handles = {}
+
+            if pvname not in self._handles:
+                self._handles[pvname] = backend.get_pv(pvname)
+                self.metrics.setdefault(pvname, PVMetrics())
+            return self._handles[pvname]
+
+    def connect(self, pvnames: Iterable[str]):
+        for pvname in pvnames:
+            self.handle(pvname)
+
+    def get(self, pvname: str, use_monitor: bool = False):
+        """
+        use_monitor returns the handle's last monitor update instead of
+        asking the IOC, for loops that can live with a slightly stale value
+        """
+        pv = self.handle(pvname)
+        start = time.perf_counter()
+        value = pv.get(use_monitor=use_monitor)
+        metrics = self.metrics[pvname]
+        metrics.gets += 1
+        if use_monitor:
+            metrics.cached_gets += 1
+        metrics.record(time.perf_counter() - start)
+        return value
+
+    def get_if_connected(self, pvname: str):
+        """
+        The handle's last monitor update, or None if it hasn't connected yet,
+        for checks that can't afford to wait for a connection
+        """
+        pv = self.handle(pvname)
+        if not pv.connected:
+            return None
+        return self.get(pvname, use_monitor=True)
+
+    def put(
+        self,
+        pvname: str,
+        value,
+        wait: bool = False,
+        callback: Optional[Callable] = None,
+    ):
+        """
+        callback gets called (from a CA thread) once a put that isn't waited
+        on has been processed
+        """
+        pv = self.handle(pvname)
+        start = time.perf_counter()
+        result = pv.put(value, wait=wait, callback=callback)
+        metrics = self.metrics[pvname]
+        metrics.puts += 1
+        metrics.record(time.perf_counter() - start)
+        return result
+
+    @property
+    def summary(self) -> List[str]:
+        return [f"{pvname}: {metrics}" for pvname, metrics in self.metrics.items()]
@@ -0,0 +1,159 @@
+"""
+Filters for smoothing the downstream liquid level readback. A filter gets
+fed from the camonitor callback and read by whichever threads are waiting on
+the level, so every update and read is O(1) (O(window) for the median) under
+the filter's own lock and nothing here ever touches the network. Readings
+that come through as nan are skipped, and a filter that hasn't seen any
+other samples reads as nan.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Callable, Dict
+
+import numpy as np
+
+
+class LLFilter(ABC):
+    def __init__(self, window: int):
+        self.window = max(int(window), 1)
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def update(self, value: float):
+        # One bad reading would otherwise stay in a running sum for good, or
+        # break the median's sort order
+        if np.isnan(value):
+            return
+        with self._lock:
+            self._count += 1
+            self._update(value)
+
+    def reset(self):
+        with self._lock:
+            self._count = 0
+            self._reset()
+
+    @property
+    def value(self) -> float:
+        with self._lock:
+            if not self._count:
+                return np.nan
+            return self._value()
+
+    @property
+    def count(self) -> int:
+        """Number of samples seen since the last reset"""
+        return self._count
+
+    @abstractmethod
+    def _update(self, value: float):
+        pass
+
+    @abstractmethod
+    def _reset(self):
+        pass
+
+    @abstractmethod
+    def _value(self) -> float:
+        pass
+
+
+class RunningMeanFilter(LLFilter):
+    """Mean of the last window samples from a ring buffer and running sum"""
+
+    def __init__(self, window: int):
+        super().__init__(window)
+        self._buffer = np.zeros(self.window)
+        self._idx = 0
+        self._size = 0
+        self._sum = 0.0
+
+    def _update(self, value: float):
+        self._sum += value - self._buffer[self._idx]
+        self._buffer[self._idx] = value
+        self._idx = (self._idx + 1) % self.window
+        self._size = min(self._size + 1, self.window)
+
+        # Re-sum once per lap so rounding in the running sum can't build up
+        if self._idx == 0:
+            self._sum = float(self._buffer.sum())
+
+    def _reset(self):
+        self._buffer[:] = 0
+        self._idx = 0
+        self._size = 0
+        self._sum = 0.0
+
+    def _value(self) -> float:
+        return self._sum / self._size
+
+
+class EWMAFilter(LLFilter):
+    """
+    Exponentially weighted moving average with the same center of mass as a
+    window-point running mean
+    """
+
+    def __init__(self, window: int):
+        super().__init__(window)
+        self.alpha = 2 / (self.window + 1)
+        self._average = np.nan
+
+    def _update(self, value: float):
+        if self._count == 1:
+            self._average = value
+        else:
+            self._average += self.alpha * (value - self._average)
+
+    def _reset(self):
+        self._average = np.nan
+
+    def _value(self) -> float:
+        return self._average
+
+
+class RollingMedianFilter(LLFilter):
+    """Median of the last window samples, for readbacks with the odd spike"""
+
+    def __init__(self, window: int):
+        super().__init__(window)
+        self._samples = deque()
+        self._sorted = []
+
+    def _update(self, value: float):
+        self._samples.append(value)
+        insort(self._sorted, value)
+        if len(self._samples) > self.window:
+            del self._sorted[bisect_left(self._sorted, self._samples.popleft())]
+
+    def _reset(self):
+        self._samples.clear()
+        self._sorted.clear()
+
+    def _value(self) -> float:
+        size = len(self._sorted)
+        mid = size // 2
+        if size % 2:
+            return self._sorted[mid]
+        return (self._sorted[mid - 1] + self._sorted[mid]) / 2
+
+
+LL_FILTERS: Dict[str, Callable[[int], LLFilter]] = {
+    "mean": RunningMeanFilter,
+    "ewma": EWMAFilter,
+    "median": RollingMedianFilter,
+}
+
+
+def make_ll_filter(name: str, window: int) -> LLFilter:
+    try:
+        filter_class = LL_FILTERS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown liquid level filter {name}, expected one of"
+            f" {list(LL_FILTERS.keys())}"
+        )
+    return filter_class(window)
@@ -1,5 +1,5 @@
 from functools import partial
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from PyQt5.QtWidgets import QHBoxLayout, QVBoxLayout
@@ -8,7 +8,10 @@ from lcls_tools.superconducting.sc_linac_utils import ALL_CRYOMODULES
 from pydm import Display
 from pyqtgraph import PlotWidget, plot
 
+import q0_catalog
+import q0_filters
 import q0_gui_utils
+import q0_utils
 from q0_gui_utils import CalibrationWorker
 from q0_linac import Q0Cryomodule, Q0_CRYOMODULES
 from q0_utils import ValveParams
@@ -24,20 +27,30 @@ class Q0GUI(Display):
     def __init__(self, parent=None, args=None):
         super().__init__(parent=parent, args=args)
 
+        # Anything still saved the old way shows up in the session pickers
+        q0_catalog.import_changed_json_indexes()
+
         self.selectedCM: Optional[Q0Cryomodule] = None
         self.ui.cm_combobox.addItems([""] + ALL_CRYOMODULES)
         self.ui.cm_combobox.currentTextChanged.connect(self.update_cm)
 
         self.ui.ll_avg_spinbox.valueChanged.connect(self.update_ll_buffer)
+        self.ui.ll_filter_combobox.addItems(list(q0_filters.LL_FILTERS.keys()))
+        self.ui.ll_filter_combobox.setCurrentText(q0_utils.LL_FILTER)
+        self.ui.ll_filter_combobox.currentTextChanged.connect(self.update_ll_filter)
 
         self.ui.new_cal_button.clicked.connect(self.takeNewCalibration)
         self.ui.load_cal_button.clicked.connect(self.load_calibration)
-        self.cal_option_windows: Dict[str, Display] = {}
+        # One picker window of each kind, pointed at whichever cryomodule is
+        # selected when it's opened
+        self.cal_options: Optional[q0_gui_utils.CalibrationOptions] = None
+        self.cal_option_window: Optional[Display] = None
         self.ui.show_cal_data_button.clicked.connect(self.show_calibration_data)
 
         self.ui.new_rf_button.clicked.connect(self.take_new_q0_measurement)
         self.ui.load_rf_button.clicked.connect(self.load_q0)
-        self.rf_option_windows: Dict[str, Display] = {}
+        self.rf_options: Optional[q0_gui_utils.Q0Options] = None
+        self.rf_option_window: Optional[Display] = None
         self.ui.show_rf_button.clicked.connect(self.show_q0_data)
 
         self.calibration_worker: Optional[CalibrationWorker] = None
@@ -51,17 +64,19 @@ class Q0GUI(Display):
         self.ui.setup_param_button.clicked.connect(self.setup_for_cryo_params)
 
         self.calibration_data_plot: Optional[PlotWidget] = None
-        self.calibration_data_plot_items = []
+        self.calibration_data_curves: List[q0_gui_utils.DecimatedCurve] = []
         self.calibration_fit_plot: Optional[PlotWidget] = None
         self.calibration_fit_plot_items = []
 
         self.q0_data_plot: PlotWidget = Optional[None]
-        self.q0_data_plot_items = []
+        self.q0_data_curves: List[q0_gui_utils.DecimatedCurve] = []
         self.q0_fit_plot: Optional[PlotWidget] = None
         self.q0_fit_plot_items = []
 
         self.calibration_window: Optional[Display] = None
         self.q0_window: Optional[Display] = None
+        self.live_dashboard: Optional[q0_gui_utils.LiveRunDashboard] = None
+        self.live_window: Optional[Display] = None
 
         self.cav_amp_controls: Dict[int, q0_gui_utils.CavAmpControl] = {}
 
@@ -105,6 +120,10 @@ class Q0GUI(Display):
             self.selectedCM = None
         else:
             self.selectedCM = Q0_CRYOMODULES[current_text]
+            self.selectedCM.ll_buffer_size = self.ui.ll_avg_spinbox.value()
+            self.selectedCM.ll_filter_name = self.ui.ll_filter_combobox.currentText()
+            # Start connecting now so the first measurement doesn't wait on it
+            self.selectedCM.connect_pvs()
             self.ui.perm_byte.channel = self.selectedCM.cryo_access_pv
             self.ui.perm_label.channel = self.selectedCM.cryo_access_pv
 
@@ -123,6 +142,10 @@ class Q0GUI(Display):
             for cavity in self.selectedCM.cavities.values():
                 self.cav_amp_controls[cavity.number].connect(cavity)
 
+            if self.live_dashboard:
+                self.live_dashboard.set_cryomodule(self.selectedCM)
+                self.live_window.setWindowTitle(f"CM {self.selectedCM.name} Live Run")
+
     @pyqtSlot()
     def show_q0_data(self):
         if not self.q0_window:
@@ -137,24 +160,14 @@ class Q0GUI(Display):
             layout.addWidget(self.q0_fit_plot)
             self.q0_window.setLayout(layout)
 
-        while self.q0_data_plot_items:
-            self.q0_data_plot.removeItem(self.q0_data_plot_items.pop())
-
         while self.q0_fit_plot_items:
             self.q0_fit_plot.removeItem(self.q0_fit_plot_items.pop())
 
         measurement = self.selectedCM.q0_measurement
-        self.q0_data_plot_items.append(
-            self.q0_data_plot.plot(
-                list(measurement.rf_run.ll_data.keys()),
-                list(measurement.rf_run.ll_data.values()),
-            )
-        )
-        self.q0_data_plot_items.append(
-            self.q0_data_plot.plot(
-                list(measurement.heater_run.ll_data.keys()),
-                list(measurement.heater_run.ll_data.values()),
-            )
+        q0_gui_utils.show_traces(
+            self.q0_data_plot,
+            self.q0_data_curves,
+            [measurement.rf_run, measurement.heater_run],
         )
 
         dll_dts = [measurement.rf_run.dll_dt, measurement.heater_run.dll_dt]
@@ -176,6 +189,20 @@ class Q0GUI(Display):
 
         showDisplay(self.q0_window)
 
+    @pyqtSlot()
+    def show_live_dashboard(self):
+        if not self.live_window:
+            self.live_window = Display()
+            self.live_dashboard = q0_gui_utils.LiveRunDashboard(self.selectedCM)
+            layout = QVBoxLayout()
+            layout.addWidget(self.live_dashboard)
+            self.live_window.setLayout(layout)
+        else:
+            self.live_dashboard.set_cryomodule(self.selectedCM)
+
+        self.live_window.setWindowTitle(f"CM {self.selectedCM.name} Live Run")
+        showDisplay(self.live_window)
+
     @pyqtSlot()
     def show_calibration_data(self):
         if not self.calibration_window:
@@ -190,22 +217,16 @@ class Q0GUI(Display):
             layout.addWidget(self.calibration_fit_plot)
             self.calibration_window.setLayout(layout)
 
-        while self.calibration_data_plot_items:
-            self.calibration_data_plot.removeItem(
-                self.calibration_data_plot_items.pop()
-            )
-
         while self.calibration_fit_plot_items:
             self.calibration_fit_plot.removeItem(self.calibration_fit_plot_items.pop())
 
         dll_dts = []
 
-        for heater_run in self.selectedCM.calibration.heater_runs:
-            self.calibration_data_plot_items.append(
-                self.calibration_data_plot.plot(
-                    list(heater_run.ll_data.keys()), list(heater_run.ll_data.values())
-                )
-            )
+        heater_runs = self.selectedCM.calibration.heater_runs
+        q0_gui_utils.show_traces(
+            self.calibration_data_plot, self.calibration_data_curves, heater_runs
+        )
+        for heater_run in heater_runs:
             dll_dts.append(heater_run.dll_dt)
             self.calibration_fit_plot_items.append(
                 self.calibration_fit_plot.plot(
@@ -235,26 +256,29 @@ class Q0GUI(Display):
 
     @pyqtSlot()
     def load_calibration(self):
-        if self.selectedCM.name not in self.cal_option_windows:
-            option_window: Display = Display()
-            option_window.setWindowTitle(
-                f"CM {self.selectedCM.name} Calibration Options"
-            )
-            cal_options = q0_gui_utils.CalibrationOptions(self.selectedCM)
-            cal_options.cal_loaded_signal.connect(self.handle_cal_status)
-            cal_options.cal_loaded_signal.connect(
+        if not self.cal_option_window:
+            self.cal_option_window = Display()
+            self.cal_options = q0_gui_utils.CalibrationOptions(self.selectedCM)
+            self.cal_options.cal_loaded_signal.connect(self.handle_cal_status)
+            self.cal_options.cal_loaded_signal.connect(
                 partial(self.ui.rf_groupbox.setEnabled, True)
             )
-            cal_options.cal_loaded_signal.connect(
+            self.cal_options.cal_loaded_signal.connect(
                 partial(self.ui.show_cal_data_button.setEnabled, True)
             )
-            cal_options.cal_loaded_signal.connect(self.show_calibration_data)
-            cal_options.cal_loaded_signal.connect(self.update_cryo_params)
+            self.cal_options.cal_loaded_signal.connect(self.show_calibration_data)
+            self.cal_options.cal_loaded_signal.connect(self.update_cryo_params)
+            self.cal_options.cal_error_signal.connect(self.handle_cal_error)
             window_layout = QVBoxLayout()
-            window_layout.addWidget(cal_options.main_groupbox)
-            option_window.setLayout(window_layout)
-            self.cal_option_windows[self.selectedCM.name] = option_window
-        showDisplay(self.cal_option_windows[self.selectedCM.name])
+            window_layout.addWidget(self.cal_options.main_groupbox)
+            self.cal_option_window.setLayout(window_layout)
+        else:
+            self.cal_options.set_cryomodule(self.selectedCM)
+
+        self.cal_option_window.setWindowTitle(
+            f"CM {self.selectedCM.name} Calibration Options"
+        )
+        showDisplay(self.cal_option_window)
 
     @pyqtSlot(str)
     def handle_rf_status(self, message):
@@ -268,25 +292,33 @@ class Q0GUI(Display):
 
     @pyqtSlot()
     def load_q0(self):
-        if self.selectedCM.name not in self.rf_option_windows:
-            option_window: Display = Display()
-            option_window.setWindowTitle(
-                f"CM {self.selectedCM.name} RF Measurement Options"
-            )
-            rf_options = q0_gui_utils.Q0Options(self.selectedCM)
-            rf_options.q0_loaded_signal.connect(self.handle_rf_status)
-            rf_options.q0_loaded_signal.connect(self.show_q0_data)
+        if not self.rf_option_window:
+            self.rf_option_window = Display()
+            self.rf_options = q0_gui_utils.Q0Options(self.selectedCM)
+            self.rf_options.q0_loaded_signal.connect(self.handle_rf_status)
+            self.rf_options.q0_loaded_signal.connect(self.show_q0_data)
+            self.rf_options.q0_error_signal.connect(self.handle_rf_error)
             window_layout = QVBoxLayout()
-            window_layout.addWidget(rf_options.main_groupbox)
-            option_window.setLayout(window_layout)
-            self.rf_option_windows[self.selectedCM.name] = option_window
-        showDisplay(self.rf_option_windows[self.selectedCM.name])
+            window_layout.addWidget(self.rf_options.main_groupbox)
+            self.rf_option_window.setLayout(window_layout)
+        else:
+            self.rf_options.set_cryomodule(self.selectedCM)
+
+        self.rf_option_window.setWindowTitle(
+            f"CM {self.selectedCM.name} RF Measurement Options"
+        )
+        showDisplay(self.rf_option_window)
 
     @pyqtSlot(int)
     def update_ll_buffer(self, value):
         if self.selectedCM:
             self.selectedCM.ll_buffer_size = value
 
+    @pyqtSlot(str)
+    def update_ll_filter(self, value):
+        if self.selectedCM:
+            self.selectedCM.ll_filter_name = value
+
     @pyqtSlot()
     def update_cryo_params(self):
         self.ui.ref_heat_spinbox.setValue(self.selectedCM.valveParams.refHeatLoadDes)
@@ -302,24 +334,40 @@ class Q0GUI(Display):
         )
         self.cryo_param_setup_worker.start()
 
+    def should_resume(self, checkpoint_key: str, description: str) -> bool:
+        checkpoint = self.selectedCM.load_checkpoint(checkpoint_key)
+        if not checkpoint:
+            return False
+        return q0_gui_utils.ask_to_resume(
+            f"Resume {description}?",
+            f"CM{self.selectedCM.name} has an interrupted {description} from"
+            f" {checkpoint[q0_utils.JSON_START_KEY]}. Pick it back up instead of"
+            " starting over?",
+        )
+
     @pyqtSlot()
     def takeNewCalibration(self):
-        self.selectedCM.valveParams = ValveParams(
-            refHeatLoadDes=self.ui.ref_heat_spinbox.value(),
-            refValvePos=self.ui.jt_pos_spinbox.value(),
-            refHeatLoadAct=self.ui.ref_heat_spinbox.value(),
-        )
+        if self.should_resume(q0_utils.JSON_CALIBRATION_CHECKPOINT_KEY, "calibration"):
+            self.calibration_worker = q0_gui_utils.CalibrationResumeWorker(
+                self.selectedCM
+            )
+        else:
+            self.selectedCM.valveParams = ValveParams(
+                refHeatLoadDes=self.ui.ref_heat_spinbox.value(),
+                refValvePos=self.ui.jt_pos_spinbox.value(),
+                refHeatLoadAct=self.ui.ref_heat_spinbox.value(),
+            )
 
-        self.calibration_worker = CalibrationWorker(
-            cryomodule=self.selectedCM,
-            jt_search_start=None,
-            jt_search_end=None,
-            desired_ll=self.ui.ll_start_spinbox.value(),
-            heat_start=self.ui.start_heat_spinbox.value(),
-            heat_end=self.ui.end_heat_spinbox.value(),
-            num_cal_steps=self.ui.num_cal_points_spinbox.value(),
-            ll_drop=self.ui.ll_drop_spinbox.value(),
-        )
+            self.calibration_worker = CalibrationWorker(
+                cryomodule=self.selectedCM,
+                jt_search_start=None,
+                jt_search_end=None,
+                desired_ll=self.ui.ll_start_spinbox.value(),
+                heat_start=self.ui.start_heat_spinbox.value(),
+                heat_end=self.ui.end_heat_spinbox.value(),
+                num_cal_steps=self.ui.num_cal_points_spinbox.value(),
+                ll_drop=self.ui.ll_drop_spinbox.value(),
+            )
         self.calibration_worker.status.connect(self.handle_cal_status)
         self.calibration_worker.finished.connect(self.handle_cal_status)
         self.calibration_worker.error.connect(self.handle_cal_error)
@@ -330,6 +378,7 @@ class Q0GUI(Display):
             partial(self.ui.show_cal_data_button.setEnabled, True)
         )
         self.calibration_worker.start()
+        self.show_live_dashboard()
 
     @property
     def desiredCavityAmplitudes(self):
@@ -361,6 +410,9 @@ class Q0GUI(Display):
             ll_drop=self.ui.ll_drop_spinbox.value(),
             desired_amplitudes=self.desiredCavityAmplitudes,
         )
+        self.start_q0_meas_worker()
+
+    def start_q0_meas_worker(self):
         self.q0_meas_worker.error.connect(
             partial(q0_gui_utils.make_error_popup, "Q0 Measurement Error")
         )
@@ -371,6 +423,12 @@ class Q0GUI(Display):
 
     @pyqtSlot()
     def take_new_q0_measurement(self):
+        self.show_live_dashboard()
+        if self.should_resume(q0_utils.JSON_Q0_CHECKPOINT_KEY, "Q0 measurement"):
+            self.q0_meas_worker = q0_gui_utils.Q0ResumeWorker(self.selectedCM)
+            self.start_q0_meas_worker()
+            return
+
         self.selectedCM.valveParams = ValveParams(
             refHeatLoadDes=self.ui.ref_heat_spinbox.value(),
             refValvePos=self.ui.jt_pos_spinbox.value(),
@@ -1,27 +1,60 @@
-import json
+from concurrent.futures import Future
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from functools import partial
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from weakref import WeakKeyDictionary
 
 import numpy as np
-from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+from PyQt5.QtCore import (
+    QAbstractTableModel,
+    QDate,
+    QModelIndex,
+    QObject,
+    QSortFilterProxyModel,
+    QThread,
+    QTimer,
+    Qt,
+    pyqtSignal,
+    pyqtSlot,
+)
+from PyQt5.QtGui import QDoubleValidator
 from PyQt5.QtWidgets import (
+    QAbstractItemView,
+    QDateEdit,
     QDoubleSpinBox,
-    QGridLayout,
     QGroupBox,
     QHBoxLayout,
+    QHeaderView,
     QLabel,
+    QLineEdit,
     QMessageBox,
-    QRadioButton,
+    QPushButton,
+    QTableView,
+    QVBoxLayout,
+    QWidget,
 )
-from epics import caget, caput
 from lcls_tools.superconducting.sc_linac_utils import CavityAbortError
 from pydm.widgets import PyDMLabel
+from pyqtgraph import (
+    DateAxisItem,
+    FillBetweenItem,
+    PlotCurveItem,
+    PlotDataItem,
+    PlotWidget,
+    ViewBox,
+    mkPen,
+)
 from requests import ConnectTimeout
 from urllib3.exceptions import ConnectTimeoutError
 
+import q0_catalog
+import q0_session_cache
 import q0_utils
+from q0_decimate import DecimationPyramid
+from q0_epics import turn_on_cavity
 from q0_linac import Q0Cavity, Q0Cryomodule
+from q0_live import LiveRunFeed, LiveSnapshot
 
 DEFAULT_LL_DROP = 4
 MIN_STARTING_LL = 93
@@ -61,13 +94,13 @@ class CryoParamSetupWorker(Worker):
 
     def run(self) -> None:
         self.status.emit("Checking for required cryo permissions")
-        if caget(self.cryomodule.cryo_access_pv) != q0_utils.CRYO_ACCESS_VALUE:
+        if not self.cryomodule.has_cryo_access:
             self.error.emit("Required cryo permissions not granted - call cryo ops")
             return
 
         self.cryomodule.heater_power = self.heater_setpoint
         self.cryomodule.jt_position = 35
-        caput(self.cryomodule.jtAutoSelectPV, 1, wait=True)
+        self.cryomodule.set_jt_auto()
         self.finished.emit("Cryo setup for new reference parameters in ~1 hour")
 
 
@@ -112,7 +145,7 @@ class RFWorker(Worker):
 
 class Q0Worker(RFWorker):
     def run(self) -> None:
-        if caget(self.cryomodule.cryo_access_pv) != q0_utils.CRYO_ACCESS_VALUE:
+        if not self.cryomodule.has_cryo_access:
             self.error.emit("Required cryo permissions not granted - call cryo ops")
             return
 
@@ -128,9 +161,32 @@ class Q0Worker(RFWorker):
             self.error.emit(str(e))
 
 
+class Q0ResumeWorker(Worker):
+    def __init__(self, cryomodule: Q0Cryomodule):
+        super().__init__()
+        self.cryomodule = cryomodule
+
+    def run(self) -> None:
+        if not self.cryomodule.has_cryo_access:
+            self.error.emit("Required cryo permissions not granted - call cryo ops")
+            return
+
+        try:
+            self.status.emit("Resuming interrupted Q0 Measurement")
+            self.cryomodule.resume_q0_measurement()
+            self.finished.emit(f"Recorded Q0: {self.cryomodule.q0_measurement.q0:.2e}")
+        except (
+            CavityAbortError,
+            q0_utils.CryoError,
+            q0_utils.DataError,
+            q0_utils.Q0AbortError,
+        ) as e:
+            self.error.emit(str(e))
+
+
 class Q0SetupWorker(RFWorker):
     def run(self) -> None:
-        if caget(self.cryomodule.cryo_access_pv) != q0_utils.CRYO_ACCESS_VALUE:
+        if not self.cryomodule.has_cryo_access:
             self.error.emit("Required cryo permissions not granted - call cryo ops")
             return
 
@@ -156,8 +212,7 @@ class CavityRampWorker(Worker):
     def run(self) -> None:
         try:
             self.status.emit(f"Ramping Cavity {self.cavity.number} to {self.des_amp}")
-            self.cavity.turn_on()
-            self.cavity.walk_amp(self.des_amp, step_size=0.1)
+            turn_on_cavity(self.cavity, self.des_amp)
             self.finished.emit(
                 f"Cavity {self.cavity.number} ramped up to {self.des_amp}"
             )
@@ -188,7 +243,7 @@ class CalibrationWorker(Worker):
         self.ll_drop = ll_drop
 
     def run(self) -> None:
-        if caget(self.cryomodule.cryo_access_pv) != q0_utils.CRYO_ACCESS_VALUE:
+        if not self.cryomodule.has_cryo_access:
             self.error.emit("Required cryo permissions not granted - call cryo ops")
             return
         try:
@@ -212,6 +267,36 @@ class CalibrationWorker(Worker):
             self.error.emit(str(e))
 
 
+class CalibrationResumeWorker(Worker):
+    def __init__(self, cryomodule: Q0Cryomodule):
+        super().__init__()
+        self.cryomodule = cryomodule
+
+    def run(self) -> None:
+        if not self.cryomodule.has_cryo_access:
+            self.error.emit("Required cryo permissions not granted - call cryo ops")
+            return
+        try:
+            self.status.emit("Resuming interrupted calibration")
+            self.cryomodule.resume_calibration()
+            self.finished.emit("Calibration Loaded")
+        except (
+            ConnectTimeoutError,
+            ConnectTimeout,
+            q0_utils.CryoError,
+            q0_utils.DataError,
+            q0_utils.Q0AbortError,
+        ) as e:
+            self.error.emit(str(e))
+
+
+def ask_to_resume(title, message: str) -> bool:
+    answer = QMessageBox.question(
+        None, title, message, QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+    )
+    return answer == QMessageBox.Yes
+
+
 def make_error_popup(title, message: str):
     popup = QMessageBox()
     popup.setIcon(QMessageBox.Critical)
@@ -247,78 +332,751 @@ class CavAmpControl:
         self.aact_label.channel = cavity.aact_pv
 
 
+# The session models hand out raw values (epoch seconds, floats) under this
+# role for sorting and range filters; what's displayed is only formatted when
+# a row actually gets drawn
+SORT_ROLE = Qt.UserRole
+
+# Shown instead of the earliest date a date filter can be set to, which means
+# it isn't filtering
+NO_DATE_LIMIT = QDate(2000, 1, 1)
+
+
+@dataclass
+class SessionColumn:
+    header: str
+    display: Callable[[Any], str]
+    # Has to be a number, missing values included, so the proxy can sort by it
+    value: Callable[[Any], float]
+
+
+def _number_or_min(value: Optional[float]) -> float:
+    return -np.inf if value is None else value
+
+
+def _format_number(value: Optional[float], fmt: str) -> str:
+    return "" if value is None else format(value, fmt)
+
+
+CALIBRATION_COLUMNS = [
+    SessionColumn(
+        "Start Time",
+        lambda record: record.time_stamp,
+        lambda record: record.start_epoch,
+    ),
+    SessionColumn(
+        "Slope",
+        lambda record: _format_number(record.slope, ".3e"),
+        lambda record: _number_or_min(record.slope),
+    ),
+    SessionColumn(
+        "JT Position (%)",
+        lambda record: _format_number(
+            record.valve_params and record.valve_params.refValvePos, ".1f"
+        ),
+        lambda record: _number_or_min(
+            record.valve_params and record.valve_params.refValvePos
+        ),
+    ),
+    SessionColumn(
+        "Reference Heat Load (W)",
+        lambda record: _format_number(
+            record.valve_params and record.valve_params.refHeatLoadAct, ".1f"
+        ),
+        lambda record: _number_or_min(
+            record.valve_params and record.valve_params.refHeatLoadAct
+        ),
+    ),
+]
+
+Q0_COLUMNS = [
+    SessionColumn(
+        "Start Time",
+        lambda record: record.time_stamp,
+        lambda record: record.start_epoch,
+    ),
+    SessionColumn(
+        "Q0",
+        lambda record: _format_number(record.q0, ".2e"),
+        lambda record: _number_or_min(record.q0),
+    ),
+    # Sorted by effective amplitude, filtered by the per cavity text
+    SessionColumn(
+        "Cavity Amplitudes (MV)",
+        lambda record: ", ".join(
+            f"{cav_num}: {amp}" for cav_num, amp in record.amplitudes.items()
+        ),
+        lambda record: (
+            q0_utils.calc_effective_amplitude(record.amplitudes)
+            if record.amplitudes
+            else -np.inf
+        ),
+    ),
+    SessionColumn(
+        "Calibration Used",
+        lambda record: record.calibration_time_stamp or "",
+        lambda record: (
+            q0_catalog.to_epoch(record.calibration_time_stamp)
+            if record.calibration_time_stamp
+            else -np.inf
+        ),
+    ),
+]
+
+
+class SessionTableModel(QAbstractTableModel):
+    """
+    One cryomodule's catalogued sessions. Refreshing only fetches the ones
+    saved since the last refresh, updating the rows it already has (results
+    get saved again when a session is reanalysed or reimported) and
+    appending the rest.
+    """
+
+    def __init__(
+        self,
+        columns: List[SessionColumn],
+        fetch: Callable[[str, Optional[int]], List],
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.columns = columns
+        # (cm_name, after_version) -> catalog records
+        self.fetch = fetch
+        self.cm_name: Optional[str] = None
+        self.records: List = []
+        self.values: List[Tuple[float, ...]] = []
+        # Catalog row id -> row
+        self.rows: Dict[int, int] = {}
+        self.last_version: Optional[int] = None
+        self.data_version: Optional[Tuple[int, int]] = None
+
+    def set_cryomodule(self, cm_name: str):
+        if cm_name != self.cm_name:
+            self.beginResetModel()
+            self.cm_name = cm_name
+            self.records = []
+            self.values = []
+            self.rows = {}
+            self.last_version = None
+            self.endResetModel()
+        self.refresh()
+
+    def refresh(self):
+        if self.cm_name is None:
+            return
+
+        self.data_version = q0_catalog.data_version()
+        fetched = self.fetch(self.cm_name, self.last_version)
+        if not fetched:
+            return
+        self.last_version = max(
+            [record.version for record in fetched] + [self.last_version or 0]
+        )
+
+        new_records = []
+        for record in fetched:
+            row = self.rows.get(record.id)
+            if row is None:
+                new_records.append(record)
+                continue
+            self.records[row] = record
+            self.values[row] = tuple(column.value(record) for column in self.columns)
+            self.dataChanged.emit(
+                self.index(row, 0), self.index(row, len(self.columns) - 1)
+            )
+        if not new_records:
+            return
+
+        new_values = [
+            tuple(column.value(record) for column in self.columns)
+            for record in new_records
+        ]
+
+        # A sorted proxy sorts everything in one go after a reset, but places
+        # inserted rows one at a time
+        first = len(self.records)
+        if not self.records:
+            self.beginResetModel()
+            self.records = new_records
+            self.values = new_values
+        else:
+            self.beginInsertRows(QModelIndex(), first, first + len(new_records) - 1)
+            self.records.extend(new_records)
+            self.values.extend(new_values)
+        for row, record in enumerate(new_records, first):
+            self.rows[record.id] = row
+        if first:
+            self.endInsertRows()
+        else:
+            self.endResetModel()
+
+    def refresh_if_changed(self):
+        """Skips the query if nothing's been written to the catalog since"""
+        if q0_catalog.data_version() != self.data_version:
+            self.refresh()
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.records)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index: QModelIndex, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self.columns[index.column()].display(self.records[index.row()])
+        if role == SORT_ROLE:
+            return self.values[index.row()][index.column()]
+        return None
+
+    def headerData(self, section: int, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.columns[section].header
+        return super().headerData(section, orientation, role)
+
+    def time_stamp(self, row: int) -> str:
+        return self.records[row].time_stamp
+
+
+class SessionFilterProxyModel(QSortFilterProxyModel):
+    """
+    Sorts by the raw values and filters on text anywhere in a row as well as
+    on ranges of any of the columns' raw values
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setSortRole(SORT_ROLE)
+        self.setFilterKeyColumn(-1)
+        self.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.ranges: Dict[int, Tuple[Optional[float], Optional[float]]] = {}
+
+    def set_range(self, column: int, low: Optional[float], high: Optional[float]):
+        self.ranges[column] = (low, high)
+        self.invalidateFilter()
+
+    def lessThan(self, left: QModelIndex, right: QModelIndex) -> bool:
+        # Straight from the model's cached values rather than through data()
+        values = self.sourceModel().values
+        column = left.column()
+        return values[left.row()][column] < values[right.row()][column]
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+        values = self.sourceModel().values[source_row]
+        for column, (low, high) in self.ranges.items():
+            if low is not None and values[column] < low:
+                return False
+            if high is not None and values[column] > high:
+                return False
+        return super().filterAcceptsRow(source_row, source_parent)
+
+
+class SessionPicker(QWidget):
+    """
+    Sortable, filterable table of sessions. Only the rows on screen get
+    drawn, and while it's showing it picks up sessions as they're catalogued.
+    range_columns are the numeric columns to offer min/max filters for.
+    """
+
+    session_selected = pyqtSignal(str)
+    # The current session followed by its neighbours, nearest first
+    sessions_browsed = pyqtSignal(list)
+
+    def __init__(
+        self,
+        columns: List[SessionColumn],
+        fetch: Callable[[str, Optional[int]], List],
+        range_columns: Iterable[int] = (),
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.model = SessionTableModel(columns, fetch, self)
+        self.proxy = SessionFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Filter")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_edit.textChanged.connect(self.proxy.setFilterFixedString)
+
+        self.start_date_edit = self.make_date_edit()
+        self.end_date_edit = self.make_date_edit()
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.search_edit)
+        filter_layout.addWidget(QLabel("From"))
+        filter_layout.addWidget(self.start_date_edit)
+        filter_layout.addWidget(QLabel("To"))
+        filter_layout.addWidget(self.end_date_edit)
+
+        self.range_edits: Dict[int, Tuple[QLineEdit, QLineEdit]] = {}
+        for column in range_columns:
+            low_edit = self.make_number_edit(f"Min {columns[column].header}")
+            high_edit = self.make_number_edit(f"Max {columns[column].header}")
+            self.range_edits[column] = (low_edit, high_edit)
+            filter_layout.addWidget(low_edit)
+            filter_layout.addWidget(high_edit)
+
+        self.view = QTableView()
+        self.view.setModel(self.proxy)
+        self.view.setSortingEnabled(True)
+        self.view.sortByColumn(0, Qt.DescendingOrder)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.setWordWrap(False)
+        self.view.verticalHeader().hide()
+        # Fixed row heights so scrolling never has to measure rows off screen
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        self.view.doubleClicked.connect(self.select_session)
+        self.view.selectionModel().currentRowChanged.connect(self.browse)
+
+        self.load_button = QPushButton("Load")
+        self.load_button.clicked.connect(
+            lambda: self.select_session(self.view.currentIndex())
+        )
+
+        layout = QVBoxLayout()
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.view)
+        layout.addWidget(self.load_button)
+        self.setLayout(layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(q0_utils.SESSION_PICKER_REFRESH_INTERVAL * 1000)
+        self.refresh_timer.timeout.connect(self.model.refresh_if_changed)
+
+    def make_date_edit(self) -> QDateEdit:
+        date_edit = QDateEdit()
+        date_edit.setCalendarPopup(True)
+        date_edit.setMinimumDate(NO_DATE_LIMIT)
+        date_edit.setSpecialValueText("Any")
+        date_edit.setDate(NO_DATE_LIMIT)
+        date_edit.dateChanged.connect(self.update_date_range)
+        return date_edit
+
+    def make_number_edit(self, placeholder: str) -> QLineEdit:
+        number_edit = QLineEdit()
+        number_edit.setPlaceholderText(placeholder)
+        number_edit.setValidator(QDoubleValidator())
+        number_edit.textChanged.connect(self.update_ranges)
+        return number_edit
+
+    @staticmethod
+    def date_epoch(date_edit: QDateEdit, days_after: int = 0) -> Optional[float]:
+        if date_edit.date() == NO_DATE_LIMIT:
+            return None
+        date = date_edit.date().addDays(days_after)
+        return datetime(date.year(), date.month(), date.day()).timestamp()
+
+    @pyqtSlot()
+    def update_date_range(self):
+        # Sessions from any time on the end date count
+        end = self.date_epoch(self.end_date_edit, days_after=1)
+        self.proxy.set_range(
+            0, self.date_epoch(self.start_date_edit), None if end is None else end - 1
+        )
+
+    @pyqtSlot()
+    def update_ranges(self):
+        for column, edits in self.range_edits.items():
+            low, high = (
+                float(edit.text()) if edit.hasAcceptableInput() else None
+                for edit in edits
+            )
+            self.proxy.set_range(column, low, high)
+
+    def set_cryomodule(self, cm_name: str):
+        self.model.set_cryomodule(cm_name)
+
+    def time_stamp_at(self, view_row: int) -> str:
+        return self.model.time_stamp(
+            self.proxy.mapToSource(self.proxy.index(view_row, 0)).row()
+        )
+
+    @pyqtSlot(QModelIndex)
+    def select_session(self, index: QModelIndex):
+        if index.isValid():
+            self.session_selected.emit(self.time_stamp_at(index.row()))
+
+    @pyqtSlot(QModelIndex, QModelIndex)
+    def browse(self, current: QModelIndex, previous: QModelIndex):
+        if not current.isValid():
+            return
+        rows = [current.row()]
+        for offset in range(1, q0_utils.SESSION_PREFETCH_NEIGHBOURS + 1):
+            rows += [current.row() + offset, current.row() - offset]
+        self.sessions_browsed.emit(
+            [
+                self.time_stamp_at(row)
+                for row in rows
+                if 0 <= row < self.proxy.rowCount()
+            ]
+        )
+
+    def showEvent(self, event):
+        self.model.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
+
+
+class SessionLoader(QObject):
+    """
+    Loads sessions through the session cache off the GUI thread. Only the
+    most recent request gets reported, so a slow load can't replace a
+    session that was picked after it.
+    """
+
+    loaded = pyqtSignal(object, object)
+    error = pyqtSignal(str)
+    # Emitted from whichever thread finished the load, delivered on this one
+    load_done = pyqtSignal(object, object)
+
+    def __init__(self, kind: q0_session_cache.SessionKind):
+        super().__init__()
+        self.kind = kind
+        self.request: Optional[Tuple[Q0Cryomodule, str]] = None
+        self.load_done.connect(self.finish)
+
+    def load(self, cryomodule: Q0Cryomodule, time_stamp: str):
+        request = (cryomodule, time_stamp)
+        self.request = request
+        future = q0_session_cache.SESSIONS.get(self.kind, cryomodule, time_stamp)
+        future.add_done_callback(partial(self.load_done.emit, request))
+
+    def prefetch(self, cryomodule: Q0Cryomodule, time_stamps: List[str]):
+        q0_session_cache.SESSIONS.prefetch(self.kind, cryomodule, time_stamps)
+
+    @pyqtSlot(object, object)
+    def finish(self, request: Tuple[Q0Cryomodule, str], future: Future):
+        if request is not self.request:
+            return
+        self.request = None
+
+        cryomodule, time_stamp = request
+        try:
+            session = future.result()
+        except (q0_utils.DataError, KeyError, OSError, ValueError) as e:
+            self.error.emit(
+                f"Unable to load CM{cryomodule.name} {self.kind.name}"
+                f" from {time_stamp}: {e}"
+            )
+            return
+        self.loaded.emit(cryomodule, session)
+
+
 class Q0Options(QObject):
     q0_loaded_signal = pyqtSignal(str)
+    q0_error_signal = pyqtSignal(str)
 
     def __init__(self, cryomodule: Q0Cryomodule):
         super().__init__()
-        self.cryomodule = cryomodule
-        self.main_groupbox: QGroupBox = QGroupBox(
-            f"Q0 Measurements for CM{cryomodule.name}"
+        self.cryomodule: Optional[Q0Cryomodule] = None
+        self.main_groupbox: QGroupBox = QGroupBox()
+        self.picker = SessionPicker(
+            Q0_COLUMNS,
+            lambda cm_name, after_version: q0_catalog.q0_measurements(
+                cm_name, after_version=after_version
+            ),
+            range_columns=[1],
         )
-        grid_layout: QGridLayout = QGridLayout()
-        self.main_groupbox.setLayout(grid_layout)
-
-        with open(cryomodule.q0_idx_file, "r+") as f:
-            q0_measurements: Dict = json.load(f)
-            col_count = get_dimensions(q0_measurements)
-            for idx, time_stamp in enumerate(q0_measurements.keys()):
-                cav_amps = q0_measurements[time_stamp]["Cavity Amplitudes"]
-                radio_button: QRadioButton = QRadioButton(
-                    f"{time_stamp}: \n{json.dumps(cav_amps, indent=4)}"
-                )
-                grid_layout.addWidget(
-                    radio_button, int(idx / col_count), idx % col_count
-                )
-                radio_button.clicked.connect(partial(self.load_q0, time_stamp))
+        self.picker.session_selected.connect(self.load_q0)
+        self.picker.sessions_browsed.connect(self.prefetch)
+        self.loader = SessionLoader(q0_session_cache.Q0_MEASUREMENTS)
+        self.loader.loaded.connect(self.use_q0)
+        self.loader.error.connect(self.q0_error_signal)
+        layout = QVBoxLayout()
+        layout.addWidget(self.picker)
+        self.main_groupbox.setLayout(layout)
+        self.set_cryomodule(cryomodule)
 
-    @pyqtSlot()
+    def set_cryomodule(self, cryomodule: Q0Cryomodule):
+        self.cryomodule = cryomodule
+        self.main_groupbox.setTitle(f"Q0 Measurements for CM{cryomodule.name}")
+        self.picker.set_cryomodule(cryomodule.name)
+
+    @pyqtSlot(list)
+    def prefetch(self, time_stamps: List[str]):
+        self.loader.prefetch(self.cryomodule, time_stamps)
+
+    @pyqtSlot(str)
     def load_q0(self, timestamp: str):
-        self.cryomodule.load_q0_measurement(time_stamp=timestamp)
+        self.loader.load(self.cryomodule, timestamp)
+
+    @pyqtSlot(object, object)
+    def use_q0(self, cryomodule: Q0Cryomodule, q0_measurement):
+        cryomodule.use_q0_measurement(q0_measurement)
         self.q0_loaded_signal.emit(
             f"Loaded q0 measurement for"
-            f" CM{self.cryomodule.name} from {timestamp}"
-            f" with q0 {self.cryomodule.q0_measurement.q0:.2e}"
+            f" CM{cryomodule.name} from {q0_measurement.start_time}"
+            f" with q0 {q0_measurement.q0:.2e}"
         )
 
 
-def get_dimensions(options):
-    num_options = len(options.keys())
-    row_count = int(np.sqrt(num_options))
-    col_count = int(np.ceil(np.sqrt(num_options)))
-    if row_count * col_count != num_options:
-        col_count += 1
-    return col_count
-
-
 class CalibrationOptions(QObject):
     cal_loaded_signal = pyqtSignal(str)
+    cal_error_signal = pyqtSignal(str)
 
     def __init__(self, cryomodule: Q0Cryomodule):
         super().__init__()
-        self.cryomodule = cryomodule
-        self.main_groupbox: QGroupBox = QGroupBox(
-            f"Calibrations for CM{cryomodule.name}"
+        self.cryomodule: Optional[Q0Cryomodule] = None
+        self.main_groupbox: QGroupBox = QGroupBox()
+        self.picker = SessionPicker(
+            CALIBRATION_COLUMNS,
+            lambda cm_name, after_version: q0_catalog.calibrations(
+                cm_name, after_version=after_version
+            ),
         )
-        grid_layout: QGridLayout = QGridLayout()
-        self.main_groupbox.setLayout(grid_layout)
+        self.picker.session_selected.connect(self.load_calibration)
+        self.picker.sessions_browsed.connect(self.prefetch)
+        self.loader = SessionLoader(q0_session_cache.CALIBRATIONS)
+        self.loader.loaded.connect(self.use_calibration)
+        self.loader.error.connect(self.cal_error_signal)
+        layout = QVBoxLayout()
+        layout.addWidget(self.picker)
+        self.main_groupbox.setLayout(layout)
+        self.set_cryomodule(cryomodule)
 
-        with open(cryomodule.calib_idx_file, "r+") as f:
-            calibrations: Dict = json.load(f)
-            col_count = get_dimensions(calibrations)
+    def set_cryomodule(self, cryomodule: Q0Cryomodule):
+        self.cryomodule = cryomodule
+        self.main_groupbox.setTitle(f"Calibrations for CM{cryomodule.name}")
+        self.picker.set_cryomodule(cryomodule.name)
 
-            for idx, time_stamp in enumerate(calibrations.keys()):
-                radio_button: QRadioButton = QRadioButton(time_stamp)
-                grid_layout.addWidget(
-                    radio_button, int(idx / col_count), idx % col_count
-                )
-                radio_button.clicked.connect(partial(self.load_calibration, time_stamp))
+    @pyqtSlot(list)
+    def prefetch(self, time_stamps: List[str]):
+        self.loader.prefetch(self.cryomodule, time_stamps)
 
-    @pyqtSlot()
+    @pyqtSlot(str)
     def load_calibration(self, timestamp: str):
-        self.cryomodule.load_calibration(time_stamp=timestamp)
+        self.loader.load(self.cryomodule, timestamp)
+
+    @pyqtSlot(object, object)
+    def use_calibration(self, cryomodule: Q0Cryomodule, calibration):
+        cryomodule.use_calibration(calibration)
         self.cal_loaded_signal.emit(
             f"Loaded calibration for"
-            f" CM{self.cryomodule.name} from {timestamp}"
-            f" with slope {self.cryomodule.calibration.dLLdt_dheat:.2e}"
+            f" CM{cryomodule.name} from {calibration.time_stamp}"
+            f" with slope {calibration.dLLdt_dheat:.2e}"
+        )
+
+
+# Pyramids of the runs plotted so far, rebuilt if a run has gained points
+LL_PYRAMIDS: "WeakKeyDictionary[q0_utils.DataRun, DecimationPyramid]" = (
+    WeakKeyDictionary()
+)
+
+
+def ll_pyramid(run: q0_utils.DataRun) -> DecimationPyramid:
+    pyramid = LL_PYRAMIDS.get(run)
+    if pyramid is None or len(pyramid) != run.num_ll_points:
+        pyramid = DecimationPyramid(run.ll_timestamps, run.ll_values)
+        LL_PYRAMIDS[run] = pyramid
+    return pyramid
+
+
+class DecimatedCurve:
+    """
+    A curve that only ever holds the points of its trace that show at the
+    plot's current zoom, picked again from the trace's pyramid whenever the
+    view moves. Give it a new trace rather than making a new curve.
+    """
+
+    def __init__(self, plot_widget: PlotWidget):
+        self.item: PlotDataItem = plot_widget.plot()
+        self.view_box: ViewBox = plot_widget.getViewBox()
+        self.pyramid: Optional[DecimationPyramid] = None
+        self.view_box.sigXRangeChanged.connect(self.update_view)
+        self.view_box.sigResized.connect(self.update_view)
+
+    def set_trace(self, pyramid: DecimationPyramid):
+        self.pyramid = pyramid
+        self.item.show()
+        self.update_view()
+
+    def clear(self):
+        self.pyramid = None
+        self.item.clear()
+        self.item.hide()
+
+    def update_view(self, *args):
+        if not self.pyramid:
+            return
+
+        (view_min, view_max), _ = self.view_box.viewRange()
+        trace_min, trace_max = self.pyramid.x_range
+        if self.view_box.autoRangeEnabled()[0]:
+            # The view gets fitted to the curve's bounds, so the curve has to
+            # reach both ends of the trace for that to come out right
+            x_min, x_max = trace_min, trace_max
+        else:
+            x_min, x_max = max(view_min, trace_min), min(view_max, trace_max)
+            if x_min > x_max:
+                self.item.clear()
+                return
+
+        # A couple of points per pixel across the part of the plot it covers
+        fraction = min((x_max - x_min) / max(view_max - view_min, 1e-12), 1)
+        max_points = int(2 * self.view_box.width() * fraction)
+        self.item.setData(*self.pyramid.view(x_min, x_max, max_points))
+
+
+def show_traces(
+    plot_widget: PlotWidget,
+    curves: List[DecimatedCurve],
+    runs: Iterable[q0_utils.DataRun],
+):
+    """
+    Points the plot's curves at the runs' liquid level traces, adding curves
+    if there are more runs than last time and clearing the spare ones
+    """
+    runs = [run for run in runs if run.num_ll_points]
+    while len(curves) < len(runs):
+        curves.append(DecimatedCurve(plot_widget))
+
+    for curve, run in zip(curves, runs):
+        curve.set_trace(ll_pyramid(run))
+    for curve in curves[len(runs) :]:
+        curve.clear()
+
+
+class LiveRunDashboard(QWidget):
+    """
+    The run a cryomodule is recording as it comes in: its liquid level with
+    the running dLL/dt fit and error band (extended to when the run is
+    projected to end), and the heater and pressure running averages.
+    Redraws on a timer while it's showing; the samples come from a
+    LiveRunFeed so drawing never holds up the monitor callbacks.
+    """
+
+    def __init__(self, cryomodule: Q0Cryomodule, parent=None):
+        super().__init__(parent)
+        self.feed = LiveRunFeed(cryomodule)
+
+        self.plot = PlotWidget(axisItems={"bottom": DateAxisItem()})
+        self.plot.setLabel("left", "Downstream Liquid Level (%)")
+        self.samples: PlotDataItem = self.plot.plot()
+        self.band_high = PlotCurveItem()
+        self.band_low = PlotCurveItem()
+        self.band = FillBetweenItem(
+            self.band_high, self.band_low, brush=(255, 0, 0, 60)
         )
+        self.plot.addItem(self.band)
+        self.fit: PlotDataItem = self.plot.plot(pen=mkPen("r", width=2))
+
+        self.run_label = QLabel()
+        self.slope_label = QLabel()
+        self.end_label = QLabel()
+        self.heater_label = QLabel()
+        self.pressure_label = QLabel()
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.plot)
+        for label in (
+            self.run_label,
+            self.slope_label,
+            self.end_label,
+            self.heater_label,
+            self.pressure_label,
+        ):
+            layout.addWidget(label)
+        self.setLayout(layout)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(
+            int(q0_utils.LIVE_DASHBOARD_REFRESH_INTERVAL * 1000)
+        )
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.show_idle()
+
+    def set_cryomodule(self, cryomodule: Q0Cryomodule):
+        if cryomodule is not self.feed.cryomodule:
+            self.feed = LiveRunFeed(cryomodule)
+            self.show_idle()
+
+    def show_idle(self):
+        for item in (self.samples, self.fit, self.band_high, self.band_low):
+            item.setData([], [])
+        self.run_label.setText(f"CM{self.feed.cryomodule.name} isn't recording")
+        for label in (
+            self.slope_label,
+            self.end_label,
+            self.heater_label,
+            self.pressure_label,
+        ):
+            label.clear()
+
+    @pyqtSlot()
+    def refresh(self):
+        snapshot: Optional[LiveSnapshot] = self.feed.poll()
+        if not snapshot:
+            self.show_idle()
+            return
+
+        self.samples.setData(snapshot.timestamps, snapshot.values)
+        self.draw_fit(snapshot)
+
+        self.run_label.setText(
+            f"CM{self.feed.cryomodule.name} {snapshot.name}:"
+            f" {snapshot.num_points} samples, averaged level"
+            f" {snapshot.level:.2f}%"
+        )
+        slope_text = (
+            f"dLL/dt {snapshot.slope:.3e} +/- {snapshot.std_err:.1e} %/s"
+            f" (relative error {snapshot.relative_error:.2%}"
+        )
+        if snapshot.target_rel_error:
+            slope_text += f", target {snapshot.target_rel_error:.2%}"
+        self.slope_label.setText(slope_text + ")")
+
+        if snapshot.projected_end is None:
+            self.end_label.setText("Projected end: not known yet")
+        else:
+            end = datetime.fromtimestamp(snapshot.projected_end)
+            remaining = timedelta(
+                seconds=round(snapshot.projected_end - snapshot.latest)
+            )
+            self.end_label.setText(
+                f"Projected end: {end.strftime(q0_utils.DATETIME_FORMATTER)}"
+                f" ({remaining} from the latest sample)"
+            )
+
+        self.heater_label.setText(f"Average heater readback: {snapshot.heater:.2f} W")
+        if snapshot.pressure is None:
+            self.pressure_label.clear()
+        else:
+            self.pressure_label.setText(f"Average pressure: {snapshot.pressure:.3f}")
+
+    def draw_fit(self, snapshot: LiveSnapshot):
+        if not np.isfinite(snapshot.slope):
+            for item in (self.fit, self.band_high, self.band_low):
+                item.setData([], [])
+            return
+
+        end = snapshot.latest
+        if snapshot.projected_end is not None:
+            end = snapshot.projected_end
+        ends = np.array([snapshot.timestamps[0], end])
+        self.fit.setData(ends, snapshot.fit(ends))
+
+        if np.isfinite(snapshot.std_err):
+            width = q0_utils.LIVE_ERROR_BAND_SIGMAS * snapshot.std_err
+            self.band_high.setData(ends, snapshot.fit(ends, snapshot.slope + width))
+            self.band_low.setData(ends, snapshot.fit(ends, snapshot.slope - width))
+        else:
+            self.band_high.setData([], [])
+            self.band_low.setData([], [])
+
+    def showEvent(self, event):
+        self.refresh()
+        self.refresh_timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.refresh_timer.stop()
+        super().hideEvent(event)
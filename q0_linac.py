@@ -1,13 +1,10 @@
-import json
+import threading
+from dataclasses import asdict
 from datetime import datetime, timedelta
 from os.path import isfile
-from time import sleep
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional
 
 import numpy as np
-from epics import caget, camonitor, camonitor_clear, caput
-from lcls_tools.common.controls.pyepics.utils import PV
-from lcls_tools.common.data_analysis.archiver import get_values_over_time_range
 from lcls_tools.superconducting.sc_linac import (
     Cavity,
     Machine,
@@ -18,305 +15,35 @@ from lcls_tools.superconducting.sc_linac import (
     SSA,
     StepperTuner,
 )
-from numpy import floor, linspace, sign
-from scipy.signal import medfilt
-from scipy.stats import linregress
+from numpy import linspace
 
+import q0_filters
+import q0_session_cache
+import q0_store
 import q0_utils
-
-
-class Calibration:
-    def __init__(self, time_stamp, cryomodule):
-        # type: (str, Q0Cryomodule) -> None
-
-        self.time_stamp: str = time_stamp
-        self.cryomodule: Q0Cryomodule = cryomodule
-
-        self.heater_runs: List[q0_utils.HeaterRun] = []
-        self._slope = None
-        self.adjustment = 0
-
-    def load_data(self):
-        self.heater_runs: List[q0_utils.HeaterRun] = []
-
-        with open(self.cryomodule.calib_data_file, "r+") as f:
-            all_data: Dict = json.load(f)
-            data: Dict = all_data[self.time_stamp]
-
-            for heater_run_data in data.values():
-                run = q0_utils.HeaterRun(heater_run_data["Desired Heat Load"])
-                run._start_time = datetime.strptime(
-                    heater_run_data[q0_utils.JSON_START_KEY],
-                    q0_utils.DATETIME_FORMATTER,
-                )
-                run._end_time = datetime.strptime(
-                    heater_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
-                )
-
-                ll_data = {}
-                for timestamp_str, val in heater_run_data[q0_utils.JSON_LL_KEY].items():
-                    ll_data[float(timestamp_str)] = val
-
-                run.ll_data = ll_data
-                run.average_heat = heater_run_data[q0_utils.JSON_HEATER_READBACK_KEY]
-
-                self.heater_runs.append(run)
-
-            with open(self.cryomodule.calib_idx_file, "r+") as f:
-                all_data: Dict = json.load(f)
-                data: Dict = all_data[self.time_stamp]
-
-                self.cryomodule.valveParams = q0_utils.ValveParams(
-                    refValvePos=data["JT Valve Position"],
-                    refHeatLoadDes=data["Total Reference Heater Setpoint"],
-                    refHeatLoadAct=data["Total Reference Heater Readback"],
-                )
-                print("Loaded new reference parameters")
-
-    def save_data(self):
-        new_data = {}
-        for idx, heater_run in enumerate(self.heater_runs):
-            key = heater_run.start_time
-            heater_data = {
-                q0_utils.JSON_START_KEY: heater_run.start_time,
-                q0_utils.JSON_END_KEY: heater_run.end_time,
-                "Desired Heat Load": heater_run.heat_load_des,
-                q0_utils.JSON_HEATER_READBACK_KEY: heater_run.average_heat,
-                q0_utils.JSON_DLL_KEY: heater_run.dll_dt,
-                q0_utils.JSON_LL_KEY: heater_run.ll_data,
-            }
-
-            new_data[key] = heater_data
-
-        q0_utils.update_json_data(
-            self.cryomodule.calib_data_file, self.time_stamp, new_data
-        )
-
-    def save_results(self):
-        newData = {
-            q0_utils.JSON_START_KEY: self.time_stamp,
-            "Calculated Heat vs dll/dt Slope": self.dLLdt_dheat,
-            "Calculated Adjustment": self.adjustment,
-            "Total Reference Heater Setpoint": self.cryomodule.valveParams.refHeatLoadDes,
-            "Total Reference Heater Readback": self.cryomodule.valveParams.refHeatLoadAct,
-            "JT Valve Position": self.cryomodule.valveParams.refValvePos,
-        }
-        q0_utils.update_json_data(
-            self.cryomodule.calib_idx_file, self.time_stamp, newData
-        )
-
-    @property
-    def dLLdt_dheat(self):
-        if not self._slope:
-            heat_loads = []
-            dll_dts = []
-            for run in self.heater_runs:
-                heat_loads.append(run.average_heat)
-                dll_dts.append(run.dll_dt)
-
-            slope, intercept, r_val, p_val, std_err = linregress(heat_loads, dll_dts)
-
-            if np.isnan(slope):
-                self._slope = None
-            else:
-                self.adjustment = intercept
-                self._slope = slope
-
-        return self._slope
-
-    def get_heat(self, dll_dt: float):
-        return (dll_dt - self.adjustment) / self.dLLdt_dheat
-
-
-class RFRun(q0_utils.DataRun):
-    def __init__(self, amplitudes: Dict[int, float]):
-        super().__init__()
-        self.amplitudes = amplitudes
-        self.pressure_buffer = []
-        self._avg_pressure = None
-
-    @property
-    def avg_pressure(self):
-        if not self._avg_pressure:
-            self._avg_pressure = np.mean(self.pressure_buffer)
-        return self._avg_pressure
-
-    @avg_pressure.setter
-    def avg_pressure(self, value: float):
-        self._avg_pressure = value
-
-
-class Q0Measurement:
-    def __init__(self, cryomodule):
-        # type: (Q0Cryomodule) -> None
-        self.cryomodule: Q0Cryomodule = cryomodule
-        self.heater_run: Optional[q0_utils.HeaterRun] = None
-        self.rf_run: Optional[RFRun] = None
-        self._raw_heat: Optional[float] = None
-        self._adjustment: Optional[float] = None
-        self._heat_load: Optional[float] = None
-        self._q0: Optional[float] = None
-        self._start_time: Optional[str] = None
-        self._amplitudes: Optional[Dict[int, float]] = None
-        self._heater_run_heatload: Optional[float] = None
-
-    @property
-    def amplitudes(self):
-        return self._amplitudes
-
-    @amplitudes.setter
-    def amplitudes(self, amplitudes: Dict[int, float]):
-        self._amplitudes = amplitudes
-        self.rf_run = RFRun(amplitudes)
-
-    @property
-    def heater_run_heatload(self):
-        return self._heater_run_heatload
-
-    @heater_run_heatload.setter
-    def heater_run_heatload(self, heat_load: float):
-        self._heater_run_heatload = heat_load
-        self.heater_run = q0_utils.HeaterRun(heat_load)
-
-    @property
-    def start_time(self):
-        return self._start_time
-
-    @start_time.setter
-    def start_time(self, start_time: datetime):
-        if not self._start_time:
-            self._start_time = start_time.strftime(q0_utils.DATETIME_FORMATTER)
-
-    def load_data(self, time_stamp: str):
-        # TODO need to load the other parameters
-        self.start_time = datetime.strptime(time_stamp, q0_utils.DATETIME_FORMATTER)
-
-        with open(self.cryomodule.q0_data_file, "r+") as f:
-            all_data: Dict = json.load(f)
-            q0_meas_data: Dict = all_data[time_stamp]
-
-            heater_run_data: Dict = q0_meas_data[q0_utils.JSON_HEATER_RUN_KEY]
-
-            self.heater_run_heatload = heater_run_data[
-                q0_utils.JSON_HEATER_READBACK_KEY
-            ]
-            self.heater_run.average_heat = heater_run_data[
-                q0_utils.JSON_HEATER_READBACK_KEY
-            ]
-            self.heater_run.start_time = datetime.strptime(
-                heater_run_data[q0_utils.JSON_START_KEY], q0_utils.DATETIME_FORMATTER
-            )
-            self.heater_run.end_time = datetime.strptime(
-                heater_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
-            )
-            ll_data = {}
-            for time_str, val in heater_run_data[q0_utils.JSON_LL_KEY].items():
-                ll_data[float(time_str)] = val
-            self.heater_run.ll_data = ll_data
-
-            rf_run_data: Dict = q0_meas_data[q0_utils.JSON_RF_RUN_KEY]
-            cav_amps = {}
-            for cav_num_str, amp in rf_run_data[q0_utils.JSON_CAV_AMPS_KEY].items():
-                cav_amps[int(cav_num_str)] = amp
-
-            self.amplitudes = cav_amps
-            self.rf_run.start_time = datetime.strptime(
-                rf_run_data[q0_utils.JSON_START_KEY], q0_utils.DATETIME_FORMATTER
-            )
-            self.rf_run.end_time = datetime.strptime(
-                rf_run_data[q0_utils.JSON_END_KEY], q0_utils.DATETIME_FORMATTER
-            )
-            self.rf_run.average_heat = rf_run_data[q0_utils.JSON_HEATER_READBACK_KEY]
-
-            ll_data = {}
-            for time_str, val in rf_run_data[q0_utils.JSON_LL_KEY].items():
-                ll_data[float(time_str)] = val
-            self.rf_run.ll_data = ll_data
-
-            self.rf_run.avg_pressure = rf_run_data[q0_utils.JSON_AVG_PRESS_KEY]
-
-        self.save_data()
-
-    def save_data(self):
-        q0_utils.make_json_file(self.cryomodule.q0_data_file)
-        heater_data = {
-            q0_utils.JSON_START_KEY: self.heater_run.start_time,
-            q0_utils.JSON_END_KEY: self.heater_run.end_time,
-            q0_utils.JSON_LL_KEY: self.heater_run.ll_data,
-            q0_utils.JSON_HEATER_READBACK_KEY: self.heater_run.average_heat,
-            q0_utils.JSON_DLL_KEY: self.heater_run.dll_dt,
-        }
-
-        rf_data = {
-            q0_utils.JSON_START_KEY: self.rf_run.start_time,
-            q0_utils.JSON_END_KEY: self.rf_run.end_time,
-            q0_utils.JSON_LL_KEY: self.rf_run.ll_data,
-            q0_utils.JSON_HEATER_READBACK_KEY: self.rf_run.average_heat,
-            q0_utils.JSON_AVG_PRESS_KEY: self.rf_run.avg_pressure,
-            q0_utils.JSON_DLL_KEY: self.rf_run.dll_dt,
-            q0_utils.JSON_CAV_AMPS_KEY: self.rf_run.amplitudes,
-        }
-
-        new_data = {
-            q0_utils.JSON_HEATER_RUN_KEY: heater_data,
-            q0_utils.JSON_RF_RUN_KEY: rf_data,
-        }
-
-        q0_utils.update_json_data(
-            self.cryomodule.q0_data_file, self.start_time, new_data
-        )
-
-    def save_results(self):
-        newData = {
-            q0_utils.JSON_START_KEY: self.start_time,
-            q0_utils.JSON_CAV_AMPS_KEY: self.rf_run.amplitudes,
-            "Calculated Adjusted Heat Load": self.heat_load,
-            "Calculated Raw Heat Load": self.raw_heat,
-            "Calculated Adjustment": self.adjustment,
-            "Calculated Q0": self.q0,
-            "Calibration Used": self.cryomodule.calibration.time_stamp,
-        }
-
-        q0_utils.update_json_data(self.cryomodule.q0_idx_file, self.start_time, newData)
-
-    @property
-    def raw_heat(self):
-        if not self._raw_heat:
-            self._raw_heat = self.cryomodule.calibration.get_heat(self.rf_run.dll_dt)
-        return self._raw_heat
-
-    @property
-    def adjustment(self):
-        if not self._adjustment:
-            heater_run_raw_heat = self.cryomodule.calibration.get_heat(
-                self.heater_run.dll_dt
-            )
-            self._adjustment = self.heater_run.average_heat - heater_run_raw_heat
-        return self._adjustment
-
-    @property
-    def heat_load(self):
-        if not self._heat_load:
-            self._heat_load = self.raw_heat + self.adjustment
-        return self._heat_load
-
-    @property
-    def q0(self):
-        if not self._q0:
-            sum_square_amp = 0
-
-            for amp in self.rf_run.amplitudes.values():
-                sum_square_amp += amp**2
-
-            effective_amplitude = np.sqrt(sum_square_amp)
-
-            self._q0 = q0_utils.calc_q0(
-                amplitude=effective_amplitude,
-                rf_heat_load=self.heat_load,
-                avg_pressure=self.rf_run.avg_pressure,
-                cav_length=self.cryomodule.cavities[1].length,
-            )
-        return self._q0
+from q0_acquisition import (
+    Acquisition,
+    AcquisitionLoop,
+    BackgroundPhase,
+    FillPhase,
+    LockJTPhase,
+    Phase,
+    RecordPhase,
+    SetHeaterPhase,
+    WaitForCavitiesPhase,
+    WaitForLLPhase,
+)
+from q0_analysis import Calibration, Q0Measurement, RFRun, find_stable_period
+from q0_archiver import to_arrays
+from q0_epics import (
+    PVPool,
+    camonitor,
+    camonitor_clear,
+    get_values_over_time_range,
+    now,
+    sleep,
+    turn_off_cavity,
+)
 
 
 class Q0Cavity(Cavity):
@@ -348,10 +75,13 @@ class Q0Cryomodule(Cryomodule):
         stepper_class=StepperTuner,
         piezo_class=Piezo,
     ):
-        super().__init__(
-            cryo_name,
-            linac_object
-        )
+        # Notified whenever a monitored readback updates or an abort is
+        # requested, so anything waiting on those can wake up straight away
+        self.monitor_condition = threading.Condition()
+        self._abort_flag: bool = False
+        self._jt_readback: Optional[float] = None
+
+        super().__init__(cryo_name, linac_object)
 
         self.jtModePV: str = self.jt_prefix + "MODE"
         self.jt_mode_str_pv: str = self.jt_prefix + "MODE_STRING"
@@ -374,15 +104,15 @@ class Q0Cryomodule(Cryomodule):
 
         self.valveParams: Optional[q0_utils.ValveParams] = None
 
-        self._calib_idx_file = "calibrations/cm{CM}.json".format(CM=self.name)
-        self._calib_data_file = f"data/calibrations/cm{self.name}.json"
-        self._q0_idx_file = "q0_measurements/cm{CM}.json".format(CM=self.name)
-        self._q0_data_file = f"data/q0_measurements/cm{self.name}.json"
+        self._calib_data_file = q0_utils.CALIB_DATA_FILE.format(CM=self.name)
+        self._q0_data_file = q0_utils.Q0_DATA_FILE.format(CM=self.name)
+        self._checkpoint_file = q0_utils.CHECKPOINT_FILE.format(CM=self.name)
 
-        self.ll_buffer: np.array = np.empty(q0_utils.NUM_LL_POINTS_TO_AVG)
-        self.ll_buffer[:] = np.nan
         self._ll_buffer_size = q0_utils.NUM_LL_POINTS_TO_AVG
-        self.ll_buffer_idx = 0
+        self._ll_filter_name = q0_utils.LL_FILTER
+        self.ll_filter: q0_filters.LLFilter = q0_filters.make_ll_filter(
+            self._ll_filter_name, self._ll_buffer_size
+        )
 
         self.measurement_buffer = []
         self.calibration: Optional[Calibration] = None
@@ -391,18 +121,42 @@ class Q0Cryomodule(Cryomodule):
         self.cavity_amplitudes = {}
 
         self.fill_data_run_buffer = False
+        # The RecordPhase filling current_data_run, while there is one
+        self.recording_phase: Optional[RecordPhase] = None
 
-        self.abort_flag: bool = False
+        self.pvs = PVPool()
 
-        self._ds_level_pv_obj: Optional[PV] = None
+        # Shared between cryomodules being measured at once to cap how many
+        # of them have their JT valve in manual at the same time
+        self.jt_manual_slots: Optional[threading.Semaphore] = None
+        self._holds_jt_manual_slot = False
+        # Where a LockJTPhase left the JT valve in manual, until it goes back
+        # to auto
+        self.jt_locked_position: Optional[float] = None
 
     def __str__(self):
         return f"CM{self.name}"
 
-    def check_abort(self):
+    @property
+    def abort_flag(self) -> bool:
+        return self._abort_flag
+
+    @abort_flag.setter
+    def abort_flag(self, value: bool):
+        with self.monitor_condition:
+            self._abort_flag = value
+            self.monitor_condition.notify_all()
+
+    def check_abort(self, restore: bool = True):
+        """
+        Raises Q0AbortError if an abort was requested, restoring the cryo
+        first unless restore is False (for the acquisition loop, which can't
+        wait on it and restores in the background instead)
+        """
         if self.abort_flag:
             self.abort_flag = False
-            self.restore_cryo()
+            if restore:
+                self.restore_cryo()
             for cavity in self.cavities.values():
                 cavity.abort_flag = True
             raise q0_utils.Q0AbortError(f"Abort requested for {self}")
@@ -419,6 +173,19 @@ class Q0Cryomodule(Cryomodule):
             q0_utils.make_json_file(self._q0_data_file)
         return self._q0_data_file
 
+    @property
+    def checkpoint_file(self):
+        if not isfile(self._checkpoint_file):
+            q0_utils.make_json_file(self._checkpoint_file)
+        return self._checkpoint_file
+
+    def save_checkpoint(self, key: str, checkpoint: Optional[Dict]):
+        q0_utils.update_json_data(self.checkpoint_file, key, checkpoint)
+
+    def load_checkpoint(self, key: str) -> Optional[Dict]:
+        """The checkpoint saved under key, or None if there's nothing to resume"""
+        return q0_utils.read_json_data(self.checkpoint_file).get(key)
+
     @property
     def ll_buffer_size(self):
         return self._ll_buffer_size
@@ -428,230 +195,346 @@ class Q0Cryomodule(Cryomodule):
         self._ll_buffer_size = value
         self.clear_ll_buffer()
 
+    @property
+    def ll_filter_name(self) -> str:
+        return self._ll_filter_name
+
+    @ll_filter_name.setter
+    def ll_filter_name(self, value: str):
+        self._ll_filter_name = value
+        self.clear_ll_buffer()
+
     def clear_ll_buffer(self):
-        self.ll_buffer = np.empty(self.ll_buffer_size)
-        self.ll_buffer[:] = np.nan
-        self.ll_buffer_idx = 0
+        # Swapped rather than reset so the monitor thread never sees a
+        # half-built filter
+        self.ll_filter = q0_filters.make_ll_filter(
+            self.ll_filter_name, self.ll_buffer_size
+        )
 
     def monitor_ll(self, value, **kwargs):
-        self.ll_buffer[self.ll_buffer_idx] = value
-        self.ll_buffer_idx = (self.ll_buffer_idx + 1) % self.ll_buffer_size
-        if self.fill_data_run_buffer:
-            self.current_data_run.ll_data[datetime.now().timestamp()] = value
+        with self.monitor_condition:
+            self.ll_filter.update(value)
+            if self.fill_data_run_buffer:
+                self.current_data_run.append_ll(now().timestamp(), value)
+            self.monitor_condition.notify_all()
+
+    def monitor_jt(self, value, **kwargs):
+        with self.monitor_condition:
+            self._jt_readback = value
+            self.monitor_condition.notify_all()
+
+    def notify_monitors(self, **kwargs):
+        """Wakes up whatever is waiting on this cryomodule's readbacks"""
+        with self.monitor_condition:
+            self.monitor_condition.notify_all()
+
+    def put_nowait(self, pvname: str, value):
+        """
+        Puts without waiting for the IOC to process it, waking up whatever's
+        waiting on this cryomodule once it has
+        """
+        self.pvs.put(pvname, value, callback=self.notify_monitors)
+
+    def run_phases(self, phases: Iterable[Phase], name: str):
+        """
+        Runs phases to completion on the calling thread, raising whatever
+        stopped them early
+        """
+        acquisition = Acquisition(self, phases, name)
+        loop = AcquisitionLoop(self.monitor_condition)
+        loop.add(acquisition)
+        loop.run()
+        if acquisition.exception:
+            raise acquisition.exception
 
     @property
     def averaged_liquid_level(self) -> float:
-        # try to do averaging of the last NUM_LL_POINTS_TO_AVG points to account
-        # for signal noise
-        avg_ll = np.nanmean(self.ll_buffer)
-        if np.isnan(avg_ll):
-            return caget(self.ds_level_pv)
-        else:
-            return avg_ll
-
-    @property
-    def q0_idx_file(self) -> str:
-        if not isfile(self._q0_idx_file):
-            q0_utils.make_json_file(self._q0_idx_file)
-
-        return self._q0_idx_file
-
-    @property
-    def calib_idx_file(self) -> str:
-        if not isfile(self._calib_idx_file):
-            q0_utils.make_json_file(self._calib_idx_file)
-
-        return self._calib_idx_file
+        """
+        Filtered liquid level to account for signal noise; nan until the
+        liquid level monitor has delivered a reading
+        """
+        return self.ll_filter.value
 
     def shut_off(self):
         print("Restoring cryo")
-        caput(self.heater_sequencer_pv, 1, wait=True)
-        caput(self.jtAutoSelectPV, 1, wait=True)
+        self.pvs.put(self.heater_sequencer_pv, 1, wait=True)
+        self.set_jt_auto()
         print("Turning cavities and SSAs off")
         for cavity in self.cavities.values():
-            cavity.turnOff()
-            cavity.ssa.turnOff()
+            turn_off_cavity(cavity, turn_off_ssa=True)
 
     @property
     def heater_power(self):
-        return caget(self.heater_readback_pv)
+        return self.pvs.get(self.heater_readback_pv)
 
     @heater_power.setter
     def heater_power(self, value):
-        while caget(self.heater_mode_pv) != q0_utils.HEATER_MANUAL_VALUE:
-            self.check_abort()
-            print(f"Setting {self} heaters to manual and waiting 3s")
-            caput(self.heater_manual_pv, 1, wait=True)
-            sleep(3)
+        self.run_phases([SetHeaterPhase(self, value)], "Heater setup")
 
-        caput(self.heater_setpoint_pv, value)
-
-        print(f"set {self} heater power to {value} W")
+    @property
+    def heater_in_manual(self) -> bool:
+        return (
+            self.pvs.get_if_connected(self.heater_mode_pv)
+            == q0_utils.HEATER_MANUAL_VALUE
+        )
 
     @property
-    def ds_level_pv_obj(self) -> PV:
-        if not self._ds_level_pv_obj:
-            self._ds_level_pv_obj = PV(self.ds_level_pv)
-        return self._ds_level_pv_obj
+    def has_cryo_access(self) -> bool:
+        # Cached since workers check it before every step
+        return (
+            self.pvs.get(self.cryo_access_pv, use_monitor=True)
+            == q0_utils.CRYO_ACCESS_VALUE
+        )
 
     @property
     def ds_liquid_level(self):
-        return self.ds_level_pv_obj.get()
+        return self.pvs.get(self.ds_level_pv)
 
     @ds_liquid_level.setter
     def ds_liquid_level(self, value):
-        self.ds_level_pv_obj.put(value)
+        self.pvs.put(self.ds_level_pv, value)
 
-    def fill(self, desired_level=q0_utils.MAX_DS_LL, turn_cavities_off: bool = True):
-        self.ds_liquid_level = desired_level
-        print(f"Setting JT to auto for refill to {desired_level}")
-        caput(self.jtAutoSelectPV, 1, wait=True)
-        self.heater_power = 0
+    @property
+    def hot_pvs(self) -> List[str]:
+        """PVs the measurement loops hit over and over"""
+        return [
+            self.ds_level_pv,
+            self.dsLiqLevSetpointPV,
+            self.heater_readback_pv,
+            self.heater_mode_pv,
+            self.heater_manual_pv,
+            self.heater_setpoint_pv,
+            self.heater_sequencer_pv,
+            self.jtModePV,
+            self.jtManualSelectPV,
+            self.jtAutoSelectPV,
+            self.jtManPosSetpointPV,
+            self.jt_valve_readback_pv,
+            self.cryo_access_pv,
+        ] + [cavity.selAmplitudeActPV.pvname for cavity in self.cavities.values()]
+
+    def connect_pvs(self):
+        self.pvs.connect(self.hot_pvs)
+
+    def turn_cavities_off(self):
+        for cavity in self.cavities.values():
+            turn_off_cavity(cavity)
 
-        if turn_cavities_off:
-            for cavity in self.cavities.values():
-                cavity.turnOff()
+    def cavity_amplitude(self, cav_num: int) -> Optional[float]:
+        """None until the amplitude PV has connected"""
+        return self.pvs.get_if_connected(
+            self.cavities[cav_num].selAmplitudeActPV.pvname
+        )
 
-        self.waitForLL(desired_level)
+    def fill(self, desired_level=q0_utils.MAX_DS_LL, turn_cavities_off: bool = True):
+        self.run_phases(
+            [FillPhase(self, desired_level, turn_cavities_off=turn_cavities_off)],
+            "Fill",
+        )
 
     def fillAndLock(self, desiredLevel=q0_utils.MAX_DS_LL):
-        self.ds_liquid_level = desiredLevel
-
-        print(f"Setting JT to auto for refill to {desiredLevel}")
-        caput(self.jtAutoSelectPV, 1, wait=True)
+        self.run_phases(
+            [
+                FillPhase(
+                    self,
+                    desiredLevel,
+                    heater_power=self.valveParams.refHeatLoadDes,
+                    turn_cavities_off=False,
+                ),
+                LockJTPhase(self, self.valveParams.refValvePos),
+            ],
+            "Fill and lock",
+        )
 
-        self.heater_power = self.valveParams.refHeatLoadDes
+    def valve_param_phases(
+        self, jt_search_start: Optional[datetime], jt_search_end: Optional[datetime]
+    ) -> Iterator[Phase]:
+        """Looks up reference cryo parameters if there aren't any yet"""
+        if self.valveParams:
+            return
 
-        self.waitForLL(desiredLevel)
+        def find_valve_params():
+            self.valveParams = self.getRefValveParams(
+                start_time=jt_search_start, end_time=jt_search_end
+            )
 
-        self.jt_position = self.valveParams.refValvePos
+        yield BackgroundPhase(
+            self, "Find reference cryo parameters", [find_valve_params]
+        )
 
     def getRefValveParams(self, start_time: datetime, end_time: datetime):
         print(f"\nSearching {start_time} to {end_time} for period of JT stability")
-        window_start = start_time
-        window_end = start_time + q0_utils.DELTA_NEEDED_FOR_FLATNESS
-        while window_end <= end_time:
+        pvs = [
+            self.ds_level_pv,
+            self.jt_valve_readback_pv,
+            self.heater_setpoint_pv,
+            self.heater_readback_pv,
+        ]
+        data = {pv: (np.empty(0), np.empty(0)) for pv in pvs}
+        fetch_start = start_time
+
+        while True:
             self.check_abort()
-            print(f"\nChecking window {window_start} to {window_end}")
 
-            data = get_values_over_time_range(
-                pv_list=[self.ds_level_pv], start_time=window_start, end_time=window_end
-            )
-            llVals = medfilt(data.values[self.ds_level_pv])
-
-            # Fit a line to the liquid level over the last [numHours] hours
-            m, b, r, _, _ = linregress(range(len(llVals)), llVals)
-            print(f"r^2 of linear fit: {r ** 2}")
-            print(f"Slope: {m}")
-
-            # If the LL slope is small enough, this may be a good period from
-            # which to get a reference valve position & heater params
-            if np.log10(abs(m)) < -5:
-                signals = [
-                    self.jt_valve_readback_pv,
-                    self.heater_setpoint_pv,
-                    self.heater_readback_pv,
-                ]
+            # Everything in the search range comes back in one request, and a
+            # retry only asks for what's new since the last one
+            new_data = get_values_over_time_range(pvs, fetch_start, end_time)
+            for pv in pvs:
+                timestamps, values = to_arrays(
+                    new_data.timeStamps[pv], new_data.values[pv]
+                )
+                old_timestamps, old_values = data[pv]
+                if old_timestamps.size:
+                    keep = timestamps > old_timestamps[-1]
+                    timestamps, values = timestamps[keep], values[keep]
+                timestamps = np.concatenate([old_timestamps, timestamps])
+                values = np.concatenate([old_values, values])
+                # Keeping the last sample before the search range, since a
+                # setpoint that hasn't changed has no samples inside it
+                first = np.searchsorted(
+                    timestamps, start_time.timestamp(), side="right"
+                )
+                first = max(first - 1, 0)
+                data[pv] = (timestamps[first:], values[first:])
 
-                data = get_values_over_time_range(
-                    pv_list=signals, start_time=window_start, end_time=window_end
+            num_windows = (
+                int(
+                    (end_time - start_time - q0_utils.DELTA_NEEDED_FOR_FLATNESS)
+                    / q0_utils.JT_SEARCH_OVERLAP_DELTA
                 )
+                + 1
+            )
+            window_starts = start_time.timestamp() + (
+                np.arange(max(num_windows, 0))
+                * q0_utils.JT_SEARCH_OVERLAP_DELTA.total_seconds()
+            )
 
-                des_val_set = set(data.values[self.heater_setpoint_pv])
+            stable_period = find_stable_period(
+                window_starts,
+                q0_utils.DELTA_NEEDED_FOR_FLATNESS.total_seconds(),
+                *[data[pv] for pv in pvs],
+            )
+
+            if stable_period:
+                window_start, slope, self.valveParams = stable_period
                 print(
-                    f"number of heater setpoints during this time: {len(des_val_set)}"
+                    f"Stable period found starting"
+                    f" {datetime.fromtimestamp(window_start)} (best of"
+                    f" {window_starts.size} windows), slope {slope}"
                 )
+                print(f"Desired JT valve position: {self.valveParams.refValvePos}")
+                print(f"Total heater des setting: {self.valveParams.refHeatLoadDes}")
+                return self.valveParams
 
-                # We only want to use time periods in which there were no
-                # changes made to the heater settings
-                if len(des_val_set) == 1:
-                    des_pos = round(np.mean(data.values[self.jtValveReadbackPV]), 1)
-                    heater_des = des_val_set.pop()
-                    heater_act = np.mean(data.values[self.heater_readback_pv])
-
-                    print("Stable period found.")
-                    print(f"Desired JT valve position: {des_pos}")
-                    print(f"Total heater des setting: {heater_des}")
-
-                    self.valveParams = q0_utils.ValveParams(
-                        des_pos, heater_des, heater_act
-                    )
-                    return self.valveParams
-
-            window_end += q0_utils.JT_SEARCH_OVERLAP_DELTA
-            window_start += q0_utils.JT_SEARCH_OVERLAP_DELTA
-
-        # If we broke out of the while loop without returning anything, that
-        # means that the LL hasn't been stable enough recently. Wait a while for
-        # it to stabilize and then try again.
-        print(
-            "Stable cryo conditions not found in search window  - determining"
-            " new JT valve position. Please do not adjust the heaters. Allow "
-            "the PID loop to regulate the JT valve position."
-        )
+            # If nothing was stable enough, the LL hasn't been stable enough
+            # recently. Wait a while for it to stabilize and then try again.
+            print(
+                "Stable cryo conditions not found in search window  - determining"
+                " new JT valve position. Please do not adjust the heaters. Allow "
+                "the PID loop to regulate the JT valve position."
+            )
 
-        print("Waiting 30 minutes for LL to stabilize then retrying")
+            print("Waiting 30 minutes for LL to stabilize then retrying")
 
-        start = datetime.now()
-        while (datetime.now() - start) < timedelta(minutes=30):
-            self.check_abort()
-            sleep(5)
-
-        # Try again but only search the recent past. We have to manipulate the
-        # search range a little bit due to how the search start time is rounded
-        # down to the nearest half hour.
-        return self.getRefValveParams(
-            start_time=start_time + timedelta(minutes=30),
-            end_time=end_time + timedelta(minutes=30),
-        )
+            start = now()
+            while (now() - start) < timedelta(minutes=30):
+                self.check_abort()
+                sleep(5)
+
+            # Try again but only search the recent past. We have to manipulate
+            # the search range a little bit due to how the search start time is
+            # rounded down to the nearest half hour.
+            fetch_start = end_time
+            start_time += timedelta(minutes=30)
+            end_time += timedelta(minutes=30)
 
     def launchHeaterRun(
         self,
         heater_setpoint,
         target_ll_diff: float = q0_utils.TARGET_LL_DIFF,
         is_cal=True,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
     ) -> None:
-        self.heater_power = heater_setpoint
+        self.run_phases(
+            self.heater_run_phases(
+                heater_setpoint, target_ll_diff, is_cal, target_rel_error
+            ),
+            "Heater run",
+        )
+
+    def heater_run_phases(
+        self,
+        heater_setpoint,
+        target_ll_diff: float = q0_utils.TARGET_LL_DIFF,
+        is_cal=True,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
+    ) -> Iterator[Phase]:
+        yield SetHeaterPhase(self, heater_setpoint)
 
         print(f"Waiting for the LL to drop {target_ll_diff}%")
 
-        self.current_data_run: q0_utils.HeaterRun = q0_utils.HeaterRun(
+        heater_run = q0_utils.HeaterRun(
             heater_setpoint - self.valveParams.refHeatLoadAct,
             reference_heat=self.valveParams.refHeatLoadAct,
         )
+        heater_run.heater_readback.target = heater_setpoint
         if is_cal:
-            self.calibration.heater_runs.append(self.current_data_run)
-
-        self.current_data_run.start_time = datetime.now()
-
-        camonitor(self.heater_readback_pv, callback=self.fill_heater_readback_buffer)
-        self.fill_data_run_buffer = True
-        self.wait_for_ll_drop(target_ll_diff)
-        self.fill_data_run_buffer = False
-        camonitor_clear(self.heater_readback_pv)
-
-        self.current_data_run.end_time = datetime.now()
+            self.calibration.heater_runs.append(heater_run)
+
+        yield RecordPhase(
+            self,
+            "Heater run",
+            heater_run,
+            target_ll_diff,
+            target_rel_error,
+            monitors={self.heater_readback_pv: self.fill_heater_readback_buffer},
+        )
 
-        print("Heater run done")
+    def report_heater_tolerance(self):
+        readback = self.current_data_run.heater_readback
+        if readback.out_of_tolerance:
+            print(
+                f"{self} heater readback was more than {readback.tolerance} W off"
+                f" {readback.target} W for {readback.out_of_tolerance} of"
+                f" {readback.count} readings"
+            )
 
-    def wait_for_ll_drop(self, target_ll_diff):
-        startingLevel = self.averaged_liquid_level
-        avgLevel = startingLevel
-        while (startingLevel - avgLevel) < target_ll_diff and (
-            avgLevel > q0_utils.MIN_DS_LL
+    def ll_drop_stop_reason(
+        self,
+        starting_level: float,
+        target_ll_diff: float,
+        target_rel_error: Optional[float] = None,
+    ) -> Optional[str]:
+        """
+        Why the current data run should stop: the liquid level dropped
+        target_ll_diff from starting_level (or hit the minimum) or, if
+        target_rel_error is given, the run's running dLL/dt fit got that
+        precise. None if it should keep going.
+        """
+        avgLevel = self.averaged_liquid_level
+        running_slope = self.current_data_run.running_fit()[0]
+        if (starting_level - avgLevel) >= target_ll_diff:
+            return q0_utils.STOP_REASON_LL_DROP
+        if avgLevel <= q0_utils.MIN_DS_LL:
+            return q0_utils.STOP_REASON_MIN_LL
+        if (
+            target_rel_error is not None
+            and running_slope.count >= q0_utils.MIN_DLL_DT_POINTS
+            and running_slope.relative_error <= target_rel_error
+            # Only worth the autocorrelation correction once the plain
+            # estimate, which is never bigger, is there
+            and self.current_data_run.running_relative_error <= target_rel_error
         ):
-            self.check_abort()
-            print(f"Averaged level is {avgLevel}; waiting 10s")
-            avgLevel = self.averaged_liquid_level
-            sleep(10)
+            return q0_utils.STOP_REASON_CONVERGED
+        return None
 
     def fill_pressure_buffer(self, value, **kwargs):
         if self.q0_measurement:
-            self.q0_measurement.rf_run.pressure_buffer.append(value)
+            self.q0_measurement.rf_run.pressure.add(value)
 
     def fill_heater_readback_buffer(self, value, **kwargs):
         if self.current_data_run:
-            self.current_data_run.heater_readback_buffer.append(value)
+            self.current_data_run.heater_readback.add(value)
 
     # to be called after setup_for_q0 and each cavity's setup_SELA
     def takeNewQ0Measurement(
@@ -659,92 +542,199 @@ class Q0Cryomodule(Cryomodule):
         desiredAmplitudes: Dict[int, float],
         desired_ll: float = q0_utils.MAX_DS_LL,
         ll_drop: float = q0_utils.TARGET_LL_DIFF,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
     ):
-        self.setup_cryo_for_measurement(desired_ll, turn_cavities_off=False)
+        self.run_phases(
+            self.q0_phases(desiredAmplitudes, desired_ll, ll_drop, target_rel_error),
+            "Q0 measurement",
+        )
 
-        for cav_num, des_amp in desiredAmplitudes.items():
-            while (
-                abs(caget(self.cavities[cav_num].selAmplitudeActPV.pvname) - des_amp)
-                > 0.1
-            ):
-                self.check_abort()
-                print(f"Waiting for CM{self.name} cavity {cav_num} to be ready")
-                sleep(5)
+    def q0_phases(
+        self,
+        desiredAmplitudes: Dict[int, float],
+        desired_ll: float = q0_utils.MAX_DS_LL,
+        ll_drop: float = q0_utils.TARGET_LL_DIFF,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
+    ) -> Iterator[Phase]:
+        yield from self.setup_phases(desired_ll, turn_cavities_off=False)
+        yield WaitForCavitiesPhase(self, desiredAmplitudes)
+
+        rf_run = self.q0_measurement.rf_run
+        rf_run.reference_heat = self.valveParams.refHeatLoadAct
+        rf_run.heater_readback.target = self.valveParams.refHeatLoadDes
+        self.q0_measurement.start_time = now()
+
+        yield RecordPhase(
+            self,
+            "RF run",
+            rf_run,
+            ll_drop,
+            target_rel_error,
+            monitors={
+                self.heater_readback_pv: self.fill_heater_readback_buffer,
+                self.ds_pressure_pv: self.fill_pressure_buffer,
+            },
+        )
 
-        self.current_data_run: RFRun = self.q0_measurement.rf_run
-        self.q0_measurement.rf_run.reference_heat = self.valveParams.refHeatLoadAct
-        camonitor(self.heater_readback_pv, callback=self.fill_heater_readback_buffer)
-        camonitor(self.ds_pressure_pv, callback=self.fill_pressure_buffer)
+        checkpoint = {
+            q0_utils.JSON_START_KEY: self.q0_measurement.start_time,
+            "Calibration Used": self.calibration.time_stamp,
+            q0_utils.JSON_VALVE_PARAMS_KEY: asdict(self.valveParams),
+            q0_utils.JSON_DESIRED_LL_KEY: desired_ll,
+            q0_utils.JSON_LL_DROP_KEY: ll_drop,
+            q0_utils.JSON_TARGET_REL_ERROR_KEY: target_rel_error,
+        }
 
-        start_time = datetime.now()
-        self.q0_measurement.start_time = start_time
-        self.q0_measurement.rf_run.start_time = start_time
+        def save_rf_run():
+            print(rf_run.dll_dt)
+            self.q0_measurement.save_data()
+            self.save_checkpoint(q0_utils.JSON_Q0_CHECKPOINT_KEY, checkpoint)
 
-        self.fill_data_run_buffer = True
-        self.wait_for_ll_drop(ll_drop)
-        self.fill_data_run_buffer = False
-        camonitor_clear(self.heater_readback_pv)
-        camonitor_clear(self.ds_pressure_pv)
-        self.q0_measurement.rf_run.end_time = datetime.now()
+        yield BackgroundPhase(self, "Save RF run", [save_rf_run])
 
-        print(self.q0_measurement.rf_run.dll_dt)
+        yield from self.q0_heater_run_phases(desired_ll, ll_drop, target_rel_error)
 
-        self.setup_cryo_for_measurement(desired_ll)
+    def resume_q0_measurement(self):
+        """
+        Picks up a Q0 measurement that was interrupted after its RF run by
+        loading the RF run and calibration it was taken with and doing the
+        heater run
+        """
+        self.run_phases(self.resume_q0_phases(), "Q0 measurement")
 
-        self.launchHeaterRun(
+    def resume_q0_phases(self) -> Iterator[Phase]:
+        checkpoint = {}
+
+        def load_q0_checkpoint():
+            checkpoint.update(
+                self.load_checkpoint(q0_utils.JSON_Q0_CHECKPOINT_KEY) or {}
+            )
+            if not checkpoint:
+                raise q0_utils.DataError(f"{self} has no Q0 measurement to resume")
+
+            self.load_calibration(checkpoint["Calibration Used"])
+            self.valveParams = q0_utils.ValveParams(
+                **checkpoint[q0_utils.JSON_VALVE_PARAMS_KEY]
+            )
+
+            time_stamp = checkpoint[q0_utils.JSON_START_KEY]
+            self.q0_measurement = Q0Measurement(cryomodule=self)
+            self.q0_measurement.start_time = datetime.strptime(
+                time_stamp, q0_utils.DATETIME_FORMATTER
+            )
+            self.q0_measurement.load_rf_run(
+                q0_store.load_session(self.q0_data_file, time_stamp)[
+                    q0_utils.JSON_RF_RUN_KEY
+                ]
+            )
+            print(f"Resuming {self} Q0 measurement from {time_stamp}")
+
+        yield BackgroundPhase(self, "Load Q0 checkpoint", [load_q0_checkpoint])
+
+        camonitor(self.ds_level_pv, callback=self.monitor_ll)
+        yield from self.q0_heater_run_phases(
+            desired_ll=checkpoint[q0_utils.JSON_DESIRED_LL_KEY],
+            ll_drop=checkpoint[q0_utils.JSON_LL_DROP_KEY],
+            target_rel_error=checkpoint[q0_utils.JSON_TARGET_REL_ERROR_KEY],
+        )
+
+    def q0_heater_run_phases(
+        self,
+        desired_ll: float,
+        ll_drop: float,
+        target_rel_error: Optional[float],
+    ) -> Iterator[Phase]:
+        yield from self.setup_phases(desired_ll)
+        yield from self.heater_run_phases(
             q0_utils.FULL_MODULE_CALIBRATION_LOAD + self.valveParams.refHeatLoadDes,
             target_ll_diff=ll_drop,
             is_cal=False,
+            target_rel_error=target_rel_error,
         )
         self.q0_measurement.heater_run = self.current_data_run
         self.q0_measurement.heater_run.reference_heat = self.valveParams.refHeatLoadAct
+        end_time = now()
 
-        print(self.q0_measurement.heater_run.dll_dt)
+        def finish_q0_measurement():
+            print(self.q0_measurement.heater_run.dll_dt)
 
-        self.q0_measurement.save_data()
+            self.q0_measurement.save_data()
 
-        end_time = datetime.now()
-        caput(
-            self.heater_setpoint_pv,
-            caget(self.heater_readback_pv) - q0_utils.FULL_MODULE_CALIBRATION_LOAD,
-        )
+            self.pvs.put(
+                self.heater_setpoint_pv,
+                self.heater_power - q0_utils.FULL_MODULE_CALIBRATION_LOAD,
+            )
+
+            camonitor_clear(self.ds_level_pv)
 
-        camonitor_clear(self.ds_level_pv)
+            start_time = datetime.strptime(
+                self.q0_measurement.start_time, q0_utils.DATETIME_FORMATTER
+            )
+            print("\nStart Time: {START}".format(START=start_time))
+            print("End Time: {END}".format(END=end_time))
 
-        print("\nStart Time: {START}".format(START=start_time))
-        print("End Time: {END}".format(END=end_time))
+            duration = (end_time - start_time).total_seconds() / 3600
+            print("Duration in hours: {DUR}".format(DUR=duration))
 
-        duration = (end_time - start_time).total_seconds() / 3600
-        print("Duration in hours: {DUR}".format(DUR=duration))
+            print("Caluclated Q0: ", self.q0_measurement.q0)
+            print(
+                f"{q0_utils.BOOTSTRAP_CONFIDENCE:.0%} confidence interval"
+                " (statistical only):"
+                f" {self.q0_measurement.q0_ci}"
+            )
+            self.q0_measurement.save_results()
+            self.save_checkpoint(q0_utils.JSON_Q0_CHECKPOINT_KEY, None)
 
-        print("Caluclated Q0: ", self.q0_measurement.q0)
-        self.q0_measurement.save_results()
-        self.restore_cryo()
+        yield BackgroundPhase(self, "Analyze Q0 measurement", [finish_q0_measurement])
+        yield BackgroundPhase(self, "Restore cryo", [self.restore_cryo])
 
     def setup_for_q0(
         self, desiredAmplitudes, desired_ll, jt_search_end, jt_search_start
     ):
+        self.run_phases(
+            self.q0_setup_phases(
+                desiredAmplitudes, desired_ll, jt_search_end, jt_search_start
+            ),
+            "Q0 setup",
+        )
+
+    def q0_setup_phases(
+        self, desiredAmplitudes, desired_ll, jt_search_end, jt_search_start
+    ) -> Iterator[Phase]:
         self.q0_measurement = Q0Measurement(cryomodule=self)
         self.q0_measurement.amplitudes = desiredAmplitudes
         self.q0_measurement.heater_run_heatload = q0_utils.FULL_MODULE_CALIBRATION_LOAD
 
-        if not self.valveParams:
-            self.valveParams = self.getRefValveParams(
-                start_time=jt_search_start, end_time=jt_search_end
-            )
+        yield from self.valve_param_phases(jt_search_start, jt_search_end)
 
         camonitor(self.ds_level_pv, callback=self.monitor_ll)
-        self.fill(desired_ll)
+        yield FillPhase(self, desired_ll)
 
     def load_calibration(self, time_stamp: str):
-        self.calibration: Calibration = Calibration(
-            time_stamp=time_stamp, cryomodule=self
+        self.use_calibration(
+            q0_session_cache.SESSIONS.get(
+                q0_session_cache.CALIBRATIONS, self, time_stamp
+            ).result()
         )
-        self.calibration.load_data()
+
+    def use_calibration(self, calibration: Calibration):
+        """Makes a loaded calibration (and its reference parameters) current"""
+        self.calibration = calibration
+        self.valveParams = calibration.valve_params
+        print("Loaded new reference parameters")
 
     def load_q0_measurement(self, time_stamp):
-        self.q0_measurement: Q0Measurement = Q0Measurement(self)
-        self.q0_measurement.load_data(time_stamp)
+        self.use_q0_measurement(
+            q0_session_cache.SESSIONS.get(
+                q0_session_cache.Q0_MEASUREMENTS, self, time_stamp
+            ).result()
+        )
+
+    def use_q0_measurement(self, q0_measurement: Q0Measurement):
+        # Its results are worked out again with whichever calibration is
+        # current now
+        q0_measurement.clear_results()
+        self.q0_measurement = q0_measurement
 
     def takeNewCalibration(
         self,
@@ -755,104 +745,280 @@ class Q0Cryomodule(Cryomodule):
         num_cal_steps: int = q0_utils.NUM_CAL_STEPS,
         heat_start: float = 130,
         heat_end: float = 160,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
     ):
-        if not self.valveParams:
-            self.valveParams = self.getRefValveParams(
-                start_time=jt_search_start, end_time=jt_search_end
-            )
+        self.run_phases(
+            self.calibration_phases(
+                jt_search_start,
+                jt_search_end,
+                desired_ll,
+                ll_drop,
+                num_cal_steps,
+                heat_start,
+                heat_end,
+                target_rel_error,
+            ),
+            "Calibration",
+        )
 
-        startTime = datetime.now().replace(microsecond=0)
+    def calibration_phases(
+        self,
+        jt_search_start: datetime = None,
+        jt_search_end: datetime = None,
+        desired_ll: float = q0_utils.MAX_DS_LL,
+        ll_drop: float = q0_utils.TARGET_LL_DIFF,
+        num_cal_steps: int = q0_utils.NUM_CAL_STEPS,
+        heat_start: float = 130,
+        heat_end: float = 160,
+        target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
+    ) -> Iterator[Phase]:
+        yield from self.valve_param_phases(jt_search_start, jt_search_end)
+
+        startTime = now().replace(microsecond=0)
         self.calibration = Calibration(
             time_stamp=startTime.strftime(q0_utils.DATETIME_FORMATTER), cryomodule=self
         )
+        checkpoint = {
+            q0_utils.JSON_START_KEY: self.calibration.time_stamp,
+            q0_utils.JSON_HEATER_SETPOINTS_KEY: linspace(
+                heat_start, heat_end, num_cal_steps
+            ).tolist(),
+            q0_utils.JSON_VALVE_PARAMS_KEY: asdict(self.valveParams),
+            q0_utils.JSON_DESIRED_LL_KEY: desired_ll,
+            q0_utils.JSON_LL_DROP_KEY: ll_drop,
+            q0_utils.JSON_TARGET_REL_ERROR_KEY: target_rel_error,
+        }
 
-        print(f"setting {self} heater to {self.valveParams.refHeatLoadDes} W")
-        self.heater_power = self.valveParams.refHeatLoadDes
+        def save_calibration_checkpoint():
+            self.save_checkpoint(q0_utils.JSON_CALIBRATION_CHECKPOINT_KEY, checkpoint)
+            starting_ll_setpoint = self.pvs.get(self.dsLiqLevSetpointPV)
+            print(f"Starting liquid level setpoint: {starting_ll_setpoint}")
 
-        starting_ll_setpoint = caget(self.dsLiqLevSetpointPV)
-        print(f"Starting liquid level setpoint: {starting_ll_setpoint}")
+        yield BackgroundPhase(
+            self, "Save calibration checkpoint", [save_calibration_checkpoint]
+        )
+        yield SetHeaterPhase(self, self.valveParams.refHeatLoadDes)
 
-        camonitor(self.ds_level_pv, callback=self.monitor_ll)
+        yield from self.calibration_step_phases(checkpoint)
 
-        self.setup_cryo_for_measurement(desired_ll)
+    def resume_calibration(self):
+        """
+        Picks up an interrupted calibration by loading the heater runs it
+        finished and doing the rest of its setpoints
+        """
+        self.run_phases(self.resume_calibration_phases(), "Calibration")
 
-        for setpoint in linspace(heat_start, heat_end, num_cal_steps):
-            self.setup_cryo_for_measurement(desired_ll)
-            self.launchHeaterRun(setpoint, target_ll_diff=ll_drop)
-            self.current_data_run = None
+    def resume_calibration_phases(self) -> Iterator[Phase]:
+        checkpoint = {}
+
+        def load_calibration_checkpoint():
+            checkpoint.update(
+                self.load_checkpoint(q0_utils.JSON_CALIBRATION_CHECKPOINT_KEY) or {}
+            )
+            if not checkpoint:
+                raise q0_utils.DataError(f"{self} has no calibration to resume")
+
+            self.valveParams = q0_utils.ValveParams(
+                **checkpoint[q0_utils.JSON_VALVE_PARAMS_KEY]
+            )
+            self.calibration = Calibration(
+                time_stamp=checkpoint[q0_utils.JSON_START_KEY], cryomodule=self
+            )
+            try:
+                self.calibration.load_heater_runs()
+            except KeyError:
+                # Interrupted before the first heater run finished
+                pass
+
+            print(
+                f"Resuming {self} calibration from {self.calibration.time_stamp}"
+                f" with {len(self.calibration.heater_runs)} of"
+                f" {len(checkpoint[q0_utils.JSON_HEATER_SETPOINTS_KEY])} heater"
+                " runs done"
+            )
+
+        yield BackgroundPhase(
+            self, "Load calibration checkpoint", [load_calibration_checkpoint]
+        )
+        yield from self.calibration_step_phases(checkpoint)
 
-        self.calibration.save_data()
+    def calibration_step_phases(self, checkpoint: Dict) -> Iterator[Phase]:
+        """
+        Does the heater runs in the checkpoint that the calibration doesn't
+        have yet, saving each one as soon as it's done
+        """
+        desired_ll = checkpoint[q0_utils.JSON_DESIRED_LL_KEY]
+        setpoints = checkpoint[q0_utils.JSON_HEATER_SETPOINTS_KEY]
 
+        camonitor(self.ds_level_pv, callback=self.monitor_ll)
+
+        for setpoint in setpoints[len(self.calibration.heater_runs) :]:
+            yield from self.setup_phases(desired_ll)
+            yield from self.heater_run_phases(
+                setpoint,
+                target_ll_diff=checkpoint[q0_utils.JSON_LL_DROP_KEY],
+                target_rel_error=checkpoint[q0_utils.JSON_TARGET_REL_ERROR_KEY],
+            )
+            self.current_data_run = None
+            yield BackgroundPhase(self, "Save heater run", [self.calibration.save_data])
+
+        startTime = datetime.strptime(
+            self.calibration.time_stamp, q0_utils.DATETIME_FORMATTER
+        )
         print("\nStart Time: {START}".format(START=startTime))
-        print("End Time: {END}".format(END=datetime.now()))
+        print("End Time: {END}".format(END=now()))
 
-        duration = (datetime.now() - startTime).total_seconds() / 3600
+        duration = (now() - startTime).total_seconds() / 3600
         print("Duration in hours: {DUR}".format(DUR=duration))
 
-        self.heater_power = self.valveParams.refHeatLoadDes
+        yield SetHeaterPhase(self, self.valveParams.refHeatLoadDes)
+        yield BackgroundPhase(self, "Restore cryo", [self.restore_cryo])
 
-        self.restore_cryo()
+        def save_calibration_results():
+            self.calibration.save_results()
+            self.save_checkpoint(q0_utils.JSON_CALIBRATION_CHECKPOINT_KEY, None)
+            camonitor_clear(self.ds_level_pv)
 
-        self.calibration.save_results()
-        camonitor_clear(self.ds_level_pv)
+        yield BackgroundPhase(
+            self, "Save calibration results", [save_calibration_results]
+        )
 
     def restore_cryo(self):
         print("Restoring initial cryo conditions")
-        caput(self.jtAutoSelectPV, 1, wait=True)
+        self.set_jt_auto()
         self.ds_liquid_level = 92
-        caput(self.heater_sequencer_pv, 1, wait=True)
+        self.pvs.put(self.heater_sequencer_pv, 1, wait=True)
 
     def setup_cryo_for_measurement(self, desired_ll, turn_cavities_off: bool = True):
-        self.fill(desired_ll, turn_cavities_off=turn_cavities_off)
-        self.jt_position = self.valveParams.refValvePos
-        self.heater_power = self.valveParams.refHeatLoadDes
+        self.run_phases(
+            self.setup_phases(desired_ll, turn_cavities_off), "Measurement setup"
+        )
+
+    def setup_phases(
+        self, desired_ll, turn_cavities_off: bool = True
+    ) -> Iterator[Phase]:
+        """Fill, lock the JT valve and set the reference heat load"""
+        yield FillPhase(self, desired_ll, turn_cavities_off=turn_cavities_off)
+        yield LockJTPhase(self, self.valveParams.refValvePos)
+        yield SetHeaterPhase(self, self.valveParams.refHeatLoadDes)
+
+    def try_set_jt_manual(self) -> bool:
+        """
+        Puts the JT valve in manual unless the cryomodules sharing
+        jt_manual_slots already have all the manual JT valves they're allowed,
+        returning whether it did
+        """
+        if self.jt_manual_slots and not self._holds_jt_manual_slot:
+            if not self.jt_manual_slots.acquire(blocking=False):
+                return False
+            self._holds_jt_manual_slot = True
+
+        self.put_nowait(self.jtManualSelectPV, 1)
+        return True
+
+    def set_jt_auto(self, wait: bool = True):
+        if wait:
+            self.pvs.put(self.jtAutoSelectPV, 1, wait=True)
+        else:
+            self.put_nowait(self.jtAutoSelectPV, 1)
+        self.jt_locked_position = None
+
+        if self._holds_jt_manual_slot:
+            self._holds_jt_manual_slot = False
+            self.jt_manual_slots.release()
 
     @property
     def jt_position(self):
-        return caget(self.jt_valve_readback_pv)
+        return self.pvs.get(self.jt_valve_readback_pv)
 
     @jt_position.setter
     def jt_position(self, value):
-        delta = value - self.jt_position
-        step = sign(delta)
+        self.run_phases([LockJTPhase(self, value)], "JT setup")
 
-        print("Setting JT to manual and waiting for readback to change")
-        caput(self.jtManualSelectPV, 1, wait=True)
+    @property
+    def jt_in_manual(self) -> bool:
+        return self.pvs.get_if_connected(self.jtModePV) == q0_utils.JT_MANUAL_MODE_VALUE
 
-        # One way for the JT valve to be locked in the correct position is for
-        # it to be in manual mode and at the desired value
-        while caget(self.jtModePV) != q0_utils.JT_MANUAL_MODE_VALUE:
-            self.check_abort()
-            sleep(1)
+    @property
+    def jt_readback(self) -> Optional[float]:
+        """JT valve position as of the last update from monitor_jt"""
+        return self._jt_readback
 
-        print(f"Walking {self} JT to {value}%")
-        for _ in range(int(floor(abs(delta)))):
-            caput(self.jtManPosSetpointPV, self.jt_position + step, wait=True)
-            sleep(3)
+    @jt_readback.setter
+    def jt_readback(self, value: float):
+        self._jt_readback = value
 
-        caput(self.jtManPosSetpointPV, value)
+    def waitForLL(self, desiredLiquidLevel=q0_utils.MAX_DS_LL):
+        self.run_phases([WaitForLLPhase(self, desiredLiquidLevel)], "Fill")
 
-        print(f"Waiting for {self} JT Valve position to be in tolerance")
-        # Wait for the valve position to be within tolerance before continuing
-        while abs(self.jt_position - value) > q0_utils.VALVE_POS_TOL:
-            self.check_abort()
-            sleep(1)
 
-        print(f"{self} JT Valve at {value}")
+class _CryomoduleSlot:
+    """
+    Takes a cryomodule's place while the Machine gets built, holding on to
+    what it would have been constructed with
+    """
 
-    def waitForLL(self, desiredLiquidLevel=q0_utils.MAX_DS_LL):
-        print(f"Waiting for downstream liquid level to be {desiredLiquidLevel}%")
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
 
-        while (desiredLiquidLevel - self.averaged_liquid_level) > 0.01:
-            self.check_abort()
-            print(
-                f"Current averaged level is {self.averaged_liquid_level}; waiting 10 seconds for more data."
-            )
-            sleep(10)
+    @property
+    def linac_object(self):
+        if "linac_object" in self.kwargs:
+            return self.kwargs["linac_object"]
+        return self.args[1]
+
+
+class Q0CryomoduleRegistry(Mapping):
+    """
+    The machine's cryomodules, keyed by name, where each Q0Cryomodule (and its
+    cavities, racks and PV names) only gets built the first time it's looked
+    up. Nothing at all gets built until the first lookup, so importing this
+    module stays cheap.
+
+    Machine and Linac only hold on to whatever their cryomodule_class gives
+    back, so each cryomodule built here replaces its slot in its linac's and
+    the machine's cryomodules, and lookups through either get the real thing.
+    Cryomodules that haven't been looked up yet are still slots there.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._machine: Optional[Machine] = None
+        self._slots: Optional[Dict[str, _CryomoduleSlot]] = None
+        self._cryomodules: Dict[str, Q0Cryomodule] = {}
 
-        print("downstream liquid level at required value.")
+    @property
+    def slots(self) -> Dict[str, _CryomoduleSlot]:
+        with self._lock:
+            if self._slots is None:
+                self._machine = Machine(
+                    cryomodule_class=_CryomoduleSlot, cavity_class=Q0Cavity
+                )
+                # A copy, since the machine's own gets the real cryomodules
+                self._slots = dict(self._machine.cryomodules)
+            return self._slots
+
+    def __getitem__(self, name: str) -> Q0Cryomodule:
+        with self._lock:
+            if name not in self._cryomodules:
+                slot = self.slots[name]
+                cryomodule = Q0Cryomodule(*slot.args, **slot.kwargs)
+                slot.linac_object.cryomodules[name] = cryomodule
+                self._machine.cryomodules[name] = cryomodule
+                self._cryomodules[name] = cryomodule
+            return self._cryomodules[name]
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def built(self) -> List[str]:
+        """Names of the cryomodules that have been constructed so far"""
+        return list(self._cryomodules.keys())
 
 
-Q0_CRYOMODULES: Dict[str, Cryomodule] = Machine(
-    cryomodule_class=Q0Cryomodule, cavity_class=Q0Cavity
-).cryomodules
+Q0_CRYOMODULES: Mapping[str, Q0Cryomodule] = Q0CryomoduleRegistry()
@@ -0,0 +1,207 @@
+"""
+Live view of the run a cryomodule is recording, for the GUI's dashboard.
+
+Liquid level samples already land in the cryomodule's current data run from
+its camonitor callback, under its monitor_condition. Rather than having the
+callback push every sample to the display as well, a LiveRunFeed gets polled
+at display rate: each poll holds the lock just long enough to copy the
+samples that came in since the last one into a fixed size ring buffer and
+read the running fit, so the callback thread does no extra work however
+often the display refreshes or however long it takes to draw.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import numpy as np
+
+import q0_slopes
+import q0_utils
+from q0_analysis import RFRun
+
+if TYPE_CHECKING:
+    from q0_linac import Q0Cryomodule
+
+
+class RingBuffer:
+    """The last capacity (timestamp, value) pairs added"""
+
+    def __init__(self, capacity: int):
+        self.timestamps: np.ndarray = np.empty(capacity)
+        self.values: np.ndarray = np.empty(capacity)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self.timestamps.size
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        with self.lock:
+            added = timestamps.size
+            if added > self.capacity:
+                timestamps = timestamps[-self.capacity :]
+                values = values[-self.capacity :]
+            positions = (self.count + added - timestamps.size) + np.arange(
+                timestamps.size
+            )
+            self.timestamps[positions % self.capacity] = timestamps
+            self.values[positions % self.capacity] = values
+            self.count += added
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Copies of what's in the buffer, oldest first"""
+        with self.lock:
+            if self.count <= self.capacity:
+                return (
+                    self.timestamps[: self.count].copy(),
+                    self.values[: self.count].copy(),
+                )
+            oldest = self.count % self.capacity
+            return (
+                np.roll(self.timestamps, -oldest),
+                np.roll(self.values, -oldest),
+            )
+
+
+def projected_end(
+    start: float,
+    latest: float,
+    num_points: int,
+    level: float,
+    slope: float,
+    relative_error: float,
+    starting_level: Optional[float],
+    target_ll_diff: float,
+    target_rel_error: Optional[float],
+) -> Optional[float]:
+    """
+    When a run should stop if it carries on as it's going: the sooner of the
+    liquid level dropping to its target and, if there's a precision target,
+    the running fit getting that precise. For evenly spaced samples the fit's
+    relative error falls as (run length) ** -3/2, and the fit doesn't count
+    until there are MIN_DLL_DT_POINTS samples.
+    """
+    candidates = []
+    if starting_level is not None and slope < 0:
+        target_level = max(starting_level - target_ll_diff, q0_utils.MIN_DS_LL)
+        candidates.append(latest + max(level - target_level, 0) / -slope)
+    if target_rel_error and np.isfinite(relative_error) and latest > start:
+        growth = max(
+            (relative_error / target_rel_error) ** (2 / 3),
+            q0_utils.MIN_DLL_DT_POINTS / num_points,
+        )
+        candidates.append(start + (latest - start) * growth)
+    return max(min(candidates), latest) if candidates else None
+
+
+@dataclass
+class LiveSnapshot:
+    name: str
+    timestamps: np.ndarray
+    values: np.ndarray
+    num_points: int
+    start: float
+    latest: float
+    level: float
+    slope: float
+    std_err: float
+    relative_error: float
+    mean_timestamp: float
+    mean_value: float
+    heater: float
+    pressure: Optional[float]
+    target_rel_error: Optional[float]
+    projected_end: Optional[float]
+
+    def fit(self, timestamps: np.ndarray, slope: Optional[float] = None):
+        """The running fit (or a line with another slope through its centre)"""
+        if slope is None:
+            slope = self.slope
+        return self.mean_value + slope * (timestamps - self.mean_timestamp)
+
+
+class LiveRunFeed:
+    def __init__(self, cryomodule, capacity: int = q0_utils.LIVE_BUFFER_SIZE):
+        # type: (Q0Cryomodule, int) -> None
+        self.cryomodule: Q0Cryomodule = cryomodule
+        self.buffer = RingBuffer(capacity)
+        self.run: Optional[q0_utils.DataRun] = None
+        self.copied = 0
+        self.start: Optional[float] = None
+
+    def poll(self) -> Optional[LiveSnapshot]:
+        """
+        Brings the buffer up to date with the run being recorded, or returns
+        None if nothing's being recorded
+        """
+        cryomodule = self.cryomodule
+        with cryomodule.monitor_condition:
+            phase = cryomodule.recording_phase
+            run = cryomodule.current_data_run
+            if not phase or not run or not run.num_ll_points:
+                return None
+
+            if run is not self.run:
+                self.run = run
+                self.copied = 0
+                self.buffer.clear()
+
+            count = run.num_ll_points
+            if not self.copied:
+                self.start = run.ll_timestamps[0]
+            # Anything older than the buffer holds would only get overwritten
+            first = max(self.copied, count - self.buffer.capacity)
+            new_timestamps = run.ll_timestamps[first:count].copy()
+            new_values = run.ll_values[first:count].copy()
+            running_slope = run.running_slope
+            slope, std_err = running_slope.slope, running_slope.std_err
+            mean_timestamp = running_slope.mean_x
+            mean_value = running_slope.mean_y
+            level = cryomodule.averaged_liquid_level
+            starting_level = phase.starting_level
+
+        self.buffer.extend(new_timestamps, new_values)
+        self.copied = count
+
+        timestamps, values = self.buffer.arrays()
+        latest = timestamps[-1]
+        if np.isfinite(std_err):
+            # Corrected the same way as the stop criterion, from the samples
+            # in the buffer rather than the whole run
+            residuals = values - (mean_value + slope * (timestamps - mean_timestamp))
+            std_err *= np.sqrt(q0_slopes.autocorrelation_time(residuals))
+        relative_error = std_err / abs(slope) if slope else np.inf
+        return LiveSnapshot(
+            name=phase.name,
+            timestamps=timestamps,
+            values=values,
+            num_points=count,
+            start=self.start,
+            latest=latest,
+            level=level,
+            slope=slope,
+            std_err=std_err,
+            relative_error=relative_error,
+            mean_timestamp=mean_timestamp,
+            mean_value=mean_value,
+            heater=run.heater_readback.mean,
+            pressure=run.pressure.mean if isinstance(run, RFRun) else None,
+            target_rel_error=phase.target_rel_error,
+            projected_end=projected_end(
+                self.start,
+                latest,
+                count,
+                level,
+                slope,
+                relative_error,
+                starting_level,
+                phase.target_ll_diff,
+                phase.target_rel_error,
+            ),
+        )
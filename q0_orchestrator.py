@@ -0,0 +1,157 @@
+"""
+Runs calibrations and Q0 measurements on several cryomodules at once, all
+stepped by one AcquisitionLoop thread. Every cryomodule gets a
+CryomoduleJob tracking what it's doing that can be paused, resumed or
+aborted on its own, while the cryomodules share limits on things the
+cryoplant cares about (how many can have their JT valve in manual at the
+same time).
+"""
+
+import threading
+from itertools import chain
+from typing import Dict, Iterator, List, Optional
+
+import q0_utils
+from q0_acquisition import (
+    ACQ_ABORTED,
+    ACQ_DONE,
+    ACQ_FAILED,
+    ACQ_PAUSED,
+    ACQ_QUEUED,
+    ACQ_RUNNING,
+    Acquisition,
+    AcquisitionLoop,
+    Phase,
+    RampCavitiesPhase,
+)
+from q0_linac import Q0Cryomodule
+
+JOB_QUEUED = ACQ_QUEUED
+JOB_RUNNING = ACQ_RUNNING
+JOB_PAUSED = ACQ_PAUSED
+JOB_DONE = ACQ_DONE
+JOB_ABORTED = ACQ_ABORTED
+JOB_FAILED = ACQ_FAILED
+
+
+class CryomoduleJob(Acquisition):
+    def __init__(
+        self,
+        cryomodule: Q0Cryomodule,
+        calibration_kwargs: Optional[Dict] = None,
+        amplitudes: Optional[Dict[int, float]] = None,
+        q0_kwargs: Optional[Dict] = None,
+        resume: bool = False,
+    ):
+        self.calibration_kwargs: Optional[Dict] = calibration_kwargs
+        self.amplitudes: Optional[Dict[int, float]] = amplitudes
+        self.q0_kwargs: Dict = q0_kwargs or {}
+        # Pick up interrupted measurements from their checkpoints instead of
+        # starting them over
+        self.from_checkpoint: bool = resume
+
+        super().__init__(cryomodule, self.job_phases(cryomodule), "Job")
+
+    def has_checkpoint(self, key: str) -> bool:
+        return self.from_checkpoint and bool(self.cryomodule.load_checkpoint(key))
+
+    def job_phases(self, cryomodule: Q0Cryomodule) -> Iterator[Phase]:
+        if self.has_checkpoint(q0_utils.JSON_Q0_CHECKPOINT_KEY):
+            # Finished with the calibration it started with, so there's
+            # nothing to recalibrate for
+            yield from cryomodule.resume_q0_phases()
+            return
+
+        if self.has_checkpoint(q0_utils.JSON_CALIBRATION_CHECKPOINT_KEY):
+            yield from cryomodule.resume_calibration_phases()
+        elif self.calibration_kwargs is not None:
+            yield from cryomodule.calibration_phases(**self.calibration_kwargs)
+
+        if self.amplitudes:
+            yield from self.q0_phases(cryomodule)
+
+    def q0_phases(self, cryomodule: Q0Cryomodule) -> Iterator[Phase]:
+        desired_ll = self.q0_kwargs.get("desired_ll", q0_utils.MAX_DS_LL)
+
+        yield from cryomodule.q0_setup_phases(
+            desiredAmplitudes=self.amplitudes,
+            desired_ll=desired_ll,
+            jt_search_start=self.q0_kwargs.get("jt_search_start"),
+            jt_search_end=self.q0_kwargs.get("jt_search_end"),
+        )
+        yield RampCavitiesPhase(cryomodule, self.amplitudes)
+        yield from cryomodule.q0_phases(
+            desiredAmplitudes=self.amplitudes,
+            desired_ll=desired_ll,
+            ll_drop=self.q0_kwargs.get("ll_drop", q0_utils.TARGET_LL_DIFF),
+            target_rel_error=self.q0_kwargs.get(
+                "target_rel_error", q0_utils.TARGET_DLL_DT_REL_ERROR
+            ),
+        )
+
+
+class Q0Orchestrator:
+    def __init__(self, max_manual_jt: int = q0_utils.MAX_MANUAL_JT_CRYOMODULES):
+        self.loop = AcquisitionLoop()
+        self.jt_manual_slots = threading.BoundedSemaphore(max_manual_jt)
+        self.jobs: Dict[str, CryomoduleJob] = {}
+
+    def submit(
+        self,
+        cryomodule: Q0Cryomodule,
+        calibration_kwargs: Optional[Dict] = None,
+        amplitudes: Optional[Dict[int, float]] = None,
+        q0_kwargs: Optional[Dict] = None,
+        resume: bool = False,
+    ) -> CryomoduleJob:
+        """
+        Queues a calibration (if calibration_kwargs isn't None) followed by a
+        Q0 measurement at amplitudes (if given) on cryomodule. With resume,
+        either one that was interrupted gets finished from its checkpoint
+        instead.
+        """
+        if cryomodule.name in self.jobs and self.jobs[cryomodule.name].is_active:
+            raise q0_utils.Q0AbortError(f"{cryomodule} is already being measured")
+
+        cryomodule.jt_manual_slots = self.jt_manual_slots
+        job = CryomoduleJob(
+            cryomodule, calibration_kwargs, amplitudes, q0_kwargs, resume=resume
+        )
+        self.jobs[cryomodule.name] = job
+        self.loop.submit(job)
+        return job
+
+    def abort(self, cm_name: str):
+        job = self.jobs[cm_name]
+        if job.is_active:
+            job.abort()
+
+    def abort_all(self):
+        for cm_name in self.jobs.keys():
+            self.abort(cm_name)
+
+    def pause(self, cm_name: str):
+        """Holds the cryomodule's job once its current phase is done"""
+        self.jobs[cm_name].pause()
+
+    def resume(self, cm_name: str):
+        self.jobs[cm_name].resume()
+
+    @property
+    def status(self) -> List[str]:
+        return [str(job) for job in self.jobs.values()]
+
+    @property
+    def timings(self) -> List[str]:
+        return list(
+            chain.from_iterable(job.timing_summary for job in self.jobs.values())
+        )
+
+    def wait(self) -> Dict[str, CryomoduleJob]:
+        for job in self.jobs.values():
+            job.finished.wait()
+        return self.jobs
+
+    def shutdown(self):
+        self.abort_all()
+        self.wait()
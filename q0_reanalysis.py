@@ -0,0 +1,272 @@
+"""
+Headless batch reanalysis of every stored calibration and Q0 measurement.
+
+Each cryomodule's calibrations are refit from their raw heater run traces,
+then each of its Q0 measurements is recomputed against the (refit)
+calibration it was taken with. Cryomodules are handled in parallel worker
+processes, and everything ends up in one CSV table next to the values that
+are currently stored in the results catalog. Nothing in the catalog or data/
+is modified.
+
+    python q0_reanalysis.py [--estimator siegel] [--r-over-q 1012]
+                            [--output results.csv] [CM ...]
+
+Q0 itself is computed for all of a cryomodule's measurements in one
+vectorised pass, both with and without the helium temperature correction.
+"""
+
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import q0_catalog
+import q0_slopes
+import q0_store
+import q0_utils
+
+CALIBRATION_TYPE = "Calibration"
+Q0_TYPE = "Q0"
+
+RESULT_FIELDS = [
+    "Cryomodule",
+    "Type",
+    q0_utils.JSON_START_KEY,
+    "Calibration Used",
+    "Slope Estimator",
+    "Calculated Heat vs dll/dt Slope",
+    "Calculated Adjustment",
+    "Calculated Raw Heat Load",
+    "Calculated Adjusted Heat Load",
+    "Calculated Q0",
+    "Calculated Corrected Q0",
+    "Stored Heat vs dll/dt Slope",
+    "Stored Q0",
+    "Error",
+]
+
+# Anything a malformed or half written session can throw at us
+REANALYSIS_ERRORS = (
+    KeyError,
+    TypeError,
+    ValueError,
+    ZeroDivisionError,
+    q0_utils.DataError,
+)
+
+
+def get_cryomodule_names() -> List[str]:
+    return q0_catalog.cryomodule_names(read_only=True)
+
+
+def get_cavity_length(cm_name: str) -> float:
+    # Harmonic linearizer cavities aren't CAV_LENGTH long, and only lcls_tools
+    # knows which cryomodules have them
+    from q0_linac import Q0_CRYOMODULES
+
+    return Q0_CRYOMODULES[cm_name].cavities[1].length
+
+
+def read_json_if_exists(filepath: str) -> Dict:
+    if not os.path.isfile(filepath):
+        return {}
+    return q0_utils.read_json_data(filepath)
+
+
+def fit_run(data_file: str, run_data: Dict, estimator: str) -> float:
+    timestamps, values = q0_store.read_run_ll(data_file, run_data)
+    slope, intercept = q0_slopes.fit_slope(timestamps, values, estimator)
+    return slope
+
+
+def reanalyze_calibration(
+    data_file: str, session: Dict, estimator: str
+) -> Tuple[Optional[float], float]:
+    heat_loads = []
+    dll_dts = []
+    for run_data in session.values():
+        heat_loads.append(run_data[q0_utils.JSON_HEATER_READBACK_KEY])
+        dll_dts.append(fit_run(data_file, run_data, estimator))
+    return q0_utils.calc_calibration_fit(heat_loads, dll_dts)
+
+
+def reanalyze_q0(
+    data_file: str, session: Dict, estimator: str, slope: float, intercept: float
+) -> Dict[str, float]:
+    """Everything up to Q0 itself, which gets calculated in bulk"""
+    heater_data: Dict = session[q0_utils.JSON_HEATER_RUN_KEY]
+    rf_data: Dict = session[q0_utils.JSON_RF_RUN_KEY]
+
+    heater_raw_heat = (fit_run(data_file, heater_data, estimator) - intercept) / slope
+    adjustment = heater_data[q0_utils.JSON_HEATER_READBACK_KEY] - heater_raw_heat
+    raw_heat = (fit_run(data_file, rf_data, estimator) - intercept) / slope
+    heat_load = raw_heat + adjustment
+
+    return {
+        "Calculated Raw Heat Load": raw_heat,
+        "Calculated Adjustment": adjustment,
+        "Calculated Adjusted Heat Load": heat_load,
+        "Effective Amplitude": q0_utils.calc_effective_amplitude(
+            rf_data[q0_utils.JSON_CAV_AMPS_KEY]
+        ),
+        "Average Pressure": float(rf_data[q0_utils.JSON_AVG_PRESS_KEY]),
+    }
+
+
+def fill_q0s(rows: List[Dict], cav_length: float, r_over_q: float = q0_utils.R_OVER_Q):
+    """Adds the uncorrected and corrected Q0 to rows all in one go"""
+    if not rows:
+        return
+
+    uncorrected, corrected = q0_utils.calc_q0_batch(
+        amplitudes=[row.pop("Effective Amplitude") for row in rows],
+        rf_heat_loads=[row["Calculated Adjusted Heat Load"] for row in rows],
+        avg_pressures=[row.pop("Average Pressure") for row in rows],
+        cav_lengths=cav_length,
+        r_over_q=r_over_q,
+    )
+    for row, q0, corrected_q0 in zip(rows, uncorrected, corrected):
+        row["Calculated Q0"] = float(q0)
+        row["Calculated Corrected Q0"] = float(corrected_q0)
+
+
+def reanalyze_cryomodule(
+    cm_name: str,
+    estimator: str,
+    cav_length: float,
+    r_over_q: float = q0_utils.R_OVER_Q,
+) -> List[Dict]:
+    calib_data_file = q0_utils.CALIB_DATA_FILE.format(CM=cm_name)
+    q0_data_file = q0_utils.Q0_DATA_FILE.format(CM=cm_name)
+    calib_data: Dict = read_json_if_exists(calib_data_file)
+    q0_data: Dict = read_json_if_exists(q0_data_file)
+
+    results = []
+    q0_rows = []
+    fits: Dict[str, Tuple[Optional[float], float]] = {}
+
+    for calib_record in q0_catalog.calibrations(cm_name, read_only=True):
+        time_stamp = calib_record.time_stamp
+        row = {
+            "Cryomodule": cm_name,
+            "Type": CALIBRATION_TYPE,
+            q0_utils.JSON_START_KEY: time_stamp,
+            "Slope Estimator": estimator,
+            "Stored Heat vs dll/dt Slope": calib_record.slope,
+        }
+        try:
+            slope, intercept = reanalyze_calibration(
+                calib_data_file, calib_data[time_stamp], estimator
+            )
+            fits[time_stamp] = (slope, intercept)
+            row["Calculated Heat vs dll/dt Slope"] = slope
+            row["Calculated Adjustment"] = intercept
+            if slope is None:
+                row["Error"] = "Calibration fit failed"
+        except REANALYSIS_ERRORS as e:
+            row["Error"] = f"{type(e).__name__}: {e}"
+        results.append(row)
+
+    for q0_record in q0_catalog.q0_measurements(cm_name, read_only=True):
+        time_stamp = q0_record.time_stamp
+        calib_time_stamp = q0_record.calibration_time_stamp
+        row = {
+            "Cryomodule": cm_name,
+            "Type": Q0_TYPE,
+            q0_utils.JSON_START_KEY: time_stamp,
+            "Calibration Used": calib_time_stamp,
+            "Slope Estimator": estimator,
+            "Stored Q0": q0_record.q0,
+        }
+        slope, intercept = fits.get(calib_time_stamp, (None, 0))
+        if slope is None:
+            row["Error"] = f"No usable calibration from {calib_time_stamp}"
+        else:
+            row["Calculated Heat vs dll/dt Slope"] = slope
+            try:
+                row.update(
+                    reanalyze_q0(
+                        q0_data_file, q0_data[time_stamp], estimator, slope, intercept
+                    )
+                )
+                q0_rows.append(row)
+            except REANALYSIS_ERRORS as e:
+                row["Error"] = f"{type(e).__name__}: {e}"
+        results.append(row)
+
+    fill_q0s(q0_rows, cav_length, r_over_q)
+    return results
+
+
+def reanalyze(
+    cm_names: List[str],
+    estimator: str = q0_utils.SLOPE_ESTIMATOR,
+    max_workers: Optional[int] = None,
+    r_over_q: float = q0_utils.R_OVER_Q,
+) -> List[Dict]:
+    if estimator not in q0_slopes.SLOPE_ESTIMATORS:
+        raise ValueError(
+            f"Unknown slope estimator {estimator}, expected one of"
+            f" {list(q0_slopes.SLOPE_ESTIMATORS.keys())}"
+        )
+
+    # Looked up here so the workers don't each have to build cryomodules
+    cav_lengths = [get_cavity_length(cm_name) for cm_name in cm_names]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for cm_results in executor.map(
+            reanalyze_cryomodule,
+            cm_names,
+            [estimator] * len(cm_names),
+            cav_lengths,
+            [r_over_q] * len(cm_names),
+        ):
+            results.extend(cm_results)
+    return results
+
+
+def write_results(results: List[Dict], filepath: str):
+    with open(filepath, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute every calibration and Q0 measurement from raw data"
+    )
+    parser.add_argument(
+        "cryomodules", nargs="*", help="cryomodule names, e.g. 02 (default: all)"
+    )
+    parser.add_argument(
+        "--estimator",
+        default=q0_utils.SLOPE_ESTIMATOR,
+        choices=sorted(q0_slopes.SLOPE_ESTIMATORS.keys()),
+        help="dLL/dt fit method",
+    )
+    parser.add_argument(
+        "--r-over-q",
+        type=float,
+        default=q0_utils.R_OVER_Q,
+        help="cavity R/Q in ohms to compute Q0 with",
+    )
+    parser.add_argument("--output", default="reanalysis.csv")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    all_results = reanalyze(
+        args.cryomodules or get_cryomodule_names(),
+        args.estimator,
+        args.workers,
+        args.r_over_q,
+    )
+    write_results(all_results, args.output)
+
+    num_errors = sum(1 for row in all_results if row.get("Error"))
+    print(
+        f"Wrote {len(all_results)} results to {args.output}"
+        f" ({num_errors} could not be recomputed)"
+    )
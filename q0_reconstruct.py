@@ -0,0 +1,347 @@
+"""
+Rebuilds calibrations and Q0 measurements after the fact from archived
+data, for when a measurement was run but never saved (or was taken by
+hand).
+
+Everything to recover goes in one spec file:
+
+    {
+        "calibrations": [
+            {
+                "cryomodule": "12",
+                "time_stamp": "08/05/22 15:35:12",
+                "valve_params": {"refValvePos": 32.3, "refHeatLoadDes": 48.0,
+                                 "refHeatLoadAct": 47.7},
+                "runs": [["08/03/22 15:42:36", "08/03/22 15:49:42"], ...]
+            }
+        ],
+        "q0_measurements": [
+            {
+                "cryomodule": "14",
+                "calibration": "08/05/22 16:00:32",
+                "heater_run": ["08/05/22 20:26:00", "08/05/22 20:32:00"],
+                "rf_run": ["08/05/22 20:13:00", "08/05/22 20:22:00"],
+                "amplitudes": {"2": 16.6, "3": 16.6, "6": 16.6},
+                "heater_run_heatload": 48.0
+            }
+        ],
+        "cryomodules": {
+            "14": {
+                "ds_level_pv": "CLL:CM14:2301:DS:LVL",
+                "heater_readback_pv": "CPIC:CM14:0000:EHCV:ORBV",
+                "ds_pressure_pv": "CPT:CM14:2302:DS:PRESS",
+                "cav_length": 1.038
+            }
+        }
+    }
+
+and gets recovered with
+
+    python q0_reconstruct.py spec.json [--archive local_archive.npz]
+
+All the windows for a cryomodule are fetched together: windows close enough
+in time share one archiver request covering all of them, which is then
+sliced up per run. Calibrations are rebuilt before Q0 measurements so that
+a Q0 measurement can use a calibration recovered by the same spec.
+
+heater_run_heatload is only the heat load recorded as the heater run's
+desired setting (it defaults to MINIMUM_HEATLOAD); the heater adjustment and
+Q0 come from the archived heater readback. Cryomodules listed under
+"cryomodules" are rebuilt from the PV names given there, without lcls_tools,
+so a spec that lists all of its cryomodules can be recovered offline from a
+local archive. Any others get their PV names from q0_linac.
+"""
+
+import argparse
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from os.path import isfile
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+import q0_session_cache
+import q0_utils
+from q0_analysis import Calibration, Q0Measurement
+from q0_archiver import LocalArchiver, to_arrays
+
+if TYPE_CHECKING:
+    from q0_linac import Q0Cryomodule
+
+# Windows closer together than this get fetched in the same request rather
+# than paying for another round trip
+RECONSTRUCT_MAX_GAP = timedelta(hours=2)
+
+
+@dataclass
+class RunWindow:
+    start: datetime
+    end: datetime
+
+    @staticmethod
+    def from_strings(window: Sequence[str]):
+        return RunWindow(
+            start=datetime.strptime(window[0], q0_utils.DATETIME_FORMATTER),
+            end=datetime.strptime(window[1], q0_utils.DATETIME_FORMATTER),
+        )
+
+
+@dataclass
+class ArchivedCavity:
+    number: int
+    length: float
+
+
+class ArchivedCryomodule:
+    """
+    Stands in for a Q0Cryomodule with just what reconstruction needs: its
+    archived PV names, its cavity length and wherever its results get saved
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ds_level_pv: str,
+        heater_readback_pv: str,
+        ds_pressure_pv: str,
+        cav_length: float = q0_utils.CAV_LENGTH,
+    ):
+        self.name = name
+        self.ds_level_pv = ds_level_pv
+        self.heater_readback_pv = heater_readback_pv
+        self.ds_pressure_pv = ds_pressure_pv
+        self.cavities = {num: ArchivedCavity(num, cav_length) for num in range(1, 9)}
+
+        self.valveParams: Optional[q0_utils.ValveParams] = None
+        self.calibration: Optional[Calibration] = None
+        self.q0_measurement: Optional[Q0Measurement] = None
+
+        self._calib_data_file = q0_utils.CALIB_DATA_FILE.format(CM=name)
+        self._q0_data_file = q0_utils.Q0_DATA_FILE.format(CM=name)
+
+    def __str__(self):
+        return f"CM{self.name}"
+
+    @property
+    def calib_data_file(self):
+        if not isfile(self._calib_data_file):
+            q0_utils.make_json_file(self._calib_data_file)
+        return self._calib_data_file
+
+    @property
+    def q0_data_file(self):
+        if not isfile(self._q0_data_file):
+            q0_utils.make_json_file(self._q0_data_file)
+        return self._q0_data_file
+
+    def load_calibration(self, time_stamp: str):
+        self.calibration = q0_session_cache.load_calibration(self, time_stamp)
+        self.valveParams = self.calibration.valve_params
+
+
+def spec_cryomodules(spec: Dict) -> Mapping[str, "Q0Cryomodule"]:
+    """Every cryomodule the spec mentions, by name"""
+    cryomodules = {
+        name: ArchivedCryomodule(name, **pvs)
+        for name, pvs in spec.get("cryomodules", {}).items()
+    }
+    for entry in spec.get("calibrations", []) + spec.get("q0_measurements", []):
+        name = entry["cryomodule"]
+        if name not in cryomodules:
+            from q0_linac import Q0_CRYOMODULES
+
+            cryomodules[name] = Q0_CRYOMODULES[name]
+    return cryomodules
+
+
+def group_windows(
+    windows: List[RunWindow], max_gap: timedelta = RECONSTRUCT_MAX_GAP
+) -> List[List[int]]:
+    """Indices of windows that can share a request, in time order"""
+    order = sorted(range(len(windows)), key=lambda idx: windows[idx].start)
+    groups = []
+    group_end = None
+    for idx in order:
+        if group_end is None or windows[idx].start - group_end > max_gap:
+            groups.append([])
+            group_end = windows[idx].end
+        groups[-1].append(idx)
+        group_end = max(group_end, windows[idx].end)
+    return groups
+
+
+def fetch_windows(
+    archiver, pvs: List[str], windows: List[RunWindow]
+) -> List[Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Returns, for each window, {pv: (timestamps, values)} for every pv,
+    making one archiver request per group of nearby windows
+    """
+    results: List[Optional[Dict]] = [None] * len(windows)
+
+    for group in group_windows(windows):
+        start = min(windows[idx].start for idx in group)
+        end = max(windows[idx].end for idx in group)
+        data = archiver.getValuesOverTimeRange(pvList=pvs, startTime=start, endTime=end)
+        arrays = {pv: to_arrays(data.timeStamps[pv], data.values[pv]) for pv in pvs}
+
+        for idx in group:
+            window = windows[idx]
+            results[idx] = {}
+            for pv, (timestamps, values) in arrays.items():
+                first, last = np.searchsorted(
+                    timestamps,
+                    [window.start.timestamp(), window.end.timestamp()],
+                    side="left",
+                )
+                results[idx][pv] = (timestamps[first:last], values[first:last])
+
+    return results
+
+
+def fill_run(run: q0_utils.DataRun, window: RunWindow, data: Dict, cm: "Q0Cryomodule"):
+    run.start_time = window.start
+    run.end_time = window.end
+    run.set_ll_data(*data[cm.ds_level_pv])
+    run.heater_readback.extend(data[cm.heater_readback_pv][1])
+
+
+def reconstruct_calibration(
+    cm: "Q0Cryomodule",
+    time_stamp: str,
+    valve_params: q0_utils.ValveParams,
+    windows: List[RunWindow],
+    data: List[Dict],
+) -> Calibration:
+    cm.valveParams = valve_params
+    calibration = Calibration(time_stamp=time_stamp, cryomodule=cm)
+
+    for window, run_data in zip(windows, data):
+        readback = run_data[cm.heater_readback_pv][1]
+        run = q0_utils.HeaterRun(
+            heat_load=np.mean(readback) - valve_params.refHeatLoadAct,
+            reference_heat=valve_params.refHeatLoadAct,
+        )
+        fill_run(run, window, run_data, cm)
+        calibration.heater_runs.append(run)
+
+    calibration.save_data()
+    calibration.save_results()
+    cm.calibration = calibration
+    print(f"Reconstructed {cm} calibration {time_stamp}: {calibration.dLLdt_dheat}")
+    return calibration
+
+
+def reconstruct_q0(
+    cm: "Q0Cryomodule",
+    calibration_time_stamp: str,
+    amplitudes: Dict[int, float],
+    heater_window: RunWindow,
+    heater_data: Dict,
+    rf_window: RunWindow,
+    rf_data: Dict,
+    heater_run_heatload: float = q0_utils.MINIMUM_HEATLOAD,
+) -> Q0Measurement:
+    cm.load_calibration(calibration_time_stamp)
+
+    q0_meas = Q0Measurement(cm)
+    q0_meas.amplitudes = amplitudes
+    q0_meas.start_time = rf_window.start
+    q0_meas.heater_run_heatload = heater_run_heatload
+
+    q0_meas.heater_run.reference_heat = cm.valveParams.refHeatLoadAct
+    fill_run(q0_meas.heater_run, heater_window, heater_data, cm)
+
+    q0_meas.rf_run.reference_heat = cm.valveParams.refHeatLoadAct
+    fill_run(q0_meas.rf_run, rf_window, rf_data, cm)
+    q0_meas.rf_run.pressure.extend(rf_data[cm.ds_pressure_pv][1])
+
+    q0_meas.save_data()
+    q0_meas.save_results()
+    cm.q0_measurement = q0_meas
+    print(f"Reconstructed {cm} Q0 measurement {q0_meas.start_time}: {q0_meas.q0:.2e}")
+    return q0_meas
+
+
+def reconstruct(spec: Dict, archiver):
+    cryomodules = spec_cryomodules(spec)
+
+    # (spec entry, its windows), calibrations first so that Q0 measurements
+    # can use calibrations recovered alongside them
+    cal_jobs = [
+        (cal_spec, [RunWindow.from_strings(window) for window in cal_spec["runs"]])
+        for cal_spec in spec.get("calibrations", [])
+    ]
+    q0_jobs = [
+        (
+            q0_spec,
+            [
+                RunWindow.from_strings(q0_spec["heater_run"]),
+                RunWindow.from_strings(q0_spec["rf_run"]),
+            ],
+        )
+        for q0_spec in spec.get("q0_measurements", [])
+    ]
+    jobs = cal_jobs + q0_jobs
+
+    job_data: List[List[Dict]] = [[] for _ in jobs]
+    for cm_name in sorted({job_spec["cryomodule"] for job_spec, _ in jobs}):
+        cm = cryomodules[cm_name]
+        pvs = [cm.ds_level_pv, cm.heater_readback_pv, cm.ds_pressure_pv]
+        owners = [
+            idx
+            for idx, (job_spec, _) in enumerate(jobs)
+            if job_spec["cryomodule"] == cm_name
+        ]
+        fetched = iter(
+            fetch_windows(
+                archiver, pvs, [window for idx in owners for window in jobs[idx][1]]
+            )
+        )
+        for idx in owners:
+            job_data[idx] = [next(fetched) for _ in jobs[idx][1]]
+
+    for (cal_spec, windows), data in zip(cal_jobs, job_data):
+        reconstruct_calibration(
+            cryomodules[cal_spec["cryomodule"]],
+            cal_spec["time_stamp"],
+            q0_utils.ValveParams(**cal_spec["valve_params"]),
+            windows,
+            data,
+        )
+
+    for (q0_spec, windows), data in zip(q0_jobs, job_data[len(cal_jobs) :]):
+        reconstruct_q0(
+            cryomodules[q0_spec["cryomodule"]],
+            q0_spec["calibration"],
+            {int(cav): amp for cav, amp in q0_spec["amplitudes"].items()},
+            windows[0],
+            data[0],
+            windows[1],
+            data[1],
+            q0_spec.get("heater_run_heatload", q0_utils.MINIMUM_HEATLOAD),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild calibrations and Q0 measurements from archived data"
+    )
+    parser.add_argument("spec", help="JSON file listing what to reconstruct")
+    parser.add_argument(
+        "--archive",
+        default=None,
+        help="npz file to read instead of the LCLS archiver (see LocalArchiver)",
+    )
+    args = parser.parse_args()
+
+    if args.archive:
+        archiver = LocalArchiver.load(args.archive)
+    else:
+        import lcls_tools.common.data_analysis.archiver as lcls_archiver
+
+        archiver = lcls_archiver.Archiver("lcls")
+
+    with open(args.spec) as f:
+        reconstruct(json.load(f), archiver)
@@ -0,0 +1,202 @@
+"""
+Keeps recently loaded calibrations and Q0 measurements in memory so going
+back and forth between sessions doesn't re-read and re-parse them every time.
+
+Loads run on a small thread pool and hand back futures, so the GUI never has
+to wait on the disk, and the sessions next to the one being looked at can be
+loaded before they're asked for. A cached session is only reused while the
+data file it came from and its catalog row are unchanged; saving anything to
+that file or saving the session's results again makes the next request load
+it again. The catalog gets checked on the pool along with the load, so asking
+for a cached session hands back a future that's done as soon as the check is.
+
+Loading is read only: nothing here writes to the data files, the catalog or
+the cryomodule, so sessions can be loaded from any thread. Making a loaded
+session the cryomodule's current one is up to Q0Cryomodule.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Set, Tuple
+
+import q0_catalog
+import q0_store
+import q0_utils
+from q0_analysis import Calibration, Q0Measurement
+
+if TYPE_CHECKING:
+    from q0_linac import Q0Cryomodule
+
+
+def load_calibration(cryomodule, time_stamp: str) -> Calibration:
+    # type: (Q0Cryomodule, str) -> Calibration
+    calibration = Calibration(time_stamp=time_stamp, cryomodule=cryomodule)
+    calibration.load_data()
+    # Fit it here so it isn't left to whichever thread shows it first
+    calibration.dLLdt_dheat
+    return calibration
+
+
+def load_q0_measurement(cryomodule, time_stamp: str) -> Q0Measurement:
+    # type: (Q0Cryomodule, str) -> Q0Measurement
+    q0_measurement = Q0Measurement(cryomodule)
+    q0_measurement.load_data(time_stamp)
+    # Everything but the Q0 itself depends on the calibration in use
+    q0_measurement.rf_run.dll_dt
+    q0_measurement.heater_run.dll_dt
+    return q0_measurement
+
+
+@dataclass(frozen=True)
+class SessionKind:
+    name: str
+    load: Callable[["Q0Cryomodule", str], object]
+    # Just the path; the cryomodule's data file properties create the file
+    data_file: Callable[["Q0Cryomodule"], str]
+    # (cm_name, time_stamp) -> catalog row version
+    catalog_version: Callable[[str, str], Optional[int]]
+
+
+CALIBRATIONS = SessionKind(
+    "calibration",
+    load_calibration,
+    lambda cryomodule: cryomodule._calib_data_file,
+    q0_catalog.calibration_version,
+)
+Q0_MEASUREMENTS = SessionKind(
+    "Q0 measurement",
+    load_q0_measurement,
+    lambda cryomodule: cryomodule._q0_data_file,
+    q0_catalog.q0_measurement_version,
+)
+
+
+@dataclass
+class _CachedSession:
+    data_file_version: Tuple
+    future: Optional[Future] = None
+    # Filled in on the pool once the session's catalog row has been looked up
+    catalog_version: Optional[int] = None
+
+
+class SessionCache:
+    def __init__(
+        self,
+        max_sessions: int = q0_utils.SESSION_CACHE_SIZE,
+        max_workers: int = q0_utils.SESSION_LOAD_WORKERS,
+    ):
+        self.max_sessions = max_sessions
+        self.max_workers = max_workers
+
+        # (kind, cryomodule name, time stamp) -> cached session, least
+        # recently used first
+        self.sessions: "OrderedDict[Tuple, _CachedSession]" = OrderedDict()
+        # Sessions only loaded ahead of time that nobody has asked for yet,
+        # which are dropped from the queue when the prefetch moves on
+        self.prefetched: Set[Tuple] = set()
+        # Reentrant since cancelling a future runs its callbacks right away
+        self.lock = threading.RLock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def get(self, kind: SessionKind, cryomodule, time_stamp: str) -> Future:
+        # type: (SessionKind, Q0Cryomodule, str) -> Future
+        """
+        Future for the session, which only has to check the catalog if the
+        session is cached. Failed loads aren't cached, so asking again retries
+        them.
+        """
+        return self._future(kind, cryomodule, time_stamp, prefetch=False)
+
+    def prefetch(self, kind: SessionKind, cryomodule, time_stamps: Iterable[str]):
+        # type: (SessionKind, Q0Cryomodule, Iterable[str]) -> None
+        """
+        Queues loads for time_stamps (most wanted first), cancelling the
+        previous prefetches that haven't started and aren't wanted anymore
+        """
+        time_stamps = list(time_stamps)
+        wanted = {(kind, cryomodule.name, time_stamp) for time_stamp in time_stamps}
+
+        with self.lock:
+            for key in self.prefetched - wanted:
+                if key in self.sessions:
+                    self.sessions[key].future.cancel()
+                self.prefetched.discard(key)
+
+        for time_stamp in time_stamps:
+            self._future(kind, cryomodule, time_stamp, prefetch=True)
+
+    def _future(
+        self, kind: SessionKind, cryomodule, time_stamp: str, prefetch: bool
+    ) -> Future:
+        key = (kind, cryomodule.name, time_stamp)
+        data_file_version = q0_store.data_file_version(kind.data_file(cryomodule))
+
+        with self.lock:
+            cached = self.sessions.get(key)
+            if cached and (
+                cached.data_file_version != data_file_version
+                or cached.future.cancelled()
+            ):
+                cached = None
+            if cached and not cached.future.done():
+                # Still loading (or checking), so as fresh as it gets
+                self.sessions.move_to_end(key)
+                if not prefetch:
+                    self.prefetched.discard(key)
+                return cached.future
+
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="session-load"
+                )
+            entry = _CachedSession(data_file_version)
+            future = self._executor.submit(
+                self._load, kind, cryomodule, time_stamp, entry, cached
+            )
+            entry.future = future
+            self.sessions[key] = entry
+            self.sessions.move_to_end(key)
+            if prefetch:
+                self.prefetched.add(key)
+            else:
+                self.prefetched.discard(key)
+
+            while len(self.sessions) > self.max_sessions:
+                evicted, _ = self.sessions.popitem(last=False)
+                self.prefetched.discard(evicted)
+
+        future.add_done_callback(partial(self._forget_failure, key))
+        return future
+
+    @staticmethod
+    def _load(
+        kind: SessionKind,
+        cryomodule,
+        time_stamp: str,
+        entry: _CachedSession,
+        cached: Optional[_CachedSession],
+    ):
+        # The catalog lookup happens here rather than on the caller's thread
+        # (usually the GUI's), since it can mean opening the catalog
+        entry.catalog_version = kind.catalog_version(cryomodule.name, time_stamp)
+        if cached and cached.catalog_version == entry.catalog_version:
+            return cached.future.result()
+        return kind.load(cryomodule, time_stamp)
+
+    def _forget_failure(self, key: Tuple, future: Future):
+        if future.cancelled() or future.exception():
+            with self.lock:
+                if key in self.sessions and self.sessions[key].future is future:
+                    del self.sessions[key]
+                self.prefetched.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+            self.prefetched.clear()
+
+
+SESSIONS = SessionCache()
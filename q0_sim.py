@@ -0,0 +1,490 @@
+"""
+Simulated cryomodule for running the acquisition code without the control
+system. SimulatedBackend plugs into q0_epics and answers every caget, caput
+and camonitor from a simple model of a cryomodule's helium bath:
+
+- The downstream liquid level falls in proportion to the heat going into the
+  bath (heaters, RF and a static load) minus what the JT valve is letting
+  through to replace it
+- The JT valve slews towards its manual setpoint or, in auto, towards the
+  position that holds the level at its setpoint
+- The heaters' readback lags their setpoint
+- The 2 K pressure wanders a little around a fixed value
+
+Time only moves when the acquisition code sleeps, so a run is deterministic
+for a given seed and takes however long the model takes to step rather than
+hours. Pass a time_scale to also sleep for real, e.g. to watch a run in the
+GUI at 100x.
+
+Run this module directly to time a full calibration and Q0 measurement on
+one or more cryomodules at once:
+
+    python q0_sim.py [--cryomodules 02 03 ...] [--num-cal-steps 7]
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+import q0_epics
+import q0_utils
+from q0_archiver import LocalArchiver
+
+SIM_EPOCH = datetime(2024, 1, 1)
+
+# Seconds of simulated time per model step
+SIM_TIME_STEP = 1.0
+
+# %/s the liquid level changes per W of heat imbalance, matching the slope of
+# a typical calibration
+SIM_LL_PER_JOULE = 8.4e-5
+
+SIM_STATIC_HEAT = 10.0
+SIM_Q0 = 2.7e10
+SIM_R_OVER_Q = 1012
+
+SIM_JT_SLEW_RATE = 0.5
+SIM_JT_AUTO_GAIN = 50
+SIM_HEATER_TIME_CONSTANT = 10.0
+
+SIM_PRESSURE = 31.0
+
+# Standard deviations of the readback noise
+SIM_LL_NOISE = 0.02
+SIM_HEATER_NOISE = 0.05
+SIM_PRESSURE_NOISE = 0.02
+
+
+class SimulatedCryomodule:
+    def __init__(
+        self,
+        cryomodule,
+        valve_params: q0_utils.ValveParams = q0_utils.ValveParams(
+            refValvePos=45, refHeatLoadDes=48, refHeatLoadAct=48
+        ),
+        q0: float = SIM_Q0,
+        liquid_level: float = 92,
+        seed: int = 0,
+    ):
+        self.cryomodule = cryomodule
+        self.valve_params = valve_params
+        self.q0 = q0
+        self.rng = np.random.default_rng(seed)
+
+        self.liquid_level = liquid_level
+        self.ll_setpoint = liquid_level
+        self.jt_mode = q0_utils.JT_AUTO_MODE_VALUE
+        self.jt_position = valve_params.refValvePos
+        self.jt_setpoint = valve_params.refValvePos
+        self.heater_mode = q0_utils.HEATER_SEQUENCER_VALUE
+        self.heater_setpoint = valve_params.refHeatLoadDes
+        self.heater_power = valve_params.refHeatLoadAct
+        self.pressure = SIM_PRESSURE
+
+        self.cavity_amplitudes: Dict[int, float] = {
+            cav_num: 0 for cav_num in cryomodule.cavities.keys()
+        }
+        self.amplitude_pvs: Dict[str, int] = {
+            cavity.selAmplitudeActPV.pvname: cav_num
+            for cav_num, cavity in cryomodule.cavities.items()
+        }
+
+        # Holding the level steady at the reference valve position means the
+        # valve is carrying away the reference heat plus the static load
+        self.jt_heat_per_percent = (
+            valve_params.refHeatLoadAct + SIM_STATIC_HEAT
+        ) / valve_params.refValvePos
+
+        self.readbacks: Dict[str, float] = {}
+        self.sample()
+
+    @property
+    def rf_heat(self) -> float:
+        return sum(
+            (amp * 1e6) ** 2 / (SIM_R_OVER_Q * self.q0)
+            for amp in self.cavity_amplitudes.values()
+        )
+
+    @property
+    def heat_in(self) -> float:
+        return self.heater_power + self.rf_heat + SIM_STATIC_HEAT
+
+    @property
+    def pv_names(self) -> List[str]:
+        return list(self.readbacks.keys()) + [
+            self.cryomodule.heater_setpoint_pv,
+            self.cryomodule.heater_manual_pv,
+            self.cryomodule.heater_sequencer_pv,
+            self.cryomodule.jtManualSelectPV,
+            self.cryomodule.jtAutoSelectPV,
+            self.cryomodule.jtManPosSetpointPV,
+            self.cryomodule.dsLiqLevSetpointPV,
+            self.cryomodule.cryo_access_pv,
+        ]
+
+    def step(self, dt: float):
+        if self.jt_mode == q0_utils.JT_AUTO_MODE_VALUE:
+            balance = self.heat_in / self.jt_heat_per_percent
+            target = balance + SIM_JT_AUTO_GAIN * (self.ll_setpoint - self.liquid_level)
+        else:
+            target = self.jt_setpoint
+        target = min(max(target, 0), 100)
+        max_move = SIM_JT_SLEW_RATE * dt
+        self.jt_position += min(max(target - self.jt_position, -max_move), max_move)
+
+        self.heater_power += (self.heater_setpoint - self.heater_power) * (
+            1 - np.exp(-dt / SIM_HEATER_TIME_CONSTANT)
+        )
+
+        heat_out = self.jt_position * self.jt_heat_per_percent
+        self.liquid_level += SIM_LL_PER_JOULE * (heat_out - self.heat_in) * dt
+        self.liquid_level = min(max(self.liquid_level, 0), 100)
+
+        self.sample()
+
+    def sample(self):
+        noise = self.rng.standard_normal(3)
+        self.readbacks = {
+            self.cryomodule.ds_level_pv: self.liquid_level + SIM_LL_NOISE * noise[0],
+            self.cryomodule.heater_readback_pv: self.heater_power
+            + SIM_HEATER_NOISE * noise[1],
+            self.cryomodule.ds_pressure_pv: self.pressure
+            + SIM_PRESSURE_NOISE * noise[2],
+            self.cryomodule.jt_valve_readback_pv: self.jt_position,
+            self.cryomodule.jtModePV: self.jt_mode,
+            self.cryomodule.heater_mode_pv: self.heater_mode,
+            **{
+                pvname: self.cavity_amplitudes[cav_num]
+                for pvname, cav_num in self.amplitude_pvs.items()
+            },
+        }
+
+    def get(self, pvname: str):
+        if pvname in self.readbacks:
+            return self.readbacks[pvname]
+        if pvname == self.cryomodule.dsLiqLevSetpointPV:
+            return self.ll_setpoint
+        if pvname == self.cryomodule.heater_setpoint_pv:
+            return self.heater_setpoint
+        if pvname == self.cryomodule.jtManPosSetpointPV:
+            return self.jt_setpoint
+        if pvname == self.cryomodule.cryo_access_pv:
+            return q0_utils.CRYO_ACCESS_VALUE
+        return None
+
+    def put(self, pvname: str, value):
+        # Writing the downstream level is how the acquisition code asks for
+        # a new level setpoint
+        if pvname in [self.cryomodule.ds_level_pv, self.cryomodule.dsLiqLevSetpointPV]:
+            self.ll_setpoint = value
+        elif pvname == self.cryomodule.heater_setpoint_pv:
+            self.heater_setpoint = value
+        elif pvname == self.cryomodule.heater_manual_pv:
+            self.heater_mode = q0_utils.HEATER_MANUAL_VALUE
+        elif pvname == self.cryomodule.heater_sequencer_pv:
+            self.heater_mode = q0_utils.HEATER_SEQUENCER_VALUE
+        elif pvname == self.cryomodule.jtManualSelectPV:
+            self.jt_mode = q0_utils.JT_MANUAL_MODE_VALUE
+            self.jt_setpoint = self.jt_position
+        elif pvname == self.cryomodule.jtAutoSelectPV:
+            self.jt_mode = q0_utils.JT_AUTO_MODE_VALUE
+        elif pvname == self.cryomodule.jtManPosSetpointPV:
+            self.jt_setpoint = value
+        self.sample()
+
+
+class SimulatedPV:
+    # Simulated PVs are there straight away
+    connected = True
+
+    def __init__(self, backend, pvname: str):
+        # type: (SimulatedBackend, str) -> None
+        self.backend = backend
+        self.pvname = pvname
+
+    def get(self, **kwargs):
+        return self.backend.caget(self.pvname)
+
+    def put(self, value, callback: Optional[Callable] = None, **kwargs):
+        # Simulated puts are processed as soon as they're made
+        result = self.backend.caput(self.pvname, value)
+        if callback:
+            callback(pvname=self.pvname)
+        return result
+
+
+class SimulatedBackend(q0_epics.EPICSBackend):
+    def __init__(
+        self,
+        models: List[SimulatedCryomodule],
+        start: datetime = SIM_EPOCH,
+        time_step: float = SIM_TIME_STEP,
+        time_scale: Optional[float] = None,
+        archiver: Optional[LocalArchiver] = None,
+    ):
+        self.models = models
+        # What getRefValveParams gets to search through
+        self.archiver = archiver if archiver else LocalArchiver()
+        self.start = start
+        self.time_step = time_step
+        self.time_scale = time_scale
+
+        self.elapsed = 0.0
+        self._pending = 0.0
+
+        # Time for threads inside acquisition_thread() only moves once all of
+        # them are blocked waiting on it
+        self._clock_lock = threading.Lock()
+        self._participants: Set[int] = set()
+        self._blocked: Dict[int, threading.Condition] = {}
+        self._generation = 0
+        self.monitors: Dict[str, Callable] = {}
+        self.values: Dict[str, float] = {}
+        self.pv_models: Dict[str, SimulatedCryomodule] = {
+            pvname: model for model in models for pvname in model.pv_names
+        }
+
+    def caget(self, pvname: str, **kwargs):
+        if pvname in self.pv_models:
+            return self.pv_models[pvname].get(pvname)
+        return self.values.get(pvname)
+
+    def caput(self, pvname: str, value, **kwargs):
+        if pvname in self.pv_models:
+            self.pv_models[pvname].put(pvname, value)
+        else:
+            self.values[pvname] = value
+        return 1
+
+    def camonitor(self, pvname: str, callback: Callable):
+        self.monitors[pvname] = callback
+
+    def camonitor_clear(self, pvname: str):
+        self.monitors.pop(pvname, None)
+
+    def get_pv(self, pvname: str):
+        return SimulatedPV(self, pvname)
+
+    def get_values_over_time_range(
+        self, pv_list: List[str], start_time: datetime, end_time: datetime
+    ):
+        return self.archiver.get_values_over_time_range(pv_list, start_time, end_time)
+
+    def turn_off_cavity(self, cavity, turn_off_ssa: bool = False):
+        for model in self.models:
+            if cavity in model.cryomodule.cavities.values():
+                model.cavity_amplitudes[cavity.number] = 0
+                model.sample()
+
+    def turn_on_cavity(self, cavity, amplitude: float):
+        for model in self.models:
+            if cavity in model.cryomodule.cavities.values():
+                model.cavity_amplitudes[cavity.number] = amplitude
+                model.sample()
+
+    @contextmanager
+    def acquisition_thread(self):
+        ident = threading.get_ident()
+        with self._clock_lock:
+            self._participants.add(ident)
+        try:
+            yield
+        finally:
+            with self._clock_lock:
+                self._participants.discard(ident)
+                self._blocked.pop(ident, None)
+            self._advance_if_idle()
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def wait_for(self, condition, predicate: Callable, timeout: float) -> bool:
+        if threading.get_ident() in self._participants:
+            return self._wait_shared(condition, predicate, self.elapsed + timeout)
+
+        # Nothing else can run while we wait, so step the model ourselves and
+        # check after every update the monitors deliver
+        deadline = self.elapsed + timeout
+        result = predicate()
+        while not result and self.elapsed < deadline:
+            self.sleep(self.time_step)
+            result = predicate()
+        return result
+
+    def sleep(self, seconds: float):
+        if threading.get_ident() in self._participants:
+            condition = threading.Condition()
+            with condition:
+                self._wait_shared(condition, lambda: False, self.elapsed + seconds)
+            return
+
+        self._pending += seconds
+        while self._pending >= self.time_step:
+            self._pending -= self.time_step
+            self._step()
+
+    def _step(self):
+        if self.time_scale:
+            time.sleep(self.time_step / self.time_scale)
+
+        self.elapsed += self.time_step
+        for model in self.models:
+            model.step(self.time_step)
+        # Every monitored PV updates once per step, like the real ones
+        # ticking over on noise
+        for pvname, callback in list(self.monitors.items()):
+            callback(pvname=pvname, value=self.caget(pvname))
+
+    def _wait_shared(self, condition, predicate: Callable, deadline: float) -> bool:
+        """
+        Waiting when several acquisition threads share the clock: block
+        (releasing condition) and let the clock move on once every thread is
+        blocked, re-checking after each step
+        """
+        ident = threading.get_ident()
+        while True:
+            result = predicate()
+            if result or self.elapsed >= deadline:
+                return result
+
+            with self._clock_lock:
+                generation = self._generation
+                self._blocked[ident] = condition
+            self._advance_if_idle()
+
+            while self._generation == generation and not predicate():
+                condition.wait()
+            with self._clock_lock:
+                self._blocked.pop(ident, None)
+
+    def _advance_if_idle(self):
+        with self._clock_lock:
+            if not self._participants or set(self._blocked) != self._participants:
+                return
+            conditions = list(self._blocked.values())
+            self._blocked.clear()
+
+        # Stepping has to happen outside the clock lock since the monitor
+        # callbacks need the waiting threads' conditions
+        self._step()
+        self._generation += 1
+        for condition in conditions:
+            with condition:
+                condition.notify_all()
+
+
+def run_benchmark(
+    cm_names: List[str],
+    num_cal_steps: int,
+    seed: int,
+    time_scale=None,
+    max_manual_jt: int = q0_utils.MAX_MANUAL_JT_CRYOMODULES,
+    target_rel_error: Optional[float] = q0_utils.TARGET_DLL_DT_REL_ERROR,
+    resume: bool = False,
+):
+    from q0_linac import Q0_CRYOMODULES
+    from q0_orchestrator import Q0Orchestrator
+
+    cryomodules = [Q0_CRYOMODULES[cm_name] for cm_name in cm_names]
+    models = [
+        SimulatedCryomodule(cryomodule, seed=seed + idx)
+        for idx, cryomodule in enumerate(cryomodules)
+    ]
+    backend = SimulatedBackend(models, time_scale=time_scale)
+    q0_epics.set_backend(backend)
+
+    orchestrator = Q0Orchestrator(max_manual_jt=max_manual_jt)
+    try:
+        wall_start = time.perf_counter()
+        for cryomodule, model in zip(cryomodules, models):
+            cryomodule.valveParams = model.valve_params
+            orchestrator.submit(
+                cryomodule,
+                calibration_kwargs={
+                    "num_cal_steps": num_cal_steps,
+                    "target_rel_error": target_rel_error,
+                },
+                amplitudes={cav_num: 16.6 for cav_num in cryomodule.cavities.keys()},
+                q0_kwargs={"target_rel_error": target_rel_error},
+                resume=resume,
+            )
+        orchestrator.wait()
+        wall_time = time.perf_counter() - wall_start
+    finally:
+        orchestrator.shutdown()
+        q0_epics.set_backend()
+
+    print()
+    for cryomodule, model in zip(cryomodules, models):
+        job = orchestrator.jobs[cryomodule.name]
+        if cryomodule.q0_measurement and not job.error:
+            print(
+                f"{job}: simulated Q0 {model.q0:.3e},"
+                f" measured {cryomodule.q0_measurement.q0:.3e}"
+            )
+        else:
+            print(job)
+    for cryomodule in cryomodules:
+        print(f"\n{cryomodule} PV access:")
+        print("\n".join(cryomodule.pvs.summary))
+    print()
+    print(
+        f"{len(cryomodules)} cryomodules: {backend.elapsed / 3600:.2f} simulated"
+        f" hours in {wall_time:.2f}s ({backend.elapsed / wall_time:.0f}x)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time calibrations and Q0 measurements on simulated cryomodules"
+    )
+    parser.add_argument("--cryomodules", nargs="+", default=["02"])
+    parser.add_argument("--num-cal-steps", type=int, default=q0_utils.NUM_CAL_STEPS)
+    parser.add_argument(
+        "--max-manual-jt", type=int, default=q0_utils.MAX_MANUAL_JT_CRYOMODULES
+    )
+    parser.add_argument(
+        "--target-rel-error",
+        type=float,
+        default=q0_utils.TARGET_DLL_DT_REL_ERROR,
+        help="dLL/dt precision that ends a run early (default: always wait for"
+        " the full liquid level drop)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="finish measurements interrupted in a previous run in the same"
+        " --output-dir instead of starting over",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=None)
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="where the simulated runs get saved (default: a new temp dir)",
+    )
+    args = parser.parse_args()
+
+    # All the data files are relative paths, so keep simulated runs out of
+    # the real ones
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="q0_sim_")
+    os.makedirs(output_dir, exist_ok=True)
+    os.chdir(output_dir)
+    print(f"Saving simulated runs to {output_dir}")
+
+    run_benchmark(
+        args.cryomodules,
+        args.num_cal_steps,
+        args.seed,
+        args.time_scale,
+        args.max_manual_jt,
+        args.target_rel_error or None,
+        args.resume,
+    )
@@ -0,0 +1,370 @@
+"""
+Slope estimators used to fit dLL/dt to a run's liquid level trace. Every
+estimator takes (x, y) arrays and returns (slope, intercept), and is looked
+up by name in SLOPE_ESTIMATORS so that the fit method can be switched (and
+whole histories refit) without touching the callers.
+"""
+
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# Upper bound on the number of pairwise slopes held in memory at once
+SIEGEL_CHUNK_ELEMENTS = 2**22
+
+# Below this many points it's faster to just evaluate every pairwise slope
+SIEGEL_BRUTE_FORCE_LIMIT = 500
+
+# Rows whose inner medians are evaluated up front to seed the search
+SIEGEL_NUM_SEED_ROWS = 32
+
+# The search interval stops being tightened once at most this many points
+# could have their inner median inside it, or after this many steps
+SIEGEL_MAX_CANDIDATES = 256
+SIEGEL_MAX_BISECTIONS = 32
+
+SlopeEstimator = Callable[[np.ndarray, np.ndarray], Tuple[float, float]]
+
+
+def _row_medians(slopes: np.ndarray, num_values: int) -> np.ndarray:
+    """
+    Medians of the first num_values order statistics of each row; anything
+    past that has been set to +inf so it can't move the middle ranks
+    """
+    lower, upper = (num_values - 1) // 2, num_values // 2
+    middle = np.partition(slopes, [lower, upper], axis=1)
+    return (middle[:, lower] + middle[:, upper]) / 2
+
+
+def _inner_medians(
+    x: np.ndarray, y: np.ndarray, rows: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    For each requested point, the median of its slopes to every other point,
+    evaluated a block of rows at a time to bound memory
+    """
+    if rows is None:
+        rows = np.arange(x.size)
+    chunk_size = max(1, SIEGEL_CHUNK_ELEMENTS // x.size)
+    medians = np.empty(rows.size)
+
+    for start in range(0, rows.size, chunk_size):
+        chunk = rows[start : start + chunk_size]
+        delta_x = x[chunk, np.newaxis] - x
+        delta_y = y[chunk, np.newaxis] - y
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slopes = delta_y / delta_x
+        # A point paired with itself (or anything sharing its timestamp)
+        # doesn't define a slope
+        same_x = delta_x == 0
+        slopes[same_x] = np.inf
+
+        if np.all(same_x.sum(axis=1) == 1):
+            medians[start : start + chunk.size] = _row_medians(slopes, x.size - 1)
+        else:
+            slopes[same_x] = np.nan
+            medians[start : start + chunk.size] = np.nanmedian(slopes, axis=1)
+
+    return medians
+
+
+def _count_smaller_before(keys: np.ndarray) -> np.ndarray:
+    """
+    For integer keys in [0, n), counts how many earlier entries have a
+    strictly smaller key. Two keys first differ at some bit where the smaller
+    one has a 0, so each bit level is a grouped running count over entries
+    sharing the higher bits. O(n log^2 n) without any per-element Python.
+    """
+    num_points = keys.size
+    counts = np.zeros(num_points, dtype=np.int64)
+    positions = np.arange(num_points)
+    # numpy's stable sort is a linear time radix sort for 16 bit integers
+    if num_points <= np.iinfo(np.int16).max:
+        keys = keys.astype(np.int16)
+
+    for bit in range(max(1, int(keys.max()).bit_length())):
+        order = np.argsort(keys >> (bit + 1), kind="stable")
+        prefixes = (keys >> (bit + 1))[order]
+        is_one = ((keys >> bit) & 1)[order].astype(bool)
+
+        zeros_so_far = np.cumsum(~is_one)
+        group_start = np.ones(num_points, dtype=bool)
+        group_start[1:] = prefixes[1:] != prefixes[:-1]
+        start_idx = np.maximum.accumulate(np.where(group_start, positions, 0))
+        zeros_before_group = zeros_so_far[start_idx] - ~is_one[start_idx]
+
+        counts[order[is_one]] += (zeros_so_far - zeros_before_group)[is_one]
+
+    return counts
+
+
+def _count_slopes_below(x: np.ndarray, y: np.ndarray, theta: float) -> np.ndarray:
+    """
+    For each point i of a strictly increasing x, counts the points j whose
+    slope to i is below theta. With r = y - theta * x that happens exactly
+    when j comes after i with r_j < r_i or before i with r_j > r_i.
+    """
+    residuals = y - theta * x
+    order = np.argsort(residuals)
+    sorted_residuals = residuals[order]
+
+    if np.all(sorted_residuals[1:] != sorted_residuals[:-1]):
+        num_smaller = np.empty(x.size, dtype=np.int64)
+        num_smaller[order] = np.arange(x.size)
+        earlier_smaller = _count_smaller_before(num_smaller)
+        # Without ties every earlier point is either smaller or larger
+        earlier_larger = np.arange(x.size) - earlier_smaller
+    else:
+        num_smaller = np.searchsorted(sorted_residuals, residuals, side="left")
+        num_larger = x.size - np.searchsorted(sorted_residuals, residuals, side="right")
+        earlier_smaller = _count_smaller_before(num_smaller)
+        earlier_larger = _count_smaller_before(num_larger)
+
+    return num_smaller - earlier_smaller + earlier_larger
+
+
+def _interpolate(good, num_good, bad, num_bad, target) -> float:
+    """
+    Linear guess at where the count crosses target, kept off both ends so a
+    badly curved count can't stall the search
+    """
+    step = bad - good
+    if num_bad != num_good:
+        fraction = (target - num_good) / (num_bad - num_good)
+    else:
+        fraction = 0.5
+    return good + step * min(max(fraction, 1 / 16), 15 / 16)
+
+
+def _repeated_median(x: np.ndarray, y: np.ndarray) -> Optional[float]:
+    """
+    Repeated median slope for a strictly increasing x without evaluating
+    every pairwise slope. Returns None if the search can't pin it down, in
+    which case the caller should fall back to brute force.
+
+    Point i's inner median is built from its k_lo-th and k_hi-th smallest
+    slopes and the answer from the K_lo-th and K_hi-th smallest inner medians.
+    The search finds lo and hi such that at most K_lo points have their
+    k_lo-th slope below lo and more than K_hi points have their k_hi-th slope
+    below hi, which puts both outer order statistics in [lo, hi). Only points
+    whose inner median can fall in that interval then need their slopes
+    evaluated; every other point is known to sit entirely below or above it.
+    """
+    # Shifting x leaves every pairwise difference (and so every slope) exactly
+    # as it was, but keeps the residuals used for counting well conditioned
+    x = x - x[0]
+    num_points = x.size
+    k_lo, k_hi = (num_points - 2) // 2, (num_points - 1) // 2
+    big_k_lo, big_k_hi = (num_points - 1) // 2, num_points // 2
+
+    def num_lo_below(counts):
+        return np.count_nonzero(counts > k_lo)
+
+    def num_hi_below(counts):
+        return np.count_nonzero(counts > k_hi)
+
+    seed_rows = np.linspace(0, num_points - 1, SIEGEL_NUM_SEED_ROWS).astype(int)
+    seeds = _inner_medians(x, y, seed_rows)
+    center = np.median(seeds)
+    spread = np.subtract(*np.percentile(seeds, [75, 25]))
+    width = max(spread, abs(center) * 1e-6, np.finfo(float).tiny)
+
+    lo, hi = center - width, center + width
+    lo_counts = _count_slopes_below(x, y, lo)
+    while num_lo_below(lo_counts) > big_k_lo:
+        width *= 2
+        lo = center - width
+        lo_counts = _count_slopes_below(x, y, lo)
+        if not np.isfinite(lo):
+            return None
+
+    hi_counts = _count_slopes_below(x, y, hi)
+    while num_hi_below(hi_counts) <= big_k_hi:
+        width *= 2
+        hi = center + width
+        hi_counts = _count_slopes_below(x, y, hi)
+        if not np.isfinite(hi):
+            return None
+
+    def candidate_rows():
+        return np.flatnonzero((lo_counts <= k_hi) & (hi_counts > k_lo))
+
+    # Pull each end of the interval in toward a rank just short of the one
+    # it has to stay on the right side of, interpolating between the last
+    # value that kept the guarantee and the last one that broke it
+    margin = SIEGEL_MAX_CANDIDATES // 4
+    lo_bad, num_lo_bad = hi, num_lo_below(hi_counts)
+    hi_bad, num_hi_bad = lo, num_hi_below(lo_counts)
+
+    for _ in range(SIEGEL_MAX_BISECTIONS):
+        if candidate_rows().size <= SIEGEL_MAX_CANDIDATES:
+            break
+
+        mid = _interpolate(
+            lo, num_lo_below(lo_counts), lo_bad, num_lo_bad, big_k_lo - margin
+        )
+        counts = _count_slopes_below(x, y, mid)
+        if num_lo_below(counts) <= big_k_lo:
+            lo, lo_counts = mid, counts
+        else:
+            lo_bad, num_lo_bad = mid, num_lo_below(counts)
+
+        mid = _interpolate(
+            hi, num_hi_below(hi_counts), hi_bad, num_hi_bad, big_k_hi + margin
+        )
+        counts = _count_slopes_below(x, y, mid)
+        if num_hi_below(counts) > big_k_hi:
+            hi, hi_counts = mid, counts
+        else:
+            hi_bad, num_hi_bad = mid, num_hi_below(counts)
+
+    candidate_medians = np.sort(_inner_medians(x, y, candidate_rows()))
+
+    # Anything whose k_hi-th slope is below lo has its whole median below lo
+    num_below = np.count_nonzero(lo_counts > k_hi)
+    idx_lo, idx_hi = big_k_lo - num_below, big_k_hi - num_below
+    if idx_lo < 0 or idx_hi >= candidate_medians.size:
+        return None
+
+    slope_lo, slope_hi = candidate_medians[idx_lo], candidate_medians[idx_hi]
+    if slope_lo < lo or slope_hi >= hi:
+        return None
+    return (slope_lo + slope_hi) / 2
+
+
+def siegel_slope(x, y) -> Tuple[float, float]:
+    """
+    Siegel's repeated median line fit, giving the same result as scipy's
+    siegelslopes(y, x) with method="hierarchical".
+
+    scipy builds every pairwise slope at once, which is O(n^2) in both time
+    and memory. Here the median is bracketed by counting slopes below a
+    trial value, which only needs rank arithmetic, and then just the points
+    that can decide the answer have their slopes evaluated. Runs with
+    repeated timestamps, or that the search can't settle, are done by brute
+    force a block of rows at a time.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size < 2:
+        raise ValueError("Need at least two points to fit a slope")
+
+    order = np.argsort(x, kind="stable")
+    sorted_x, sorted_y = x[order], y[order]
+
+    slope = None
+    if x.size > SIEGEL_BRUTE_FORCE_LIMIT and np.all(np.diff(sorted_x) > 0):
+        slope = _repeated_median(sorted_x, sorted_y)
+    if slope is None:
+        slope = np.median(_inner_medians(sorted_x, sorted_y))
+
+    intercept = np.median(y - slope * x)
+    return float(slope), float(intercept)
+
+
+def scipy_siegel_slope(x, y) -> Tuple[float, float]:
+    # scipy.stats is slow to import and the default estimator doesn't need it
+    from scipy.stats import siegelslopes
+
+    slope, intercept = siegelslopes(y, x)
+    return float(slope), float(intercept)
+
+
+def least_squares_slope(x, y) -> Tuple[float, float]:
+    from scipy.stats import linregress
+
+    slope, intercept, r_val, p_val, std_err = linregress(x, y)
+    return float(slope), float(intercept)
+
+
+class RunningSlope:
+    """
+    Least squares fit of a growing series, updated in O(1) per point from
+    running means and centred sums (Welford's method, extended to the cross
+    term) so large timestamps don't cost any precision
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.sum_xx = 0.0
+        self.sum_xy = 0.0
+        self.sum_yy = 0.0
+
+    def add(self, x: float, y: float):
+        self.count += 1
+        delta_x = x - self.mean_x
+        delta_y = y - self.mean_y
+        self.mean_x += delta_x / self.count
+        self.mean_y += delta_y / self.count
+        self.sum_xx += delta_x * (x - self.mean_x)
+        self.sum_xy += delta_x * (y - self.mean_y)
+        self.sum_yy += delta_y * (y - self.mean_y)
+
+    @property
+    def slope(self) -> float:
+        if self.count < 2 or self.sum_xx <= 0:
+            return np.nan
+        return self.sum_xy / self.sum_xx
+
+    @property
+    def std_err(self) -> float:
+        if self.count < 3 or self.sum_xx <= 0:
+            return np.inf
+        residuals = max(self.sum_yy - self.slope * self.sum_xy, 0)
+        return np.sqrt(residuals / (self.count - 2) / self.sum_xx)
+
+    @property
+    def relative_error(self) -> float:
+        slope = self.slope
+        if not slope:
+            return np.inf
+        return self.std_err / abs(slope)
+
+    def residuals(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return y - (self.mean_y + self.slope * (x - self.mean_x))
+
+
+def autocorrelation_time(residuals: np.ndarray) -> float:
+    """
+    Integrated autocorrelation time of a fit's residuals, i.e. how many
+    samples it takes to get one independent one. Liquid level samples are
+    nowhere near independent (the level sloshes and the sensor lags), so a
+    least squares standard error that assumes they are is too small by about
+    the square root of this. The autocorrelation is summed up to the first
+    lag where it stops being positive, and is never taken to be below 1.
+    """
+    residuals = np.asarray(residuals, dtype=float)
+    residuals = residuals[np.isfinite(residuals)]
+    if residuals.size < 3:
+        return 1.0
+
+    centered = residuals - residuals.mean()
+    spectrum = np.fft.rfft(centered, 2 * centered.size)
+    autocovariance = np.fft.irfft(spectrum * np.conj(spectrum))[: centered.size]
+    if autocovariance[0] <= 0:
+        return 1.0
+
+    autocorrelation = autocovariance[1:] / autocovariance[0]
+    not_positive = np.flatnonzero(autocorrelation <= 0)
+    cutoff = not_positive[0] if not_positive.size else autocorrelation.size
+    return max(1.0, 1 + 2 * float(np.sum(autocorrelation[:cutoff])))
+
+
+SLOPE_ESTIMATORS: Dict[str, SlopeEstimator] = {
+    "siegel": siegel_slope,
+    "scipy_siegel": scipy_siegel_slope,
+    "least_squares": least_squares_slope,
+}
+
+
+def fit_slope(x, y, method: str) -> Tuple[float, float]:
+    try:
+        estimator = SLOPE_ESTIMATORS[method]
+    except KeyError:
+        raise ValueError(
+            f"Unknown slope estimator {method}, expected one of"
+            f" {list(SLOPE_ESTIMATORS.keys())}"
+        )
+    return estimator(x, y)
@@ -0,0 +1,65 @@
+"""
+Times how long it takes to get going: importing the Q0 modules and building
+cryomodules from Q0_CRYOMODULES. Every measurement runs in a fresh
+interpreter so nothing is already imported or built.
+
+    python q0_startup.py [--modules q0_linac q0_reanalysis] [--repeat 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import List
+
+TIMING_SCRIPT = """
+import time
+start = time.perf_counter()
+{setup}
+print(time.perf_counter() - start)
+"""
+
+
+def time_in_fresh_interpreter(setup: str, repeat: int) -> float:
+    """Median seconds the setup code takes in a new python process"""
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", TIMING_SCRIPT.format(setup=setup)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def run_benchmark(modules: List[str], cm_name: str, repeat: int):
+    results = {}
+    for module in modules:
+        results[f"import {module}"] = time_in_fresh_interpreter(
+            f"import {module}", repeat
+        )
+
+    registry = "from q0_linac import Q0_CRYOMODULES"
+    results[f"build CM{cm_name}"] = time_in_fresh_interpreter(
+        f"{registry}\nQ0_CRYOMODULES['{cm_name}']", repeat
+    )
+    results["build every cryomodule"] = time_in_fresh_interpreter(
+        f"{registry}\nfor name in Q0_CRYOMODULES: Q0_CRYOMODULES[name]", repeat
+    )
+
+    for label, seconds in results.items():
+        print(f"{label}: {seconds * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time Q0 module imports and cryomodule construction"
+    )
+    parser.add_argument("--modules", nargs="+", default=["q0_utils", "q0_linac"])
+    parser.add_argument("--cryomodule", default="02")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark(args.modules, args.cryomodule, args.repeat)
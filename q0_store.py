@@ -0,0 +1,185 @@
+"""
+Columnar storage for raw liquid level traces.
+
+Each data file (e.g. data/calibrations/cm13.json) gets a sibling binary file
+(data/calibrations/cm13.bin) holding raw little endian float64 arrays. A run's
+trace is stored as all of its timestamps followed by all of its values, and
+the run's entry in the JSON file only keeps a reference to where that block
+lives in the binary file. Loading a session then only has to parse the (small)
+JSON metadata and read that session's bytes.
+
+Run this module directly to migrate existing JSON data files:
+
+    python q0_store.py [data/calibrations/cm13.json ...]
+"""
+
+import argparse
+import os
+from glob import glob
+from typing import Dict, Tuple
+
+import numpy as np
+
+import q0_utils
+
+LL_DTYPE = np.dtype("<f8")
+
+REF_OFFSET_KEY = "Offset"
+REF_COUNT_KEY = "Count"
+
+DATA_FILE_GLOBS = ["data/calibrations/cm*.json", "data/q0_measurements/cm*.json"]
+
+
+def ll_store_file(data_file: str) -> str:
+    return os.path.splitext(data_file)[0] + ".bin"
+
+
+def append_ll_data(data_file: str, timestamps, values) -> Dict[str, int]:
+    """
+    Appends one run's trace to the binary store and returns the reference
+    that should be saved in the run's JSON entry
+    """
+    timestamps = np.asarray(timestamps, dtype=LL_DTYPE)
+    values = np.asarray(values, dtype=LL_DTYPE)
+    if timestamps.shape != values.shape:
+        raise q0_utils.DataError(
+            f"Got {timestamps.size} timestamps but {values.size} values"
+        )
+
+    with open(ll_store_file(data_file), "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(timestamps.tobytes())
+        f.write(values.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+    return {REF_OFFSET_KEY: offset, REF_COUNT_KEY: int(timestamps.size)}
+
+
+def read_ll_data(data_file: str, reference: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    count = reference[REF_COUNT_KEY]
+    block = np.fromfile(
+        ll_store_file(data_file),
+        dtype=LL_DTYPE,
+        count=2 * count,
+        offset=reference[REF_OFFSET_KEY],
+    )
+    if block.size != 2 * count:
+        raise q0_utils.DataError(
+            f"Truncated liquid level block in {ll_store_file(data_file)}"
+        )
+    return block[:count], block[count:]
+
+
+def read_run_ll(data_file: str, run_data: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (timestamps, values) for a run entry, whether its trace has been
+    migrated to the binary store or is still inline JSON
+    """
+    if q0_utils.JSON_LL_REF_KEY in run_data:
+        return read_ll_data(data_file, run_data[q0_utils.JSON_LL_REF_KEY])
+
+    ll_data: Dict[str, float] = run_data[q0_utils.JSON_LL_KEY]
+    timestamps = np.fromiter(ll_data.keys(), dtype=LL_DTYPE, count=len(ll_data))
+    values = np.fromiter(ll_data.values(), dtype=LL_DTYPE, count=len(ll_data))
+    return timestamps, values
+
+
+def load_run_ll(data_file: str, run: q0_utils.DataRun, run_data: Dict):
+    run.set_ll_data(*read_run_ll(data_file, run_data))
+    run.ll_reference = run_data.get(q0_utils.JSON_LL_REF_KEY)
+
+
+def save_run_ll(data_file: str, run: q0_utils.DataRun) -> Dict[str, int]:
+    """
+    Returns the store reference for a run's trace, only appending it to the
+    store if it isn't there already (e.g. when re-saving a loaded session)
+    """
+    if not run.ll_reference:
+        run.ll_reference = append_ll_data(data_file, run.ll_timestamps, run.ll_values)
+    return run.ll_reference
+
+
+def load_session(data_file: str, time_stamp: str) -> Dict:
+    return q0_utils.read_json_data(data_file)[time_stamp]
+
+
+def data_file_version(data_file: str) -> Tuple:
+    """
+    Changes whenever a session is saved to or compacted into data_file. The
+    binary store is append only, so anything loaded from it stays valid.
+    """
+    version = []
+    for path in (data_file, q0_utils.journal_file(data_file)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            version.append(None)
+        else:
+            version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+def iter_runs(session: Dict):
+    """
+    Calibration sessions map run start times to runs, Q0 sessions map the
+    heater/RF run keys to runs. Either way, every run has a liquid level trace.
+    """
+    for run_data in session.values():
+        if isinstance(run_data, dict) and (
+            q0_utils.JSON_LL_KEY in run_data or q0_utils.JSON_LL_REF_KEY in run_data
+        ):
+            yield run_data
+
+
+def migrate_data_file(data_file: str) -> int:
+    """
+    Moves every inline liquid level trace in data_file to the binary store.
+    The JSON file is only replaced once every migrated trace has been read
+    back and compared against the original. Returns the number of runs moved.
+    """
+    # New saves never have inline traces, so there's no need to lock (and
+    # rewrite) a file that's already migrated
+    if not any(
+        q0_utils.JSON_LL_KEY in run_data
+        for session in q0_utils.read_json_data(data_file).values()
+        for run_data in iter_runs(session)
+    ):
+        return 0
+
+    # Held for the whole migration so sessions saved meanwhile aren't lost
+    with q0_utils.modify_json_data(data_file) as all_data:
+        migrated = []
+        for session in all_data.values():
+            for run_data in iter_runs(session):
+                if q0_utils.JSON_LL_KEY not in run_data:
+                    continue
+                timestamps, values = read_run_ll(data_file, run_data)
+                reference = append_ll_data(data_file, timestamps, values)
+                migrated.append((run_data, reference, timestamps, values))
+
+        for run_data, reference, timestamps, values in migrated:
+            stored_times, stored_vals = read_ll_data(data_file, reference)
+            if not (
+                np.array_equal(stored_times, timestamps)
+                and np.array_equal(stored_vals, values, equal_nan=True)
+            ):
+                raise q0_utils.DataError(f"Round trip mismatch migrating {data_file}")
+            del run_data[q0_utils.JSON_LL_KEY]
+            run_data[q0_utils.JSON_LL_REF_KEY] = reference
+
+    return len(migrated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate inline liquid level data to the binary store"
+    )
+    parser.add_argument("files", nargs="*", help="data files (default: all)")
+    args = parser.parse_args()
+
+    files = args.files or sorted(
+        path for pattern in DATA_FILE_GLOBS for path in glob(pattern)
+    )
+    for path in files:
+        print(f"{path}: migrated {migrate_data_file(path)} runs")
@@ -1,18 +1,27 @@
+import fcntl
 import json
 import os
+import threading
+from contextlib import contextmanager
+from copy import copy
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from os import devnull
 from os.path import isfile
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.axes import Axes
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from scipy.stats import linregress, siegelslopes
 
-USE_SIEGELSLOPES = True
+import q0_slopes
+
+# Plotting pulls in matplotlib and Qt, so it only gets imported by the
+# functions that draw, keeping this module cheap for headless analysis
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+
+# One of q0_slopes.SLOPE_ESTIMATORS
+SLOPE_ESTIMATOR = "siegel"
 
 DATETIME_FORMATTER = "%m/%d/%y %H:%M:%S"
 
@@ -25,9 +34,29 @@ MAX_DS_LL = 93
 
 MIN_US_LL = 66
 
+# If set, heater and RF runs stop early once the running dLL/dt fit's standard
+# error (corrected for autocorrelation) is this fraction of the slope, as long
+# as they have at least MIN_DLL_DT_POINTS liquid level samples. Off by default:
+# a run cut short of the full liquid level drop is still more exposed to
+# whatever isn't linear about the drop than the error estimate can tell.
+TARGET_DLL_DT_REL_ERROR: Optional[float] = None
+MIN_DLL_DT_POINTS = 300
+
+STOP_REASON_LL_DROP = "Target liquid level drop"
+STOP_REASON_MIN_LL = "Minimum liquid level"
+STOP_REASON_CONVERGED = "dLL/dt converged"
+
 # Used to reject data where the JT valve wasn't at the correct position
 VALVE_POS_TOL = 2
 
+# How close the JT valve readback has to get to each 1% step when walking it
+# to a new position, and the longest we'll wait for it to get there
+JT_STEP_TOL = 0.1
+JT_STEP_TIMEOUT = 3
+
+# Seconds between status updates while waiting on the liquid level or valve
+STATUS_INTERVAL = 10
+
 # Used to reject data where the cavity heater wasn't at the correct value
 HEATER_TOL = 1.2
 
@@ -58,7 +87,29 @@ NUM_CAL_STEPS = 7
 
 NUM_LL_POINTS_TO_AVG = 10
 
+# How the liquid level readback gets smoothed, one of q0_filters.LL_FILTERS
+LL_FILTER = "mean"
+
+# Initial number of samples a run's liquid level buffer has room for; it
+# doubles whenever it fills up, and never has room for fewer than this
+LL_BUFFER_CAPACITY = 1024
+
 CAV_HEATER_RUN_LOAD = 24
+
+# Active length in meters of a (non harmonic linearizer) cavity, for when
+# there's no lcls_tools cavity object to ask
+CAV_LENGTH = 1.038
+
+# Geometric shunt impedance in ohms used for every cavity's Q0
+R_OVER_Q = 1012
+
+# Resamples behind the (statistical only) confidence intervals reported for
+# calibration slopes and Q0, and the seed that keeps them reproducible (None
+# for a fresh one every time)
+BOOTSTRAP_RESAMPLES = 2000
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+
 FULL_MODULE_CALIBRATION_LOAD = 80
 
 CAL_HEATER_DELTA = 8
@@ -67,6 +118,10 @@ JT_SEARCH_TIME_RANGE: timedelta = timedelta(hours=24)
 JT_SEARCH_OVERLAP_DELTA: timedelta = timedelta(minutes=30)
 DELTA_NEEDED_FOR_FLATNESS: timedelta = timedelta(hours=2)
 
+# A JT search window's liquid level counts as flat if its fitted slope (in %
+# per archiver sample) is smaller than this
+MAX_STABLE_LL_SLOPE = 1e-5
+
 RUN_STATUS_MSSG = "\nWaiting for the LL to drop {DIFF}% " "or below {MIN}%...".format(
     MIN=MIN_DS_LL, DIFF=TARGET_LL_DIFF
 )
@@ -74,21 +129,75 @@ RUN_STATUS_MSSG = "\nWaiting for the LL to drop {DIFF}% " "or below {MIN}%...".f
 JT_MANUAL_MODE_VALUE = 0
 JT_AUTO_MODE_VALUE = 1
 
+# The cryoplant can only take so many cryomodules with their JT valves
+# locked at once when measuring several in parallel
+MAX_MANUAL_JT_CRYOMODULES = 2
+
 HEATER_MANUAL_VALUE = 0
 HEATER_SEQUENCER_VALUE = 2
 
+# Saves are appended to a journal next to each JSON file and only folded into
+# the JSON file itself once the journal has grown to this fraction of the
+# file's size (and at least JOURNAL_COMPACTION_MIN_BYTES), so however long the
+# history gets, each byte saved is only rewritten a bounded number of times
+JOURNAL_COMPACTION_RATIO = 0.5
+JOURNAL_COMPACTION_MIN_BYTES = 256 * 1024
+
 CRYO_ACCESS_VALUE = 1
 MINIMUM_HEATLOAD = 48
 
+CALIB_DATA_FILE = "data/calibrations/cm{CM}.json"
+Q0_DATA_FILE = "data/q0_measurements/cm{CM}.json"
+
+# Where results are catalogued (see q0_catalog). Results used to be kept in
+# these JSON index files, which are now only read to import them.
+CATALOG_FILE = "q0_results.db"
+CALIB_IDX_FILE = "calibrations/cm{CM}.json"
+Q0_IDX_FILE = "q0_measurements/cm{CM}.json"
+
+# Seconds a catalog write waits for another one to finish before giving up
+CATALOG_BUSY_TIMEOUT = 30
+
+# Seconds between checks for newly catalogued sessions while a session picker
+# is open
+SESSION_PICKER_REFRESH_INTERVAL = 5
+
+# Loaded calibrations/Q0 measurements kept in memory, how many threads load
+# them, and how many sessions either side of the one being looked at in a
+# picker get loaded ahead of time
+SESSION_CACHE_SIZE = 32
+SESSION_LOAD_WORKERS = 2
+SESSION_PREFETCH_NEIGHBOURS = 2
+
+# Most recent liquid level samples the live dashboard keeps, how often (in
+# seconds) it redraws, and how many standard errors wide its dLL/dt band is
+LIVE_BUFFER_SIZE = 7200
+LIVE_DASHBOARD_REFRESH_INTERVAL = 0.5
+LIVE_ERROR_BAND_SIGMAS = 2
+
+# What's needed to pick an interrupted calibration or Q0 measurement back up
+# where it left off, cleared once it finishes
+CHECKPOINT_FILE = "checkpoints/cm{CM}.json"
+
 JSON_START_KEY = "Start Time"
 JSON_END_KEY = "End Time"
 JSON_LL_KEY = "Liquid Level Data"
+JSON_LL_REF_KEY = "Liquid Level Data Reference"
 JSON_HEATER_RUN_KEY = "Heater Run"
 JSON_RF_RUN_KEY = "RF Run"
 JSON_HEATER_READBACK_KEY = "Average Heater Readback"
 JSON_DLL_KEY = "dLL/dt"
 JSON_CAV_AMPS_KEY = "Cavity Amplitudes"
 JSON_AVG_PRESS_KEY = "Average Pressure"
+JSON_STOP_REASON_KEY = "Stop Reason"
+
+JSON_CALIBRATION_CHECKPOINT_KEY = "Calibration"
+JSON_Q0_CHECKPOINT_KEY = "Q0 Measurement"
+JSON_HEATER_SETPOINTS_KEY = "Heater Setpoints"
+JSON_VALVE_PARAMS_KEY = "Reference Valve Parameters"
+JSON_DESIRED_LL_KEY = "Desired Liquid Level"
+JSON_LL_DROP_KEY = "Liquid Level Drop"
+JSON_TARGET_REL_ERROR_KEY = "Target dLL/dt Relative Error"
 
 
 class DataError(Exception):
@@ -99,22 +208,180 @@ class Q0AbortError(Exception):
     pass
 
 
+class RunningStats:
+    """
+    Count, mean, variance and extremes of a stream of readbacks in constant
+    memory (Welford's algorithm). If a target is set, readbacks more than
+    tolerance away from it get counted too. Updated from monitor callbacks
+    and safe to read while that's happening.
+    """
+
+    def __init__(self, tolerance: Optional[float] = None):
+        self.tolerance: Optional[float] = tolerance
+        self.target: Optional[float] = None
+        self._lock = threading.Lock()
+        self.count = 0
+        self.out_of_tolerance = 0
+        self._mean = np.nan
+        self._sum_sq = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+    def add(self, value: float):
+        with self._lock:
+            self.count += 1
+            if self.count == 1:
+                self._mean = value
+                self.min = value
+                self.max = value
+            else:
+                delta = value - self._mean
+                self._mean += delta / self.count
+                self._sum_sq += delta * (value - self._mean)
+                self.min = min(self.min, value)
+                self.max = max(self.max, value)
+
+            if self._out_of_tolerance(value):
+                self.out_of_tolerance += 1
+
+    def extend(self, values):
+        """Adds a whole array of readbacks at once (Chan et al.'s merge)"""
+        values = np.asarray(values, dtype=float)
+        if not values.size:
+            return
+
+        with self._lock:
+            count = self.count + values.size
+            mean = values.mean()
+            sum_sq = float(((values - mean) ** 2).sum())
+            if self.count:
+                delta = mean - self._mean
+                self._sum_sq += sum_sq + delta**2 * self.count * values.size / count
+                self._mean += delta * values.size / count
+                self.min = min(self.min, values.min())
+                self.max = max(self.max, values.max())
+            else:
+                self._mean = mean
+                self._sum_sq = sum_sq
+                self.min = values.min()
+                self.max = values.max()
+            self.count = count
+
+            if self.target is not None and self.tolerance is not None:
+                self.out_of_tolerance += int(
+                    (np.abs(values - self.target) > self.tolerance).sum()
+                )
+
+    def _out_of_tolerance(self, value: float) -> bool:
+        if self.target is None or self.tolerance is None:
+            return False
+        return abs(value - self.target) > self.tolerance
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def variance(self) -> float:
+        with self._lock:
+            if self.count < 2:
+                return np.nan
+            return self._sum_sq / (self.count - 1)
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self.variance)
+
+
 class DataRun:
     def __init__(self, reference_heat=0):
-        self.ll_data: Dict[float, float] = {}
-        self.heater_readback_buffer: List[float] = []
+        self._ll_timestamps: np.ndarray = np.empty(LL_BUFFER_CAPACITY)
+        self._ll_values: np.ndarray = np.empty(LL_BUFFER_CAPACITY)
+        self._ll_count: int = 0
+        # Where the liquid level data lives in the binary store, if saved
+        self.ll_reference: Optional[Dict[str, int]] = None
+        self.heater_readback = RunningStats(tolerance=HEATER_TOL)
         self._dll_dt = None
         self._start_time: Optional[datetime] = None
         self._end_time: Optional[datetime] = None
         self._average_heat = None
         self.reference_heat = reference_heat
+        # Kept up to date as samples come in so a live run can tell how well
+        # its slope is known yet
+        self.running_slope = q0_slopes.RunningSlope()
+        self.stop_reason: Optional[str] = None
+        # Samples come in on the monitor thread while the acquisition loop
+        # checks the fit
+        self.lock = threading.Lock()
 
     @property
-    def average_heat(self) -> float:
-        if not self._average_heat:
-            self._average_heat = (
-                np.mean(self.heater_readback_buffer) - self.reference_heat
+    def ll_timestamps(self) -> np.ndarray:
+        return self._ll_timestamps[: self._ll_count]
+
+    @property
+    def ll_values(self) -> np.ndarray:
+        return self._ll_values[: self._ll_count]
+
+    @property
+    def num_ll_points(self) -> int:
+        return self._ll_count
+
+    def append_ll(self, timestamp: float, value: float):
+        with self.lock:
+            self._append_ll(timestamp, value)
+
+    def _append_ll(self, timestamp: float, value: float):
+        if self._ll_count == self._ll_timestamps.size:
+            # Copy into bigger buffers rather than resizing in place so that
+            # views handed out earlier stay valid
+            capacity = max(2 * self._ll_timestamps.size, LL_BUFFER_CAPACITY)
+            timestamps = np.empty(capacity)
+            values = np.empty(capacity)
+            timestamps[: self._ll_count] = self.ll_timestamps
+            values[: self._ll_count] = self.ll_values
+            self._ll_timestamps = timestamps
+            self._ll_values = values
+
+        self._ll_timestamps[self._ll_count] = timestamp
+        self._ll_values[self._ll_count] = value
+        self._ll_count += 1
+        self.ll_reference = None
+        self.running_slope.add(timestamp, value)
+
+    def set_ll_data(self, timestamps, values):
+        # Copied, since appending writes into these in place
+        timestamps = np.array(timestamps, dtype=float)
+        values = np.array(values, dtype=float)
+        if timestamps.shape != values.shape:
+            raise DataError(
+                f"Got {timestamps.size} timestamps but {values.size} values"
             )
+        with self.lock:
+            self._ll_timestamps = timestamps
+            self._ll_values = values
+            self._ll_count = timestamps.size
+            self.ll_reference = None
+
+    def running_fit(self) -> Tuple[q0_slopes.RunningSlope, np.ndarray, np.ndarray]:
+        """
+        A copy of running_slope along with the samples it was fitted to, taken
+        together so a sample coming in meanwhile can't be in one and not the
+        other. Appending never writes below the count or into buffers it has
+        outgrown, so the samples don't need copying.
+        """
+        with self.lock:
+            count = self._ll_count
+            return (
+                copy(self.running_slope),
+                self._ll_timestamps[:count],
+                self._ll_values[:count],
+            )
+
+    @property
+    def average_heat(self) -> float:
+        # Worked out live from the readback stats unless it was loaded
+        if self._average_heat is None:
+            return self.heater_readback.mean - self.reference_heat
         return self._average_heat
 
     @average_heat.setter
@@ -141,17 +408,26 @@ class DataRun:
     def end_time(self, value: datetime):
         self._end_time = value
 
+    @property
+    def running_relative_error(self) -> float:
+        """
+        running_slope's relative error, allowing for the liquid level samples
+        being autocorrelated. O(n log n), unlike everything else about the
+        running fit.
+        """
+        running_slope, timestamps, values = self.running_fit()
+        relative_error = running_slope.relative_error
+        if not np.isfinite(relative_error):
+            return relative_error
+        residuals = running_slope.residuals(timestamps, values)
+        return relative_error * np.sqrt(q0_slopes.autocorrelation_time(residuals))
+
     @property
     def dll_dt(self) -> float:
         if not self._dll_dt:
-            if USE_SIEGELSLOPES:
-                slope, intercept = siegelslopes(
-                    list(self.ll_data.values()), list(self.ll_data.keys())
-                )
-            else:
-                slope, intercept, r_val, p_val, std_err = linregress(
-                    list(self.ll_data.keys()), list(self.ll_data.values())
-                )
+            slope, intercept = q0_slopes.fit_slope(
+                self.ll_timestamps, self.ll_values, SLOPE_ESTIMATOR
+            )
             self._dll_dt = slope
         return self._dll_dt
 
@@ -166,16 +442,138 @@ class HeaterRun(DataRun):
         self.heat_load_des: float = heat_load
 
 
-def update_json_data(filepath, time_stamp, new_data):
-    make_json_file(filepath)
-    with open(filepath, "r+") as f:
+def journal_file(filepath: str) -> str:
+    return filepath + ".journal"
+
+
+def _read_journal(journal) -> List[Dict]:
+    records = []
+    for line in journal:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # A torn record from a crash mid-append; the records around it
+            # were fsync'd and are still good
+            print(f"Skipping corrupt record in {journal.name}")
+    return records
+
+
+def _read_json_data(filepath, journal) -> Dict:
+    """The file's data with journal (which has to be locked) applied on top"""
+    with open(filepath, "r") as f:
         data: Dict = json.load(f)
-        data[time_stamp] = new_data
+    journal.seek(0)
+    for record in _read_journal(journal):
+        data[record["key"]] = record["value"]
+    return data
 
-        # go to the beginning of the file to overwrite the existing data structure
-        f.seek(0)
+
+def read_json_data(filepath) -> Dict:
+    """
+    Returns the contents of a JSON data file with any journaled saves that
+    haven't been compacted into it yet applied on top
+    """
+    make_json_file(filepath)
+    try:
+        journal = open(journal_file(filepath), "rb")
+    except FileNotFoundError:
+        # Nothing's been saved through the journal yet, and saving anything
+        # creates it before touching the file
+        with open(filepath, "r") as f:
+            return json.load(f)
+
+    # Shared with other readers, but keeps a compaction from replacing the
+    # file and clearing the journal in between reading the two
+    with journal:
+        fcntl.flock(journal, fcntl.LOCK_SH)
+        return _read_json_data(filepath, journal)
+
+
+def _replace_json_file(filepath, data: Dict, journal):
+    # The journal is only cleared after the new file is in place, so a crash
+    # in between just replays records on top of data that already has them
+    tmp_file = filepath + ".tmp"
+    with open(tmp_file, "w") as f:
         json.dump(data, f, indent=4)
-        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, filepath)
+    journal.truncate(0)
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+@contextmanager
+def modify_json_data(filepath) -> Iterator[Dict]:
+    """
+    Yields the file's data to be changed in place and then replaces the file
+    with it, holding the journal's lock throughout so that nothing saved in
+    the meantime gets dropped when the journal is cleared. The file is left
+    alone if the block raises.
+    """
+    make_json_file(filepath)
+    with open(journal_file(filepath), "ab+") as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        data = _read_json_data(filepath, journal)
+        yield data
+        _replace_json_file(filepath, data, journal)
+
+
+def compact_json_data(filepath):
+    with modify_json_data(filepath):
+        pass
+
+
+def update_json_data(filepath, time_stamp, new_data):
+    """
+    Appends one session to the file's journal instead of rewriting the whole
+    file, so a save costs the size of the session rather than the history
+    """
+    make_json_file(filepath)
+    record = json.dumps({"key": time_stamp, "value": new_data}).encode() + b"\n"
+
+    with open(journal_file(filepath), "ab+") as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+
+        # Make sure a torn record can't swallow this one
+        if journal.seek(0, os.SEEK_END) > 0:
+            journal.seek(-1, os.SEEK_END)
+            if journal.read(1) != b"\n":
+                record = b"\n" + record
+
+        journal.write(record)
+        journal.flush()
+        os.fsync(journal.fileno())
+        journal_size = journal.tell()
+
+    if journal_size >= max(
+        JOURNAL_COMPACTION_RATIO * os.path.getsize(filepath),
+        JOURNAL_COMPACTION_MIN_BYTES,
+    ):
+        compact_json_data(filepath)
+
+
+def calc_calibration_fit(heat_loads, dll_dts) -> Tuple[Optional[float], float]:
+    """
+    Linear fit of dLL/dt against heat load for a calibration's heater runs.
+    Returns (slope, intercept), with a slope of None if the fit failed.
+    """
+    slope, intercept = q0_slopes.least_squares_slope(heat_loads, dll_dts)
+    if np.isnan(slope):
+        return None, intercept
+    return slope, intercept
+
+
+def calc_effective_amplitude(amplitudes: Dict[Any, float]) -> float:
+    return float(calc_effective_amplitudes(list(amplitudes.values())))
+
+
+def calc_effective_amplitudes(amplitudes) -> np.ndarray:
+    """
+    Effective amplitude of each row of a (measurements x cavities) array,
+    with unused cavities as 0
+    """
+    return np.sqrt(np.sum(np.square(np.asarray(amplitudes, dtype=float)), axis=-1))
 
 
 # The calculated Q0 value for this run. Formula from Mike Drury
@@ -189,12 +587,34 @@ def calc_q0(
     cav_length: float,
     use_correction: bool = False,
 ) -> float:
+    uncorrected_q0, corrected_q0 = calc_q0_batch(
+        amplitude, rf_heat_load, avg_pressure, cav_length
+    )
+    print(f"Uncorrected Q0: {uncorrected_q0}")
+    print(f"Corrected Q0: {corrected_q0}")
+
+    return float(corrected_q0 if use_correction else uncorrected_q0)
+
+
+def calc_q0_batch(
+    amplitudes,
+    rf_heat_loads,
+    avg_pressures,
+    cav_lengths,
+    r_over_q: float = R_OVER_Q,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    calc_q0 for whole arrays of measurements at once (anything that
+    broadcasts together), returning the (uncorrected, corrected) Q0 arrays
+    """
+    amplitude = np.asarray(amplitudes, dtype=float)
+    rf_heat_load = np.asarray(rf_heat_loads, dtype=float)
+    avg_pressure = np.asarray(avg_pressures, dtype=float)
+    cav_length = np.asarray(cav_lengths, dtype=float)
+
     # The initial Q0 calculation doesn't account for the temperature
     # variation of the 2 K helium
-    r_over_q = 1012
-
     uncorrected_q0 = ((amplitude * 1e6) ** 2) / (r_over_q * rf_heat_load)
-    print(f"Uncorrected Q0: {uncorrected_q0}")
 
     # We can correct Q0 for the helium temperature
     mbar_to_torr = 0.750062
@@ -213,9 +633,8 @@ def calc_q0(
         + c1 / uncorrected_q0
         - (c7 / temp_from_press) * np.exp(c6 / temp_from_press)
     )
-    print(f"Corrected Q0: {corrected_q0}")
 
-    return corrected_q0 if use_correction else uncorrected_q0
+    return uncorrected_q0, corrected_q0
 
 
 def make_json_file(filepath):
@@ -288,6 +707,8 @@ class ValveParams:
 
 def gen_axis(title, xlabel, ylabel):
     # type: (str, str, str) -> Axes
+    from matplotlib import pyplot as plt
+
     fig = plt.figure()
     ax = fig.add_subplot(111)
     ax.set_title(title)
@@ -307,5 +728,7 @@ def redraw_axis(canvas, title, xlabel, ylabel):
 
 def draw_and_show():
     # type: () -> None
+    from matplotlib import pyplot as plt
+
     plt.draw()
     plt.show()
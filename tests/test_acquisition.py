@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+pytest.importorskip("lcls_tools")
+
+import q0_utils  # noqa: E402
+from q0_acquisition import (  # noqa: E402
+    ACQ_ABORTED,
+    ACQ_FAILED,
+    Acquisition,
+    LockJTPhase,
+    Phase,
+)
+
+
+class FakeCryomodule:
+    def __init__(self):
+        self.jt_locked_position = None
+        self.auto_calls = []
+        self.abort_flag = False
+        self.restore_started = threading.Event()
+        self.allow_restore = threading.Event()
+
+    def __str__(self):
+        return "CM01"
+
+    def set_jt_auto(self, wait: bool = True):
+        self.auto_calls.append(wait)
+        self.jt_locked_position = None
+
+    def check_abort(self, restore: bool = True):
+        if self.abort_flag:
+            self.abort_flag = False
+            assert not restore
+            raise q0_utils.Q0AbortError("Abort requested for CM01")
+
+    def restore_cryo(self):
+        self.restore_started.set()
+        self.allow_restore.wait()
+
+
+class FailingPhase(Phase):
+    def __init__(self, cryomodule):
+        super().__init__(cryomodule, "Fail")
+
+    def poll(self) -> bool:
+        raise ValueError("broken phase")
+
+
+def test_pausing_releases_a_locked_jt_and_relocks_it_first():
+    cryomodule = FakeCryomodule()
+    cryomodule.jt_locked_position = 45
+    later = object()
+    acquisition = Acquisition(cryomodule, [later], "Job")
+
+    acquisition.release_jt()
+
+    assert cryomodule.auto_calls == [False]
+    relock = next(acquisition._phases)
+    assert isinstance(relock, LockJTPhase)
+    assert relock.position == 45
+    assert next(acquisition._phases) is later
+
+
+def test_pausing_with_the_jt_in_auto_changes_nothing():
+    cryomodule = FakeCryomodule()
+    later = object()
+    acquisition = Acquisition(cryomodule, [later], "Job")
+
+    acquisition.release_jt()
+
+    assert cryomodule.auto_calls == []
+    assert next(acquisition._phases) is later
+
+
+@pytest.mark.parametrize("abort", [True, False])
+def test_restoring_after_an_abort_or_failure_does_not_hold_up_the_loop(abort):
+    cryomodule = FakeCryomodule()
+    cryomodule.abort_flag = abort
+    acquisition = Acquisition(cryomodule, [FailingPhase(cryomodule)], "Job")
+
+    # Returns with the restore still going on in the background
+    acquisition.step()
+    assert acquisition.state == (ACQ_ABORTED if abort else ACQ_FAILED)
+    assert cryomodule.restore_started.wait(5)
+    assert not acquisition.finished.is_set()
+
+    cryomodule.allow_restore.set()
+    assert acquisition.finished.wait(5)
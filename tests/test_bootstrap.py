@@ -0,0 +1,48 @@
+import numpy as np
+
+import q0_bootstrap
+import q0_utils
+from q0_analysis import Calibration
+
+TRUE_SLOPE = -4.6e-4
+
+
+def ar1_trace(rng: np.random.Generator, num_points: int = 4000, rho: float = 0.99):
+    noise_sd = 0.02
+    innovations = rng.normal(0, noise_sd * np.sqrt(1 - rho**2), num_points)
+    noise = np.empty(num_points)
+    noise[0] = rng.normal(0, noise_sd)
+    for i in range(1, num_points):
+        noise[i] = rho * noise[i - 1] + innovations[i]
+    timestamps = 1.6e9 + np.arange(num_points, dtype=float)
+    return timestamps, 92 + TRUE_SLOPE * (timestamps - timestamps[0]) + noise
+
+
+def test_dll_dt_interval_covers_autocorrelated_noise():
+    rng = np.random.default_rng(0)
+    num_traces = 60
+    covered = 0
+    for _ in range(num_traces):
+        timestamps, values = ar1_trace(rng)
+        x = timestamps - timestamps.mean()
+        fitted = np.dot(values, x) / np.dot(x, x)
+        samples = q0_bootstrap.bootstrap_dll_dt(timestamps, values, fitted, 500, rng)
+        low, high = q0_bootstrap.confidence_interval(samples)
+        covered += low <= TRUE_SLOPE <= high
+    # Nominally 95%; blocks that ignore the autocorrelation get nowhere near
+    assert covered / num_traces > 0.8
+
+
+def test_failed_bootstrap_is_not_retried(monkeypatch):
+    calls = []
+
+    def fail(calibration):
+        calls.append(calibration)
+        raise q0_utils.DataError("too few points")
+
+    monkeypatch.setattr(q0_bootstrap, "bootstrap_calibration", fail)
+    calibration = Calibration(time_stamp="01/01/22 00:00:00", cryomodule=None)
+
+    assert calibration.slope_ci is None
+    assert calibration.slope_ci is None
+    assert len(calls) == 1
@@ -0,0 +1,112 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+import q0_catalog
+import q0_utils
+
+TIME_STAMP = "01/02/23 03:04:05"
+
+
+@pytest.fixture
+def catalog_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.dirname(q0_utils.CALIB_IDX_FILE))
+    yield tmp_path
+    q0_catalog._connections.__dict__.get("by_file", {}).clear()
+
+
+def write_index(slope):
+    with open(q0_utils.CALIB_IDX_FILE.format(CM="01"), "w") as f:
+        json.dump({TIME_STAMP: {"Calculated Heat vs dll/dt Slope": slope}}, f)
+
+
+def test_connecting_does_not_import_anything(catalog_dir):
+    write_index(1.0)
+    q0_catalog.connect()
+    assert q0_catalog.calibrations() == []
+
+
+def test_only_changed_index_files_get_imported(catalog_dir):
+    write_index(1.0)
+    assert q0_catalog.import_changed_json_indexes() == {
+        q0_utils.CALIB_IDX_FILE.format(CM="01"): 1
+    }
+    assert q0_catalog.get_calibration("01", TIME_STAMP).slope == 1.0
+    assert q0_catalog.import_changed_json_indexes() == {}
+
+    write_index(2.0)
+    os.utime(q0_utils.CALIB_IDX_FILE.format(CM="01"), ns=(0, 10**18))
+    q0_catalog.import_changed_json_indexes()
+    assert [record.slope for record in q0_catalog.calibrations()] == [2.0]
+
+
+def test_failed_imports_get_retried(catalog_dir):
+    with open(q0_utils.CALIB_IDX_FILE.format(CM="01"), "w") as f:
+        f.write("{not json")
+    assert q0_catalog.import_changed_json_indexes() == {}
+
+    write_index(3.0)
+    q0_catalog.import_changed_json_indexes()
+    assert q0_catalog.calibrations()[0].slope == 3.0
+
+
+def test_read_only_connections_cannot_write(catalog_dir):
+    with pytest.raises(q0_utils.DataError):
+        q0_catalog.connect(read_only=True)
+
+    write_index(1.0)
+    q0_catalog.import_changed_json_indexes()
+    assert q0_catalog.cryomodule_names(read_only=True) == ["01"]
+    with pytest.raises(sqlite3.OperationalError):
+        q0_catalog.connect(read_only=True).execute("DELETE FROM calibrations")
+
+
+def test_saving_again_gives_the_row_a_newer_version(catalog_dir):
+    record = q0_catalog.CalibrationRecord("01", TIME_STAMP, 1.0, 0.0, None)
+    q0_catalog.save_calibration(record)
+    q0_catalog.save_calibration(
+        q0_catalog.CalibrationRecord("02", TIME_STAMP, 1.0, 0.0, None)
+    )
+    last_version = max(record.version for record in q0_catalog.calibrations())
+    assert q0_catalog.calibrations(after_version=last_version) == []
+
+    record.slope = 2.0
+    q0_catalog.save_calibration(record)
+    changed = q0_catalog.calibrations(after_version=last_version)
+    assert [(record.cryomodule, record.slope) for record in changed] == [("01", 2.0)]
+
+
+def test_catalogs_without_versions_get_them(catalog_dir):
+    old = sqlite3.connect(q0_utils.CATALOG_FILE)
+    old.execute(
+        "CREATE TABLE calibrations (id INTEGER PRIMARY KEY, cryomodule TEXT,"
+        " time_stamp TEXT, start_epoch REAL, slope REAL, slope_ci_low REAL,"
+        " slope_ci_high REAL, adjustment REAL, ref_valve_pos REAL,"
+        " ref_heat_load_des REAL, ref_heat_load_act REAL,"
+        " UNIQUE (cryomodule, start_epoch))"
+    )
+    old.execute(
+        "INSERT INTO calibrations (cryomodule, time_stamp, start_epoch, slope)"
+        " VALUES ('01', ?, ?, 1.0)",
+        (TIME_STAMP, q0_catalog.to_epoch(TIME_STAMP)),
+    )
+    old.commit()
+    old.close()
+
+    assert [record.version for record in q0_catalog.calibrations()] == [0]
+
+
+def test_own_writes_change_the_data_version(catalog_dir):
+    q0_catalog.connect()
+    before = q0_catalog.data_version()
+    # Same thread, so the same cached connection as data_version's
+    q0_catalog.save_calibration(
+        q0_catalog.CalibrationRecord("01", TIME_STAMP, 1.0, 0.0, None)
+    )
+    assert q0_catalog.data_version() != before
+    unchanged = q0_catalog.data_version()
+    q0_catalog.calibrations()
+    assert q0_catalog.data_version() == unchanged
@@ -0,0 +1,29 @@
+import numpy as np
+
+import q0_utils
+
+
+def test_appending_after_setting_empty_data():
+    run = q0_utils.DataRun()
+    run.set_ll_data([], [])
+    run.append_ll(1.0, 90.0)
+    run.append_ll(2.0, 89.0)
+
+    assert run.ll_timestamps.tolist() == [1.0, 2.0]
+    assert run.ll_values.tolist() == [90.0, 89.0]
+
+
+def test_set_ll_data_keeps_its_own_copy():
+    timestamps = np.array([1.0, 2.0])
+    values = np.array([90.0, 89.0])
+    run = q0_utils.DataRun()
+    run.set_ll_data(timestamps, values)
+
+    timestamps[0] = 0.0
+    values[0] = 0.0
+    assert run.ll_timestamps.tolist() == [1.0, 2.0]
+    assert run.ll_values.tolist() == [90.0, 89.0]
+
+    run.append_ll(3.0, 88.0)
+    assert timestamps.tolist() == [0.0, 2.0]
+    assert run.ll_values.tolist() == [90.0, 89.0, 88.0]
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from q0_decimate import DecimationPyramid
+
+
+def ll_trace(num_points: int, seed: int = 0, nan_fraction: float = 0.0):
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(0.5, 1.5, num_points))
+    y = 90 - 0.002 * x + rng.normal(0, 0.05, num_points)
+    spikes = rng.choice(num_points, size=max(num_points // 50, 1), replace=False)
+    y[spikes] += rng.choice([-5.0, 5.0], spikes.size)
+    y[rng.random(num_points) < nan_fraction] = np.nan
+    return x, y
+
+
+@pytest.mark.parametrize("num_points", [2, 7, 1000, 1001])
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.3])
+def test_every_level_keeps_each_bins_extremes(num_points, nan_fraction):
+    x, y = ll_trace(num_points, nan_fraction=nan_fraction)
+    pyramid = DecimationPyramid(x, y)
+
+    for level, (min_idx, max_idx) in enumerate(pyramid.levels):
+        bin_points = 2 ** (level + 1)
+        assert min_idx.size == max_idx.size == -(-num_points // bin_points)
+        for bin_num, (low, high) in enumerate(zip(min_idx, max_idx)):
+            first = bin_num * bin_points
+            values = y[first : first + bin_points]
+            assert first <= low < first + bin_points
+            assert first <= high < first + bin_points
+            if np.all(np.isnan(values)):
+                continue
+            # nan is never picked over a number
+            assert y[low] == np.nanmin(values)
+            assert y[high] == np.nanmax(values)
+
+
+@pytest.mark.parametrize("max_points", [2, 10, 100, 999, 5000])
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.3])
+def test_views_keep_the_extremes_in_range(max_points, nan_fraction):
+    x, y = ll_trace(3001, seed=1, nan_fraction=nan_fraction)
+    pyramid = DecimationPyramid(x, y)
+
+    for x_min, x_max in [pyramid.x_range, (x[400], x[2500]), (x[10], x[40])]:
+        view_x, view_y = pyramid.view(x_min, x_max, max_points)
+        in_range = (x >= x_min) & (x <= x_max)
+
+        assert np.all(np.diff(view_x) > 0)
+        assert view_x.size <= max(max_points, 2) + 4
+        assert np.all(np.isin(view_x, x))
+        assert np.nanmin(view_y) <= np.nanmin(y[in_range])
+        assert np.nanmax(view_y) >= np.nanmax(y[in_range])
+
+
+def test_views_of_all_nan_traces_stay_nan():
+    x = np.arange(100, dtype=float)
+    view_x, view_y = DecimationPyramid(x, np.full_like(x, np.nan)).view(0, 99, 10)
+    assert view_x[0] == 0 and view_x[-1] == 99
+    assert np.all(np.isnan(view_y))
+
+
+@pytest.mark.parametrize("max_points", [10, 10000])
+def test_views_reach_past_the_range_edges(max_points):
+    x, y = ll_trace(2000, seed=2)
+    pyramid = DecimationPyramid(x, y)
+
+    # The point either side of the range is drawn so the line runs to the edge
+    # (decimated views can also have the extremes of the bins they overlap)
+    view_x, _ = pyramid.view(x[500] + 0.1, x[1500] - 0.1, max_points)
+    assert x[500] in view_x and x[1500] in view_x
+
+    # Ranges at or beyond the ends of the trace end at its first and last points
+    for x_min, x_max in [pyramid.x_range, (x[0] - 10, x[-1] + 10)]:
+        view_x, view_y = pyramid.view(x_min, x_max, max_points)
+        assert (view_x[0], view_y[0]) == (x[0], y[0])
+        assert (view_x[-1], view_y[-1]) == (x[-1], y[-1])
+
+    view_x, _ = pyramid.view(x[-1] - 50, x[-1] + 5, max_points)
+    assert view_x[-1] == x[-1]
+    view_x, _ = pyramid.view(x[0] - 5, x[0] + 50, max_points)
+    assert view_x[0] == x[0]
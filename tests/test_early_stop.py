@@ -0,0 +1,91 @@
+import sys
+import threading
+
+import numpy as np
+
+import q0_slopes
+import q0_utils
+
+TRUE_SLOPE = -4.6e-4
+TARGET_REL_ERROR = 0.01
+NUM_RUNS = 40
+
+
+def autocorrelated_run(seed: int, num_points: int = 10000, rho: float = 0.995):
+    """A steady liquid level drop with AR(1) noise, sampled once a second"""
+    rng = np.random.default_rng(seed)
+    noise_sd = 0.02
+    innovations = rng.normal(0, noise_sd * np.sqrt(1 - rho**2), num_points)
+    noise = np.empty(num_points)
+    noise[0] = rng.normal(0, noise_sd)
+    for i in range(1, num_points):
+        noise[i] = rho * noise[i - 1] + innovations[i]
+    timestamps = 1.6e9 + np.arange(num_points, dtype=float)
+    return timestamps, 92 + TRUE_SLOPE * (timestamps - timestamps[0]) + noise
+
+
+def stopped_slope_error(seed: int, corrected: bool) -> float:
+    """Relative error of the running fit wherever the early stop ends the run"""
+    data_run = q0_utils.DataRun()
+    for i, (timestamp, value) in enumerate(zip(*autocorrelated_run(seed))):
+        data_run.append_ll(timestamp, value)
+        running_slope = data_run.running_slope
+        if (
+            i % 50 == 0
+            and running_slope.count >= q0_utils.MIN_DLL_DT_POINTS
+            and running_slope.relative_error <= TARGET_REL_ERROR
+            and (not corrected or data_run.running_relative_error <= TARGET_REL_ERROR)
+        ):
+            break
+    return data_run.running_slope.slope / TRUE_SLOPE - 1
+
+
+def test_early_stop_is_off_by_default():
+    assert q0_utils.TARGET_DLL_DT_REL_ERROR is None
+
+
+def test_corrected_stop_does_not_bias_slope():
+    errors = np.array([stopped_slope_error(seed, True) for seed in range(NUM_RUNS)])
+    assert abs(errors.mean()) < TARGET_REL_ERROR / 2
+    assert np.sqrt(np.mean(errors**2)) < 2 * TARGET_REL_ERROR
+
+
+def test_uncorrected_stop_is_too_early():
+    # What the correction is for: assuming independent samples stops runs
+    # long before the slope is anywhere near as precise as asked for
+    errors = np.array([stopped_slope_error(seed, False) for seed in range(NUM_RUNS)])
+    assert np.sqrt(np.mean(errors**2)) > 5 * TARGET_REL_ERROR
+
+
+def test_autocorrelation_time_of_white_noise():
+    rng = np.random.default_rng(0)
+    assert q0_slopes.autocorrelation_time(rng.standard_normal(10000)) < 1.2
+
+
+def test_running_error_is_safe_to_read_while_appending():
+    timestamps, values = autocorrelated_run(0, num_points=20000)
+    data_run = q0_utils.DataRun()
+    for timestamp, value in zip(timestamps[:10], values[:10]):
+        data_run.append_ll(timestamp, value)
+
+    def append():
+        for timestamp, value in zip(timestamps[10:], values[10:]):
+            data_run.append_ll(timestamp, value)
+
+    # Switch threads as often as possible so reads land mid append
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    appender = threading.Thread(target=append)
+    try:
+        appender.start()
+        errors = []
+        while appender.is_alive():
+            running_slope, fit_timestamps, fit_values = data_run.running_fit()
+            assert running_slope.count == fit_timestamps.size == fit_values.size
+            errors.append(data_run.running_relative_error)
+        appender.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors
+    assert data_run.num_ll_points == timestamps.size
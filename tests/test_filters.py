@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import q0_filters
+
+
+@pytest.mark.parametrize("name", sorted(q0_filters.LL_FILTERS))
+def test_nan_readings_are_skipped(name):
+    ll_filter = q0_filters.make_ll_filter(name, 3)
+    for value in [91.0, np.nan, 92.0, np.nan, 93.0]:
+        ll_filter.update(value)
+
+    clean = q0_filters.make_ll_filter(name, 3)
+    for value in [91.0, 92.0, 93.0]:
+        clean.update(value)
+
+    assert ll_filter.count == 3
+    assert ll_filter.value == pytest.approx(clean.value)
+
+
+@pytest.mark.parametrize("name", sorted(q0_filters.LL_FILTERS))
+def test_nan_does_not_stick_once_out_of_window(name):
+    ll_filter = q0_filters.make_ll_filter(name, 2)
+    ll_filter.update(np.nan)
+    for value in [90.0, 92.0, 94.0]:
+        ll_filter.update(value)
+    assert np.isfinite(ll_filter.value)
+
+
+@pytest.mark.parametrize("name", sorted(q0_filters.LL_FILTERS))
+def test_only_nan_reads_as_nan(name):
+    ll_filter = q0_filters.make_ll_filter(name, 3)
+    ll_filter.update(np.nan)
+    assert ll_filter.count == 0
+    assert np.isnan(ll_filter.value)
+
+
+def test_median_keeps_sorted_order_with_nan():
+    ll_filter = q0_filters.make_ll_filter("median", 3)
+    for value in [91.0, np.nan, 95.0, 90.0, 99.0, 92.0]:
+        ll_filter.update(value)
+    assert ll_filter.value == 92.0
+
+
+def test_filter_base_is_abstract():
+    with pytest.raises(TypeError):
+        q0_filters.LLFilter(3)
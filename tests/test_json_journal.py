@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+import q0_store
+import q0_utils
+
+
+def test_reads_see_journaled_saves(tmp_path):
+    data_file = str(tmp_path / "data" / "cm01.json")
+    q0_utils.update_json_data(data_file, "a", 1)
+    q0_utils.update_json_data(data_file, "b", 2)
+    assert q0_utils.read_json_data(data_file) == {"a": 1, "b": 2}
+
+    q0_utils.compact_json_data(data_file)
+    assert os.path.getsize(q0_utils.journal_file(data_file)) == 0
+    assert q0_utils.read_json_data(data_file) == {"a": 1, "b": 2}
+
+
+def test_saves_during_modify_are_kept(tmp_path):
+    data_file = str(tmp_path / "cm01.json")
+    q0_utils.update_json_data(data_file, "a", 1)
+
+    started = threading.Event()
+    saver = threading.Thread(
+        target=lambda: (started.set(), q0_utils.update_json_data(data_file, "b", 2))
+    )
+    with q0_utils.modify_json_data(data_file) as data:
+        saver.start()
+        started.wait()
+        # The save has to wait for the lock instead of landing in the journal
+        # that's about to be cleared
+        saver.join(timeout=0.2)
+        assert saver.is_alive()
+        data["a"] = 10
+    saver.join()
+
+    assert q0_utils.read_json_data(data_file) == {"a": 10, "b": 2}
+
+
+def test_reads_wait_for_compaction(tmp_path):
+    data_file = str(tmp_path / "cm01.json")
+    q0_utils.update_json_data(data_file, "a", 1)
+
+    results = []
+    reader = threading.Thread(
+        target=lambda: results.append(q0_utils.read_json_data(data_file))
+    )
+    with q0_utils.modify_json_data(data_file):
+        reader.start()
+        reader.join(timeout=0.2)
+        assert reader.is_alive()
+    reader.join()
+
+    assert results == [{"a": 1}]
+
+
+def test_failed_modify_leaves_file_alone(tmp_path):
+    data_file = str(tmp_path / "cm01.json")
+    q0_utils.update_json_data(data_file, "a", 1)
+    try:
+        with q0_utils.modify_json_data(data_file) as data:
+            data["a"] = 2
+            raise q0_utils.DataError("stop")
+    except q0_utils.DataError:
+        pass
+    assert q0_utils.read_json_data(data_file) == {"a": 1}
+
+
+def test_migration_keeps_journaled_sessions(tmp_path):
+    data_file = str(tmp_path / "cm01.json")
+    session = {"Run": {q0_utils.JSON_LL_KEY: {"1.0": 90.0, "2.0": 89.5}}}
+    with open(data_file, "w") as f:
+        json.dump({"old": session}, f)
+    q0_utils.update_json_data(data_file, "new", {"Value": 1})
+
+    assert q0_store.migrate_data_file(data_file) == 1
+    data = q0_utils.read_json_data(data_file)
+    assert data["new"] == {"Value": 1}
+    assert q0_utils.JSON_LL_REF_KEY in data["old"]["Run"]
+    assert q0_store.migrate_data_file(data_file) == 0
+
+
+def test_compaction_is_amortised_over_the_history(tmp_path, monkeypatch):
+    data_file = str(tmp_path / "cm01.json")
+    monkeypatch.setattr(q0_utils, "JOURNAL_COMPACTION_MIN_BYTES", 0)
+    rewritten = []
+    compact = q0_utils.compact_json_data
+
+    def counting_compact(filepath):
+        compact(filepath)
+        rewritten.append(os.path.getsize(filepath))
+
+    monkeypatch.setattr(q0_utils, "compact_json_data", counting_compact)
+
+    for idx in range(500):
+        q0_utils.update_json_data(data_file, str(idx), {"Value": idx})
+        journal_size = os.path.getsize(q0_utils.journal_file(data_file))
+        assert journal_size < (
+            q0_utils.JOURNAL_COMPACTION_RATIO * os.path.getsize(data_file)
+        )
+
+    # The file grows geometrically between compactions, so everything they've
+    # rewritten adds up to a few times the file rather than growing with the
+    # square of the history
+    assert len(rewritten) < 25
+    assert sum(rewritten) < 4 * os.path.getsize(data_file)
+    assert q0_utils.read_json_data(data_file) == {
+        str(idx): {"Value": idx} for idx in range(500)
+    }
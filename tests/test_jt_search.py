@@ -0,0 +1,76 @@
+import numpy as np
+
+import q0_utils
+from q0_analysis import find_stable_period
+
+WINDOW = q0_utils.DELTA_NEEDED_FOR_FLATNESS.total_seconds()
+STEP = q0_utils.JT_SEARCH_OVERLAP_DELTA.total_seconds()
+START = 1_600_000_000.0
+
+
+def flat_ll(end: float):
+    timestamps = np.arange(START, end, 1.0)
+    return timestamps, np.full(timestamps.size, 90.0)
+
+
+def test_constant_setpoints_archived_before_search():
+    # The archiver only stored each setpoint when it last changed, well
+    # before the search range, so no window has a sample of its own
+    window_starts = START + STEP * np.arange(3)
+    end = window_starts[-1] + WINDOW
+    before = np.array([START - 86400.0])
+
+    result = find_stable_period(
+        window_starts,
+        WINDOW,
+        flat_ll(end),
+        (before, np.array([40.0])),
+        (before, np.array([48.0])),
+        (before, np.array([47.5])),
+    )
+
+    assert result is not None
+    _, slope, valve_params = result
+    assert slope == 0
+    assert valve_params == q0_utils.ValveParams(40.0, 48.0, 47.5)
+
+
+def test_setpoint_change_inside_window_is_rejected():
+    window_starts = np.array([START])
+    end = START + WINDOW
+    before = np.array([START - 86400.0])
+    des_times = np.array([START - 86400.0, START + WINDOW / 2])
+
+    result = find_stable_period(
+        window_starts,
+        WINDOW,
+        flat_ll(end),
+        (before, np.array([40.0])),
+        (des_times, np.array([48.0, 60.0])),
+        (before, np.array([47.5])),
+    )
+
+    assert result is None
+
+
+def test_later_window_carries_last_change_forward():
+    # The setpoint changed during the first window and then held, so only
+    # the second window (which starts after the change) is usable
+    window_starts = START + STEP * np.arange(2)
+    end = window_starts[-1] + WINDOW
+    des_times = np.array([START - 86400.0, START + STEP / 2])
+    before = np.array([START - 86400.0])
+
+    result = find_stable_period(
+        window_starts,
+        WINDOW,
+        flat_ll(end),
+        (before, np.array([40.0])),
+        (des_times, np.array([48.0, 60.0])),
+        (before, np.array([47.5])),
+    )
+
+    assert result is not None
+    window_start, _, valve_params = result
+    assert window_start == window_starts[1]
+    assert valve_params.refHeatLoadDes == 60.0
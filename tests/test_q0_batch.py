@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import q0_utils
+
+HL_CAV_LENGTH = 0.346
+
+
+def reference_q0(amplitude, rf_heat_load, avg_pressure, cav_length):
+    """The original one measurement at a time calculation"""
+    uncorrected_q0 = ((amplitude * 1e6) ** 2) / (q0_utils.R_OVER_Q * rf_heat_load)
+    temp_from_press = (0.750062 * avg_pressure * 0.0125) + 1.705
+    c4 = amplitude / cav_length - 0.7
+    c7 = 0.0000726 - (0.00000214 * c4) + (0.000000043 * (c4**2))
+    corrected_q0 = 271 / (
+        (c7 / 2) * np.exp(-17.02 / 2)
+        + 271 / uncorrected_q0
+        - (c7 / temp_from_press) * np.exp(-17.02 / temp_from_press)
+    )
+    return uncorrected_q0, corrected_q0
+
+
+MEASUREMENTS = [
+    (16.6, 20.0, 30.0, q0_utils.CAV_LENGTH),
+    (12.0, 8.5, 28.5, q0_utils.CAV_LENGTH),
+    (20.0, 35.0, 31.2, q0_utils.CAV_LENGTH),
+    (5.0, 2.0, 29.0, HL_CAV_LENGTH),
+]
+
+
+def test_batch_matches_one_at_a_time():
+    amplitudes, heat_loads, pressures, lengths = zip(*MEASUREMENTS)
+    uncorrected, corrected = q0_utils.calc_q0_batch(
+        amplitudes, heat_loads, pressures, lengths
+    )
+
+    for i, measurement in enumerate(MEASUREMENTS):
+        expected_uncorrected, expected_corrected = reference_q0(*measurement)
+        assert uncorrected[i] == pytest.approx(expected_uncorrected)
+        assert corrected[i] == pytest.approx(expected_corrected)
+        assert q0_utils.calc_q0(*measurement) == pytest.approx(expected_uncorrected)
+        assert q0_utils.calc_q0(*measurement, use_correction=True) == pytest.approx(
+            expected_corrected
+        )
+
+
+def test_one_length_for_every_measurement():
+    amplitudes, heat_loads, pressures, _ = zip(*MEASUREMENTS)
+    _, corrected = q0_utils.calc_q0_batch(
+        amplitudes, heat_loads, pressures, HL_CAV_LENGTH
+    )
+
+    expected = [
+        reference_q0(amplitude, heat_load, pressure, HL_CAV_LENGTH)[1]
+        for amplitude, heat_load, pressure, _ in MEASUREMENTS
+    ]
+    assert corrected == pytest.approx(expected)
@@ -0,0 +1,25 @@
+import pytest
+
+import q0_reanalysis
+import q0_utils
+
+# Roughly a harmonic linearizer cavity's active length
+HL_CAV_LENGTH = 0.346
+
+
+def test_fill_q0s_uses_the_cryomodules_cavity_length():
+    rows = [
+        {
+            "Effective Amplitude": 16.6,
+            "Calculated Adjusted Heat Load": 20.0,
+            "Average Pressure": 30.0,
+        }
+    ]
+    q0_reanalysis.fill_q0s(rows, HL_CAV_LENGTH)
+
+    assert rows[0]["Calculated Corrected Q0"] == pytest.approx(
+        q0_utils.calc_q0(16.6, 20.0, 30.0, HL_CAV_LENGTH, use_correction=True)
+    )
+    assert rows[0]["Calculated Corrected Q0"] != pytest.approx(
+        q0_utils.calc_q0(16.6, 20.0, 30.0, q0_utils.CAV_LENGTH, use_correction=True)
+    )
@@ -0,0 +1,148 @@
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import q0_catalog
+import q0_reconstruct
+import q0_utils
+from q0_archiver import LocalArchiver
+
+PVS = {
+    "ds_level_pv": "CLL:CM01:2301:DS:LVL",
+    "heater_readback_pv": "CPIC:CM01:0000:EHCV:ORBV",
+    "ds_pressure_pv": "CPT:CM01:2302:DS:PRESS",
+}
+HL_CAV_LENGTH = 0.346
+REF_HEAT = 10.0
+SLOPE = -0.004
+INTERCEPT = 0.01
+START = datetime(2022, 8, 5, 12, 0, 0)
+
+
+def window(offset_minutes: int):
+    start = START + timedelta(minutes=offset_minutes)
+    return start, start + timedelta(minutes=10)
+
+
+def record(archive: dict, offset_minutes: int, heat: float, readback: float):
+    """A run whose liquid level falls as the calibration says heat should"""
+    start, end = window(offset_minutes)
+    timestamps = np.arange(start.timestamp(), end.timestamp(), 1.0)
+    levels = 90 + (SLOPE * heat + INTERCEPT) * (timestamps - timestamps[0])
+    for pv, values in [
+        (PVS["ds_level_pv"], levels),
+        (PVS["heater_readback_pv"], np.full_like(timestamps, readback)),
+        (PVS["ds_pressure_pv"], np.full_like(timestamps, 30.0)),
+    ]:
+        old_timestamps, old_values = archive.get(pv, ([], []))
+        archive[pv] = (
+            np.concatenate([old_timestamps, timestamps]),
+            np.concatenate([old_values, values]),
+        )
+    return [time.strftime(q0_utils.DATETIME_FORMATTER) for time in (start, end)]
+
+
+@pytest.fixture
+def archive_spec(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Reconstructing cryomodules the spec has PV names for mustn't need
+    # q0_linac (or lcls_tools)
+    monkeypatch.setitem(sys.modules, "q0_linac", None)
+
+    archive = {}
+    calibration_runs = [
+        record(archive, 20 * idx, heat, REF_HEAT + heat)
+        for idx, heat in enumerate([40.0, 60.0, 80.0])
+    ]
+    heater_run = record(archive, 100, 60.0, REF_HEAT + 60.0)
+    # The RF run has the heater at its reference, so all of its heat is RF
+    rf_run = record(archive, 120, 30.0, REF_HEAT)
+
+    archiver = LocalArchiver()
+    for pv, (timestamps, values) in archive.items():
+        archiver.add(pv, timestamps, values)
+
+    calibration_time_stamp = START.strftime(q0_utils.DATETIME_FORMATTER)
+    spec = {
+        "calibrations": [
+            {
+                "cryomodule": "01",
+                "time_stamp": calibration_time_stamp,
+                "valve_params": {
+                    "refValvePos": 40.0,
+                    "refHeatLoadDes": REF_HEAT,
+                    "refHeatLoadAct": REF_HEAT,
+                },
+                "runs": calibration_runs,
+            }
+        ],
+        "q0_measurements": [
+            {
+                "cryomodule": "01",
+                "calibration": calibration_time_stamp,
+                "heater_run": heater_run,
+                "rf_run": rf_run,
+                "amplitudes": {"1": 16.0, "2": 16.0},
+            }
+        ],
+        "cryomodules": {"01": dict(PVS, cav_length=HL_CAV_LENGTH)},
+    }
+    yield spec, archiver
+    q0_catalog._connections.__dict__.get("by_file", {}).clear()
+
+
+def test_reconstructing_from_a_local_archive(archive_spec):
+    spec, archiver = archive_spec
+    q0_reconstruct.reconstruct(spec, archiver)
+
+    # Every window is close enough to the next to share one request
+    assert archiver.num_requests == 1
+
+    calibration = q0_catalog.calibrations()[0]
+    assert calibration.slope == pytest.approx(SLOPE)
+    assert calibration.adjustment == pytest.approx(INTERCEPT)
+
+    q0_measurement = q0_catalog.q0_measurements()[0]
+    assert q0_measurement.adjusted_heat_load == pytest.approx(30.0)
+    assert q0_measurement.q0 == pytest.approx(
+        q0_utils.calc_q0(
+            amplitude=q0_utils.calc_effective_amplitude({1: 16.0, 2: 16.0}),
+            rf_heat_load=30.0,
+            avg_pressure=30.0,
+            cav_length=HL_CAV_LENGTH,
+        )
+    )
+
+
+def test_heater_run_heatload_is_only_metadata(archive_spec):
+    spec, archiver = archive_spec
+    q0_reconstruct.reconstruct(spec, archiver)
+
+    q0_spec = spec["q0_measurements"][0]
+    cm = q0_reconstruct.spec_cryomodules(spec)["01"]
+    windows = [
+        q0_reconstruct.RunWindow.from_strings(q0_spec[run])
+        for run in ["heater_run", "rf_run"]
+    ]
+    data = q0_reconstruct.fetch_windows(archiver, list(PVS.values()), windows)
+    q0_measurements = [
+        q0_reconstruct.reconstruct_q0(
+            cm,
+            q0_spec["calibration"],
+            {1: 16.0, 2: 16.0},
+            windows[0],
+            data[0],
+            windows[1],
+            data[1],
+            heater_run_heatload,
+        )
+        for heater_run_heatload in [q0_utils.MINIMUM_HEATLOAD, 80.0]
+    ]
+
+    assert [
+        q0_measurement.heater_run.heat_load_des for q0_measurement in q0_measurements
+    ] == [q0_utils.MINIMUM_HEATLOAD, 80.0]
+    assert q0_measurements[0].q0 == pytest.approx(q0_measurements[1].q0)
+    assert q0_measurements[0].q0 == pytest.approx(q0_catalog.q0_measurements()[0].q0)
@@ -0,0 +1,22 @@
+import pytest
+
+pytest.importorskip("lcls_tools")
+
+from q0_linac import Q0Cryomodule, Q0CryomoduleRegistry  # noqa: E402
+
+
+def test_linac_and_machine_get_the_real_cryomodule():
+    registry = Q0CryomoduleRegistry()
+    name = next(iter(registry))
+    cryomodule = registry[name]
+
+    assert isinstance(cryomodule, Q0Cryomodule)
+    assert cryomodule.linac.cryomodules[name] is cryomodule
+    assert registry._machine.cryomodules[name] is cryomodule
+
+
+def test_cryomodules_only_get_built_when_looked_up():
+    registry = Q0CryomoduleRegistry()
+    names = list(registry)
+    registry[names[0]]
+    assert registry.built == [names[0]]
@@ -0,0 +1,72 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import q0_catalog
+import q0_session_cache
+import q0_utils
+
+TIME_STAMP = "01/02/23 03:04:05"
+
+
+def counting_kind(loads):
+    def load(cryomodule, time_stamp):
+        loads.append(time_stamp)
+        return len(loads)
+
+    return q0_session_cache.SessionKind(
+        "calibration",
+        load,
+        q0_session_cache.CALIBRATIONS.data_file,
+        q0_session_cache.CALIBRATIONS.catalog_version,
+    )
+
+
+def test_sessions_reload_when_their_catalog_row_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    record = q0_catalog.CalibrationRecord("01", TIME_STAMP, 1.0, 0.0, None)
+    q0_catalog.save_calibration(record)
+    cryomodule = SimpleNamespace(
+        name="01", _calib_data_file=q0_utils.CALIB_DATA_FILE.format(CM="01")
+    )
+    loads = []
+    kind = counting_kind(loads)
+    cache = q0_session_cache.SessionCache()
+
+    try:
+        assert cache.get(kind, cryomodule, TIME_STAMP).result() == 1
+        assert cache.get(kind, cryomodule, TIME_STAMP).result() == 1
+
+        record.slope = 2.0
+        q0_catalog.save_calibration(record)
+        assert cache.get(kind, cryomodule, TIME_STAMP).result() == 2
+    finally:
+        q0_catalog._connections.__dict__.get("by_file", {}).clear()
+
+    # Looking a session up doesn't make an empty data file for it
+    assert not os.path.exists(cryomodule._calib_data_file)
+
+
+def test_catalog_is_only_checked_on_the_pool(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cryomodule = SimpleNamespace(
+        name="01", _calib_data_file=q0_utils.CALIB_DATA_FILE.format(CM="01")
+    )
+    checked_on = []
+
+    def catalog_version(cm_name, time_stamp):
+        checked_on.append(threading.current_thread())
+        return 1
+
+    kind = q0_session_cache.SessionKind(
+        "calibration",
+        lambda cryomodule, time_stamp: time_stamp,
+        q0_session_cache.CALIBRATIONS.data_file,
+        catalog_version,
+    )
+    cache = q0_session_cache.SessionCache()
+
+    assert cache.get(kind, cryomodule, TIME_STAMP).result() == TIME_STAMP
+    assert cache.get(kind, cryomodule, TIME_STAMP).result() == TIME_STAMP
+    assert len(checked_on) == 2
+    assert threading.current_thread() not in checked_on
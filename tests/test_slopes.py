@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import q0_slopes
+
+pytest.importorskip("scipy.stats")
+
+
+def ll_trace(num_points: int, seed: int, decimals: int = None):
+    """A liquid level falling at a steady rate, with noise and a few spikes"""
+    rng = np.random.default_rng(seed)
+    x = 1.66e9 + np.cumsum(rng.uniform(0.5, 1.5, num_points))
+    y = 90 - 0.002 * (x - x[0]) + rng.normal(0, 0.05, num_points)
+    spikes = rng.choice(num_points, size=num_points // 20, replace=False)
+    y[spikes] += rng.normal(0, 2, spikes.size)
+    if decimals is not None:
+        y = np.round(y, decimals)
+    # Out of order, the way unsorted archiver data would be
+    order = rng.permutation(num_points)
+    return x[order], y[order]
+
+
+def assert_matches_scipy(x, y):
+    slope, intercept = q0_slopes.siegel_slope(x, y)
+    expected_slope, expected_intercept = q0_slopes.scipy_siegel_slope(x, y)
+    assert slope == pytest.approx(expected_slope, rel=1e-9, abs=1e-15)
+    assert intercept == pytest.approx(expected_intercept, rel=1e-9)
+
+
+@pytest.fixture
+def bracketed(monkeypatch):
+    """Fails the test if the bracketed search had to fall back to brute force"""
+    results = []
+    repeated_median = q0_slopes._repeated_median
+
+    def recording_repeated_median(x, y):
+        results.append(repeated_median(x, y))
+        return results[-1]
+
+    monkeypatch.setattr(q0_slopes, "_repeated_median", recording_repeated_median)
+    yield
+    assert results and all(result is not None for result in results)
+
+
+@pytest.mark.parametrize("num_points", [2, 3, 10, 101, 500])
+@pytest.mark.parametrize("seed", range(3))
+def test_brute_force_matches_scipy(num_points, seed):
+    assert num_points <= q0_slopes.SIEGEL_BRUTE_FORCE_LIMIT
+    assert_matches_scipy(*ll_trace(num_points, seed))
+
+
+@pytest.mark.parametrize("num_points", [501, 1000, 3000])
+@pytest.mark.parametrize("seed", range(3))
+def test_bracketed_search_matches_scipy(num_points, seed, bracketed):
+    assert_matches_scipy(*ll_trace(num_points, seed))
+
+
+@pytest.mark.parametrize("num_points", [200, 2000])
+def test_tied_values_match_scipy(num_points):
+    # Level readbacks only come with a couple of decimal places
+    x, y = ll_trace(num_points, 7, decimals=1)
+    assert np.unique(y).size < num_points / 2
+    assert_matches_scipy(x, y)
+
+
+def test_flat_trace_matches_scipy():
+    x, _ = ll_trace(1000, 8)
+    assert_matches_scipy(x, np.full_like(x, 90.0))
+
+
+@pytest.mark.parametrize("num_points", [200, 2000])
+def test_repeated_timestamps_match_scipy(num_points):
+    x, y = ll_trace(num_points, 9)
+    # Every timestamp shows up twice, as when the archiver repeats a sample
+    x = np.sort(x)
+    x[1::2] = x[::2][: x[1::2].size]
+    assert_matches_scipy(x, y)